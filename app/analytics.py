@@ -0,0 +1,162 @@
+# app/analytics.py
+# 長い期間の分析を NumPy の配列演算で行う。必要な列 (エポック時刻・アプリID・入力文字数) だけを
+# 配列として読み、行ごとの Python ループや datetime の変換を使わずに集計する。
+from __future__ import annotations
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import datetime as _dt
+import sqlite3
+
+import numpy as np
+
+from . import retention
+from .database import to_epoch_us
+from .intervals import LANE_START_SQL
+from .queries import TimeLike, as_epoch_us
+
+US_PER_SECOND = 1_000_000
+US_PER_MINUTE = 60 * US_PER_SECOND
+US_PER_HOUR = 60 * US_PER_MINUTE
+
+# 範囲に掛かるフォーカス区間を範囲で切り詰めて読む (intervals._INTERVALS_SQL の ID 版)。
+# 取り込んだ端末の区間は端末ごとにまとめて並べる (この端末の区間が先)
+_INTERVALS_SQL = f'''
+    SELECT app_id, MAX(start_ts, :start), MIN(COALESCE(end_ts, :now), :end)
+    FROM app_intervals
+    WHERE start_ts >= {LANE_START_SQL}
+      AND start_ts < :end AND (end_ts > :start OR end_ts IS NULL)
+    ORDER BY COALESCE(host_id, 0), start_ts
+'''
+# [ENTER] などの特殊キーは文字数に含めない (rollups.counts_as_keystrokes と同じ)
+_KEYSTROKES_SQL = '''
+    SELECT ts, length(content) FROM {db}.logs
+    WHERE event_type = 'KEYSTROKE' AND ts >= ? AND ts < ? AND substr(content, 1, 1) <> '['
+    ORDER BY ts
+'''
+_HOURLY_SQL = "SELECT day, hour, keystrokes FROM rollup_hourly WHERE day >= ? AND day <= ? ORDER BY day, hour"
+_KEY_DTYPE = [('ts', '<i8'), ('chars', '<i4')]
+
+
+class ActivityArrays(NamedTuple):
+    """[start_us, end_us) の分析用の列。区間は端末ごとに開始順、入力は時刻順。"""
+    start_us: int
+    end_us: int
+    app_names: List[str]             # interval_app の値 → アプリ名
+    interval_app: np.ndarray         # int32
+    interval_start: np.ndarray       # int64 エポックマイクロ秒
+    interval_end: np.ndarray         # int64 エポックマイクロ秒
+    key_ts: np.ndarray               # int64 エポックマイクロ秒
+    key_chars: np.ndarray            # int32 入力文字数
+
+
+def load(conn: sqlite3.Connection, start: TimeLike, end: TimeLike, now: Optional[TimeLike] = None,
+         raw_keystrokes: bool = False) -> ActivityArrays:
+    """[start, end) のフォーカス区間と入力を配列として読む。開いている区間は now (既定は現在) まで。
+
+    入力は既定では rollup_hourly の1時間ごとの文字数を、その時の開始時刻の行として読む
+    (1年分でも1万行未満)。raw_keystrokes=True なら入力1件ずつの行を読むので、1時間より
+    細かい typing_rate() に使えるが、長い期間では読み込みに時間がかかる。
+    """
+    start_us, end_us = as_epoch_us(start), as_epoch_us(end)
+    now_us = as_epoch_us(now) if now is not None else to_epoch_us(_dt.datetime.now())
+    params = {'start': start_us, 'end': end_us, 'now': now_us}
+    intervals = np.fromiter(conn.execute(_INTERVALS_SQL, params),
+                            dtype=[('app', '<i8'), ('start', '<i8'), ('end', '<i8')])
+    intervals = intervals[intervals['end'] > intervals['start']]
+    # アプリIDを 0 から詰めた番号にして、bincount の添字に使う
+    app_ids, interval_app = np.unique(intervals['app'], return_inverse=True)
+    names = dict(conn.execute("SELECT id, name FROM apps"))
+
+    keys = _load_raw_keystrokes(conn, start_us, end_us) if raw_keystrokes else _load_hourly_keystrokes(conn, start_us, end_us)
+    return ActivityArrays(start_us, end_us, [names.get(int(app_id), str(app_id)) for app_id in app_ids],
+                          interval_app.astype(np.int32), intervals['start'], intervals['end'],
+                          np.ascontiguousarray(keys['ts']), np.ascontiguousarray(keys['chars']))
+
+
+def _load_raw_keystrokes(conn: sqlite3.Connection, start_us: int, end_us: int) -> np.ndarray:
+    chunks = [np.fromiter(conn.execute(_KEYSTROKES_SQL.format(db=db), (start_us, end_us)), dtype=_KEY_DTYPE)
+              for db in retention.sources(conn, start_us, end_us)]
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype=_KEY_DTYPE)
+
+
+def _load_hourly_keystrokes(conn: sqlite3.Connection, start_us: int, end_us: int) -> np.ndarray:
+    # 集計テーブルはアーカイブ済みの日も持っているので、本体だけから読めばよい
+    midnights, _ = _local_days(start_us, end_us)
+    first = _dt.datetime.fromtimestamp(int(midnights[0]) / US_PER_SECOND).date()
+    rows = np.fromiter(conn.execute(_HOURLY_SQL, (first.isoformat(), (first + _dt.timedelta(days=len(midnights) - 1)).isoformat())),
+                       dtype=[('day', 'U10'), ('hour', '<i8'), ('chars', '<i4')])
+    # 'YYYY-MM-DD' を範囲の最初の日からの日数にして、その日の0時 + 時 にする
+    offsets = (rows['day'].astype('datetime64[D]') - np.datetime64(first, 'D')).astype(np.int64)
+    keys = np.empty(len(rows), dtype=_KEY_DTYPE)
+    keys['ts'] = midnights[offsets] + rows['hour'] * US_PER_HOUR
+    keys['chars'] = rows['chars']
+    return keys[(keys['ts'] >= start_us) & (keys['ts'] < end_us)]
+
+
+def app_seconds(data: ActivityArrays) -> Dict[str, float]:
+    """アプリ別のフォーカス秒数。
+
+    切り替えイベントの時刻の差 (np.diff) ではなく app_intervals の区間の長さを足す。
+    時刻の差では一時停止や記録を止めていた時間までアプリに数えてしまうため。
+    """
+    totals = np.bincount(data.interval_app, weights=data.interval_end - data.interval_start,
+                         minlength=len(data.app_names)) / US_PER_SECOND
+    return {name: float(seconds) for name, seconds in zip(data.app_names, totals) if seconds > 0}
+
+
+def _local_days(start_us: int, end_us: int) -> Tuple[np.ndarray, np.ndarray]:
+    # 範囲に掛かるローカル日付の0時 (エポックマイクロ秒) と曜日 (月曜=0)。
+    # 日ごとに求めるので、夏時間の切り替わりがあっても時刻の変換が正しい
+    first = _dt.datetime.fromtimestamp(start_us / US_PER_SECOND).date()
+    last = _dt.datetime.fromtimestamp(max(start_us, end_us - 1) / US_PER_SECOND).date()
+    days = [first + _dt.timedelta(days=i) for i in range((last - first).days + 1)]
+    midnights = np.array([to_epoch_us(_dt.datetime.combine(day, _dt.time())) for day in days], dtype=np.int64)
+    return midnights, np.array([day.weekday() for day in days], dtype=np.int8)
+
+
+def local_hour_and_weekday(ts: np.ndarray, start_us: int, end_us: int) -> Tuple[np.ndarray, np.ndarray]:
+    """エポックマイクロ秒の配列を、ローカル時刻の時 (0〜23) と曜日 (月曜=0) の配列にする。"""
+    midnights, weekdays = _local_days(start_us, end_us)
+    day = np.clip(np.searchsorted(midnights, ts, side='right') - 1, 0, len(midnights) - 1)
+    hour = np.clip((ts - midnights[day]) // US_PER_HOUR, 0, 23)
+    return hour.astype(np.int8), weekdays[day]
+
+
+def hour_of_week(data: ActivityArrays) -> np.ndarray:
+    """曜日 × 時 (7 × 24) ごとの入力文字数。行が月曜。"""
+    hour, weekday = local_hour_and_weekday(data.key_ts, data.start_us, data.end_us)
+    cells = weekday.astype(np.int32) * 24 + hour
+    return np.bincount(cells, weights=data.key_chars, minlength=7 * 24).reshape(7, 24)
+
+
+def typing_rate(data: ActivityArrays, bin_us: int = US_PER_HOUR) -> Tuple[np.ndarray, np.ndarray]:
+    """bin_us ごとの (区切りの開始時刻, 1分あたりの入力文字数) の時系列。"""
+    bins = max(1, -(-(data.end_us - data.start_us) // bin_us))
+    index = (data.key_ts - data.start_us) // bin_us
+    chars = np.bincount(index, weights=data.key_chars, minlength=bins)[:bins]
+    starts = data.start_us + np.arange(bins, dtype=np.int64) * bin_us
+    return starts, chars * (US_PER_MINUTE / bin_us)
+
+
+def focus_sessions(data: ActivityArrays, max_gap_us: int = 0) -> np.ndarray:
+    """同じアプリが続いた区間をまとめたセッションの長さ (秒) を開始順に返す。
+
+    隣り合う区間が同じアプリで、間が max_gap_us 以下ならひと続きとみなす
+    (一時停止をはさんでも同じアプリならつなげたいときに間を指定する)。
+    """
+    if not len(data.interval_app):
+        return np.empty(0)
+    gaps = data.interval_start[1:] - data.interval_end[:-1]
+    # アプリが変わったか、間が空いたところでセッションを区切る。
+    # 1台の区間は重ならないので、間が負なら次の端末の区間に移ったところ
+    breaks = (np.diff(data.interval_app) != 0) | (gaps > max_gap_us) | (gaps < 0)
+    first = np.concatenate(([0], np.flatnonzero(breaks) + 1))
+    # 間の時間は含めず、セッション内の区間の長さだけを足す
+    return np.add.reduceat(data.interval_end - data.interval_start, first) / US_PER_SECOND
+
+
+def session_histogram(lengths: np.ndarray, edges_s: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """セッションの長さの分布 (件数, 区切り秒)。既定の区切りは1分〜8時間の対数間隔。"""
+    if edges_s is None:
+        edges_s = np.concatenate(([0], np.geomspace(60, 8 * 3600, 12), [np.inf]))
+    counts, edges = np.histogram(lengths, bins=edges_s)
+    return counts, edges
@@ -0,0 +1,585 @@
+# app/benchmarks.py
+# 性能確認用のマイクロベンチマーク。python -m app.benchmarks [名前 ...] で実行する。
+from __future__ import annotations
+from typing import Callable, Dict
+import argparse
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARKS: Dict[str, Callable[..., dict]] = {}
+_app = None
+
+
+def benchmark(name: str):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def _qt_app():
+    # GUI を表示しない環境でも動くように offscreen プラットフォームを使う
+    global _app
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    _app = QApplication.instance() or QApplication(sys.argv[:1])
+    return _app
+
+
+@benchmark('live_log')
+def bench_live_log(events: int = 20000, events_per_frame: int = 50) -> dict:
+    """Live Log 1イベントあたりの GUI スレッド時間: 逐次挿入+flush付き print と、まとめて反映するシンクの比較。"""
+    _qt_app()
+    from PyQt5.QtWidgets import QTextEdit
+    from .log_sink import CoalescingLogSink, ConsoleLogHandler
+
+    chunks = [f"chunk{i % 97} " for i in range(events)]
+
+    edit = QTextEdit(); stream = io.StringIO()
+    start = time.perf_counter()
+    for text in chunks:
+        edit.moveCursor(edit.textCursor().End)
+        edit.insertPlainText(text)
+        print(text, end='', file=stream, flush=True)
+    per_event_us = (time.perf_counter() - start) / events * 1e6
+
+    edit = QTextEdit(); stream = io.StringIO()
+    def insert(text):
+        edit.moveCursor(edit.textCursor().End)
+        edit.insertPlainText(text)
+    sink = CoalescingLogSink()
+    sink.add_output(insert); sink.add_output(ConsoleLogHandler(stream))
+    start = time.perf_counter()
+    for i, text in enumerate(chunks, start=1):
+        sink.append(text)
+        # events_per_frame 件ごとにフレームのタイマーが発火したものとして反映する
+        if i % events_per_frame == 0:
+            sink.flush()
+    sink.flush()
+    coalesced_us = (time.perf_counter() - start) / events * 1e6
+
+    return {'events': events, 'per_event_us': round(per_event_us, 2),
+            'coalesced_us': round(coalesced_us, 2), 'speedup': round(per_event_us / coalesced_us, 1)}
+
+
+@benchmark('chart')
+def bench_chart(refreshes: int = 30, apps: int = 12) -> dict:
+    """ダッシュボードのグラフ更新: 毎回 setHtml でページを作り直す方式と、runJavaScript で差し替える方式の比較。"""
+    os.environ.setdefault('QTWEBENGINE_DISABLE_SANDBOX', '1')
+    from PyQt5.QtCore import QEventLoop, QUrl, QTimer
+    from PyQt5.QtWebEngineWidgets import QWebEngineView
+    _qt_app()
+    from .chart import CHART_PAGE, chart_update_script
+    from .utils import resource_path
+
+    page_path = resource_path(CHART_PAGE)
+    base_url = QUrl.fromLocalFile(page_path)
+    with open(page_path, 'r', encoding='utf-8') as f:
+        page_html = f.read()
+    durations = [{f"App {n}": float((n + 1) * (i + 1)) for n in range(apps)} for i in range(refreshes)]
+
+    def wait(connect) -> None:
+        loop = QEventLoop()
+        connect(loop.quit)
+        QTimer.singleShot(10000, loop.quit)
+        loop.exec_()
+
+    # 従来方式: 更新のたびに HTML 全体を読み込み直し、Chart.js も毎回パースされる
+    view = QWebEngineView()
+    start = time.perf_counter()
+    for app_durations in durations:
+        html = page_html.replace('</body>', f"<script>{chart_update_script(app_durations)}</script></body>")
+        view.setHtml(html, base_url)
+        wait(lambda done: view.loadFinished.connect(lambda ok: done()))
+    reload_ms = (time.perf_counter() - start) / refreshes * 1000
+
+    # 新方式: ページは1回だけ読み込み、データだけを送る
+    view = QWebEngineView()
+    view.load(base_url)
+    wait(lambda done: view.loadFinished.connect(lambda ok: done()))
+    start = time.perf_counter()
+    for app_durations in durations:
+        wait(lambda done: view.page().runJavaScript(chart_update_script(app_durations), lambda result: done()))
+    incremental_ms = (time.perf_counter() - start) / refreshes * 1000
+
+    return {'refreshes': refreshes, 'reload_ms': round(reload_ms, 2), 'incremental_ms': round(incremental_ms, 2),
+            'speedup': round(reload_ms / incremental_ms, 1)}
+
+
+@benchmark('pipeline')
+def bench_pipeline(events: int = 200000, batch_size: int = 500, capacity: int = 8192,
+                   source: str = 'synthetic', path: str = '') -> dict:
+    """キャプチャスレッド → チャンク化 → DB ライターまでを Qt なしで流したときのスループット。"""
+    from .capture import CaptureThread, KeystrokeChunker
+    from .database import DatabaseManager
+    from .sources import create_source
+
+    if source == 'replay':
+        capture_source = create_source('replay', path=path, speed=0)
+    else:
+        capture_source = create_source('synthetic', keys_per_second=0, max_events=events, seed=1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_manager = DatabaseManager(os.path.join(tmp, "bench.db"), batch_size=batch_size, queue_size=1_000_000)
+        db_manager.ready.wait()
+        gui_chars = 0
+        def on_gui(text):
+            nonlocal gui_chars
+            gui_chars += len(text)
+        chunker = KeystrokeChunker(db_manager.add_log_entry, on_gui)
+        pending = threading.Event()
+        capture = CaptureThread(capture_source, pending.set, capacity)
+
+        start = time.perf_counter()
+        capture_source.open(capture.emit, capture.post)
+        capture.start()
+        raw = 0
+        while capture.is_alive() or len(capture.ring):
+            pending.wait(0.05); pending.clear()
+            for kind, first, second in capture.drain():
+                chunker.feed(kind, first, second); raw += 1
+        chunker.flush()
+        captured = time.perf_counter() - start
+        capture_stats = capture.stats()
+        db_manager.flush()
+        elapsed = time.perf_counter() - start
+        stats = db_manager.writer_stats()
+        db_manager.close()
+
+    return {'raw_events': raw, 'rows': stats['committed'], 'dropped': stats['dropped'] + capture_stats['dropped'],
+            'capture_events_per_s': int(raw / captured), 'end_to_end_events_per_s': int(raw / elapsed),
+            'emit_p50_us': capture_stats['p50_us'], 'emit_p99_us': capture_stats['p99_us'],
+            'emit_max_us': capture_stats['max_us']}
+
+
+@benchmark('background_memory')
+def bench_background_memory(events: int = 20000, chunk: int = 200) -> dict:
+    """Live Log に events 行溜めた状態からバックグラウンドモードに入ったときの RSS の変化。"""
+    _qt_app()
+    from PyQt5.QtWidgets import QApplication
+    from .config import ConfigManager
+    from .database import DatabaseManager
+    from .event_monitor import EventTapManager
+    from .main_window import AppWindow
+    from .profiling import resident_memory_bytes
+    from .sources import create_source
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_manager = DatabaseManager(os.path.join(tmp, "bench.db"), queue_size=events + 1)
+        config_manager = ConfigManager(os.path.join(tmp, "config.json"))
+        config_manager.save({**config_manager.defaults, 'console_log': False})
+        window = AppWindow(db_manager, config_manager, EventTapManager(create_source('synthetic')))
+        window.switch_view(1)
+        baseline = resident_memory_bytes()
+        text = "x" * chunk
+        for _ in range(events):
+            window.record_log_event('KEYSTROKE', text)
+        window.flush_log_output()
+        filled = resident_memory_bytes()
+        window.enter_background_mode()
+        for _ in range(3):
+            QApplication.processEvents()
+        released = resident_memory_bytes()
+        window.deleteLater(); db_manager.close()
+
+    mb = 1024 * 1024
+    return {'events': events, 'baseline_mb': round(baseline / mb, 1), 'filled_mb': round(filled / mb, 1),
+            'background_mb': round(released / mb, 1)}
+
+
+@benchmark('storage')
+def bench_storage(events: int = 1000000, apps: int = 40, repeat: int = 5) -> dict:
+    """従来の logs テーブルと、辞書テーブルで正規化した events のファイルサイズとアプリ別集計の速さの比較。"""
+    import datetime as _dt
+    import random
+    import shutil
+    import sqlite3
+    from . import schema, storage
+
+    # 切り替え1回あたりの秒数と、アプリ別の合計を出す2種類の集計
+    legacy_sql = (
+        "SELECT content, COUNT(*) FROM logs WHERE event_type = 'APP_SWITCH' GROUP BY content",
+        '''SELECT app, SUM(end_ts - ts) FROM (
+               SELECT content AS app, ts, LEAD(ts) OVER (ORDER BY ts) AS end_ts
+               FROM logs WHERE event_type = 'APP_SWITCH') GROUP BY app''',
+    )
+    normalized_sql = (
+        '''SELECT a.name, n FROM (
+               SELECT app_id, COUNT(*) AS n FROM events
+               WHERE type_id = (SELECT id FROM event_types WHERE name = 'APP_SWITCH') GROUP BY app_id
+           ) JOIN apps a ON a.id = app_id''',
+        '''SELECT a.name, us FROM (
+               SELECT app_id, SUM(end_ts - ts) AS us FROM (
+                   SELECT app_id, ts, LEAD(ts) OVER (ORDER BY ts) AS end_ts FROM events
+                   WHERE type_id = (SELECT id FROM event_types WHERE name = 'APP_SWITCH'))
+               GROUP BY app_id
+           ) JOIN apps a ON a.id = app_id''',
+    )
+
+    def best_ms(conn, queries):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results = [sorted(conn.execute(sql).fetchall()) for sql in queries]
+            timings.append((time.perf_counter() - start) * 1000)
+        return min(timings), results
+
+    rng = random.Random(1)
+    names = [f"Application {i} — アプリ" for i in range(apps)]
+    moment = _dt.datetime(2025, 1, 1)
+    rows = []
+    for _ in range(events):
+        moment += _dt.timedelta(microseconds=rng.randrange(1, 4_000_000))
+        if rng.random() < 0.1:
+            event_type, content = 'APP_SWITCH', rng.choice(names)
+        else:
+            event_type, content = 'KEYSTROKE', rng.choice(("hello ", "[ENTER]", "def main():", "テスト"))
+        rows.append((moment.isoformat(), int(moment.timestamp() * 1_000_000), event_type, content))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path, normalized_path = os.path.join(tmp, "legacy.db"), os.path.join(tmp, "normalized.db")
+        conn = sqlite3.connect(legacy_path)
+        schema.migrate(conn, target_version=2)
+        with conn:
+            conn.executemany("INSERT INTO logs (timestamp, ts, event_type, content) VALUES (?, ?, ?, ?)", rows)
+        conn.execute("VACUUM"); conn.close()
+        del rows
+        shutil.copyfile(legacy_path, normalized_path)
+        conn = sqlite3.connect(normalized_path)
+        storage.migrate_logs(conn)
+        conn.execute("VACUUM"); conn.close()
+
+        legacy, normalized = sqlite3.connect(legacy_path), sqlite3.connect(normalized_path)
+        legacy_ms, legacy_results = best_ms(legacy, legacy_sql)
+        normalized_ms, normalized_results = best_ms(normalized, normalized_sql)
+        legacy.close(); normalized.close()
+        legacy_bytes, normalized_bytes = os.path.getsize(legacy_path), os.path.getsize(normalized_path)
+
+    mb = 1024 * 1024
+    return {'events': events, 'legacy_mb': round(legacy_bytes / mb, 1), 'normalized_mb': round(normalized_bytes / mb, 1),
+            'size_reduction_pct': round((1 - normalized_bytes / legacy_bytes) * 100, 1),
+            'legacy_group_by_ms': round(legacy_ms, 1), 'normalized_group_by_ms': round(normalized_ms, 1),
+            'speedup': round(legacy_ms / normalized_ms, 1), 'same_results': legacy_results == normalized_results}
+
+
+@benchmark('analytics')
+def bench_analytics(days: int = 365, keys_per_day: int = 3000, switches_per_day: int = 300) -> dict:
+    """1年分の履歴の分析: 行ごとに fromisoformat する従来のループと、analytics の配列演算の比較。"""
+    import datetime as _dt
+    import random
+    import sqlite3
+    from collections import defaultdict
+    import numpy as np
+    from . import analytics, intervals, rollups, schema
+    from .database import to_epoch_us
+
+    rng = random.Random(1)
+    end = _dt.datetime.combine(_dt.date.today(), _dt.time())
+    start = end - _dt.timedelta(days=days)
+    start_us, end_us = to_epoch_us(start), to_epoch_us(end)
+    apps = [f"Application {i}" for i in range(30)]
+    texts = ("hello ", "[ENTER]", "def main():", "テスト", "[BACKSPACE]", "SELECT * FROM logs")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+        schema.migrate(conn)
+        with conn:
+            conn.executemany("INSERT INTO event_types (id, name) VALUES (?, ?)", [(1, 'APP_SWITCH'), (2, 'KEYSTROKE'), (3, 'SYSTEM')])
+            conn.executemany("INSERT INTO apps (id, name) VALUES (?, ?)", list(enumerate(apps, start=1)))
+            span = end_us - start_us
+            rows = [(start_us + rng.randrange(span), 1, rng.randrange(1, len(apps) + 1), None) for _ in range(days * switches_per_day)]
+            rows += [(start_us + rng.randrange(span), 2, None, rng.choice(texts)) for _ in range(days * keys_per_day)]
+            rows.sort()
+            conn.executemany("INSERT INTO events (ts, type_id, app_id, content) VALUES (?, ?, ?, ?)", rows)
+            del rows
+            intervals.rebuild(conn)
+            rollups.rebuild(conn)
+
+        # 従来のダッシュボードと同じく、行ごとに timestamp を datetime にして Python で足し込む
+        start_loop = time.perf_counter()
+        switches = conn.execute("SELECT timestamp, content FROM logs WHERE event_type = 'APP_SWITCH' AND ts >= ? AND ts < ? ORDER BY ts",
+                                (start_us, end_us)).fetchall()
+        loop_seconds = defaultdict(float)
+        for (begin, app), (finish, _) in zip(switches, switches[1:]):
+            loop_seconds[app] += (_dt.datetime.fromisoformat(finish) - _dt.datetime.fromisoformat(begin)).total_seconds()
+        loop_seconds[switches[-1][1]] += (end - _dt.datetime.fromisoformat(switches[-1][0])).total_seconds()
+        heatmap = [[0] * 24 for _ in range(7)]; hourly = defaultdict(int)
+        for timestamp, content in conn.execute("SELECT timestamp, content FROM logs WHERE event_type = 'KEYSTROKE' AND ts >= ? AND ts < ?",
+                                               (start_us, end_us)):
+            if not content.startswith('['):
+                moment = _dt.datetime.fromisoformat(timestamp)
+                heatmap[moment.weekday()][moment.hour] += len(content)
+                hourly[moment.replace(minute=0, second=0, microsecond=0)] += len(content)
+        sessions, current, length = [], None, 0.0
+        for (begin, app), (finish, _) in zip(switches, switches[1:]):
+            duration = (_dt.datetime.fromisoformat(finish) - _dt.datetime.fromisoformat(begin)).total_seconds()
+            if app != current and current is not None:
+                sessions.append(length); length = 0.0
+            current = app; length += duration
+        loop_ms = (time.perf_counter() - start_loop) * 1000
+
+        start_load = time.perf_counter()
+        data = analytics.load(conn, start_us, end_us, now=end_us)
+        load_ms = (time.perf_counter() - start_load) * 1000
+        start_compute = time.perf_counter()
+        seconds = analytics.app_seconds(data)
+        grid = analytics.hour_of_week(data)
+        rate = analytics.typing_rate(data)[1]
+        analytics.session_histogram(analytics.focus_sessions(data))
+        compute_ms = (time.perf_counter() - start_compute) * 1000
+        conn.close()
+
+    vectorized_ms = load_ms + compute_ms
+    return {'events': days * (keys_per_day + switches_per_day), 'loop_ms': round(loop_ms, 1),
+            'load_ms': round(load_ms, 1), 'compute_ms': round(compute_ms, 1),
+            'speedup': round(loop_ms / vectorized_ms, 1),
+            'same_heatmap': bool((grid == np.array(heatmap)).all()),
+            'same_typing_rate': sorted(hourly.values()) == sorted(round(chars) for chars in rate * 60 if chars),
+            'same_app_seconds': all(abs(seconds.get(app, 0) - value) < 1 for app, value in loop_seconds.items())}
+
+
+@benchmark('dashboard_range')
+def bench_dashboard_range(days: int = 365, keys_per_day: int = 3000, switches_per_day: int = 300, repeat: int = 5) -> dict:
+    """期間ダッシュボード: 1時間ごとの集計から作る今日と12か月の表示時間と、生ログを数え直す場合の比較。"""
+    import datetime as _dt
+    import random
+    import sqlite3
+    from . import intervals, queries, rollups, schema
+    from .database import to_epoch_us
+
+    rng = random.Random(1)
+    today = _dt.date.today()
+    end = _dt.datetime.combine(today, _dt.time())
+    start = end - _dt.timedelta(days=days)
+    start_us, end_us = to_epoch_us(start), to_epoch_us(end)
+    apps = [f"Application {i}" for i in range(30)]
+    texts = ("hello ", "[ENTER]", "def main():", "テスト", "[BACKSPACE]")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+        schema.migrate(conn)
+        with conn:
+            conn.executemany("INSERT INTO event_types (id, name) VALUES (?, ?)", [(1, 'APP_SWITCH'), (2, 'KEYSTROKE')])
+            conn.executemany("INSERT INTO apps (id, name) VALUES (?, ?)", list(enumerate(apps, start=1)))
+            span = end_us - start_us
+            rows = [(start_us + rng.randrange(span), 1, rng.randrange(1, len(apps) + 1), None) for _ in range(days * switches_per_day)]
+            rows += [(start_us + rng.randrange(span), 2, None, rng.choice(texts)) for _ in range(days * keys_per_day)]
+            rows.sort()
+            conn.executemany("INSERT INTO events (ts, type_id, app_id, content) VALUES (?, ?, ?, ?)", rows)
+            del rows
+            intervals.rebuild(conn)
+            rollups.rebuild(conn)
+
+        def timed(func) -> tuple:
+            best = float('inf')
+            for _ in range(repeat):
+                begin = time.perf_counter(); result = func(); best = min(best, time.perf_counter() - begin)
+            return best * 1000, result
+
+        now = end
+        year_start, year_end = today - _dt.timedelta(days=days), today
+        day_ms, _ = timed(lambda: queries.range_summary(conn, year_end - _dt.timedelta(days=1), year_end, now=now))
+        year_ms, summary = timed(lambda: queries.range_summary(conn, year_start, year_end, now=now))
+        # 同じ合計を生ログとフォーカス区間から数え直す
+        raw_ms, (raw_keys, raw_seconds) = timed(lambda: (queries.keystroke_count(conn, year_start, year_end),
+                                                         intervals.app_seconds(conn, start_us, end_us, end_us)))
+        conn.close()
+
+    return {'events': days * (keys_per_day + switches_per_day), 'buckets': len(summary.buckets),
+            'today_ms': round(day_ms, 2), 'year_ms': round(year_ms, 2), 'raw_year_ms': round(raw_ms, 1),
+            'same_keystrokes': summary.total_keys == raw_keys,
+            'same_app_seconds': all(abs(summary.app_durations.get(app, 0) - value) < 1e-3 for app, value in raw_seconds.items())}
+
+
+@benchmark('merge')
+def bench_merge(hosts: int = 3, events: int = 300000, new_events: int = 3000) -> dict:
+    """複数端末の取り込み: 初回の一括コピー、同じファイルの取り込み直し、新しい行だけの追加の時間と、集計の正しさ。"""
+    import random
+    import sqlite3
+    from . import intervals, merge, rollups, schema
+
+    rng = random.Random(1)
+    apps = [f"Application {i}" for i in range(30)]
+    texts = ("hello ", "[ENTER]", "def main():", "テスト", "[BACKSPACE]")
+    start_us = int((time.time() - 90 * 86400) * 1_000_000)
+
+    def add_events(conn, count: int, first_us: int) -> int:
+        ts, rows = first_us, []
+        for _ in range(count):
+            ts += rng.randrange(1, 20_000_000)
+            if rng.random() < 0.1:
+                rows.append((ts, 1, rng.randrange(1, len(apps) + 1), None))
+            else:
+                rows.append((ts, 2, None, rng.choice(texts)))
+        with conn:
+            conn.executemany("INSERT INTO events (ts, type_id, app_id, content) VALUES (?, ?, ?, ?)", rows)
+        return ts
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths, last_us = [], 0
+        for i in range(hosts):
+            paths.append(os.path.join(tmp, f"host{i}.db"))
+            source = sqlite3.connect(paths[-1])
+            schema.migrate(source)
+            with source:
+                source.executemany("INSERT INTO event_types (id, name) VALUES (?, ?)", [(1, 'APP_SWITCH'), (2, 'KEYSTROKE')])
+                source.executemany("INSERT INTO apps (id, name) VALUES (?, ?)", list(enumerate(apps, start=1)))
+            last_us = add_events(source, events, start_us)
+            source.close()
+
+        conn = sqlite3.connect(os.path.join(tmp, "merged.db"))
+        schema.migrate(conn)
+        begin = time.perf_counter()
+        rows = sum(merge.merge(conn, path).rows for path in paths)
+        first_s = time.perf_counter() - begin
+        begin = time.perf_counter()
+        again = sum(merge.merge(conn, path).rows for path in paths)
+        again_ms = (time.perf_counter() - begin) * 1000
+        source = sqlite3.connect(paths[0])
+        add_events(source, new_events, last_us)
+        source.close()
+        begin = time.perf_counter()
+        added = merge.merge(conn, paths[0]).rows
+        added_ms = (time.perf_counter() - begin) * 1000
+
+        # 差分で更新した区間と集計が、全部を作り直したものと同じか
+        def snapshot():
+            return (conn.execute("SELECT COUNT(*), SUM(end_ts - start_ts) FROM app_intervals").fetchone(),
+                    rollups.snapshot(conn, rollups.ROLLUP_TABLES + intervals.ROLLUP_TABLES))
+        before = snapshot()
+        with conn:
+            rollups.rebuild(conn)
+            intervals.rebuild(conn)
+        after = snapshot()
+        conn.close()
+
+    return {'rows': rows, 'first_s': round(first_s, 2), 'rows_per_s': round(rows / first_s),
+            'remerged_rows': again, 'remerge_ms': round(again_ms, 1), 'added_rows': added, 'add_ms': round(added_ms, 1),
+            'same_as_rebuild': before[0] == after[0] and not rollups.diff(before[1], after[1])}
+
+
+@benchmark('query_server')
+def bench_query_server(days: int = 90, keys_per_day: int = 3000, switches_per_day: int = 300, requests: int = 200) -> dict:
+    """クエリサーバー: Unix ソケット越しの1リクエストの時間を、キャッシュなしとありで比べる。書き込み後に新しい値を返すかも確かめる。"""
+    import datetime as _dt
+    import http.client
+    import json
+    import random
+    import socket
+    from . import intervals, rollups
+    from .database import DatabaseManager, to_epoch_us
+    from .server import QueryServer
+
+    class UnixConnection(http.client.HTTPConnection):
+        def __init__(self, path):
+            super().__init__('localhost'); self.path = path
+
+        def connect(self):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM); self.sock.connect(self.path)
+
+    rng = random.Random(1)
+    end_us = to_epoch_us(_dt.datetime.now())
+    start_us = end_us - days * 86400 * 1_000_000
+    apps = [f"Application {i}" for i in range(30)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_manager = DatabaseManager(os.path.join(tmp, "bench.db"), write_behind=False)
+        conn = db_manager.conn
+        with conn:
+            conn.executemany("INSERT INTO event_types (id, name) VALUES (?, ?)", [(1, 'APP_SWITCH'), (2, 'KEYSTROKE')])
+            conn.executemany("INSERT INTO apps (id, name) VALUES (?, ?)", list(enumerate(apps, start=1)))
+            span = end_us - start_us
+            rows = [(start_us + rng.randrange(span), 1, rng.randrange(1, len(apps) + 1), None) for _ in range(days * switches_per_day)]
+            rows += [(start_us + rng.randrange(span), 2, None, "hello ") for _ in range(days * keys_per_day)]
+            rows.sort()
+            conn.executemany("INSERT INTO events (ts, type_id, app_id, content) VALUES (?, ?, ?, ?)", rows)
+            del rows
+            intervals.rebuild(conn)
+            rollups.rebuild(conn)
+        db_manager.last_row_id = conn.execute("SELECT MAX(id) FROM events").fetchone()[0]
+
+        def get(path: str, socket_path: str) -> dict:
+            client = UnixConnection(socket_path)
+            client.request('GET', path)
+            body = client.getresponse().read()
+            client.close()
+            return json.loads(body)
+
+        paths = ('/current', '/today', '/range?range=month', '/events?limit=50')
+        results = {}
+        for name, ttl in (('uncached', 0), ('cached', 60)):
+            socket_path = os.path.join(tmp, f"{name}.sock")
+            server = QueryServer(db_manager, socket_path, ttl=ttl)
+            server.start()
+            begin = time.perf_counter()
+            for i in range(requests):
+                get(paths[i % len(paths)], socket_path)
+            results[name] = (time.perf_counter() - begin) / requests * 1000
+            if ttl:
+                keys = get('/today', socket_path)['keystrokes']
+                db_manager.add_log_entry('KEYSTROKE', 'abc')
+                fresh = get('/today', socket_path)['keystrokes'] == keys + 3
+                stats = server.cache.stats()
+            server.close()
+        db_manager.close()
+
+    return {'events': days * (keys_per_day + switches_per_day), 'uncached_ms': round(results['uncached'], 2),
+            'cached_ms': round(results['cached'], 2), 'hits': stats['hits'], 'misses': stats['misses'],
+            'fresh_after_write': fresh}
+
+
+def run(names=None, **params) -> Dict[str, dict]:
+    results = {}
+    for name in names or BENCHMARKS:
+        func = BENCHMARKS[name]
+        accepted = func.__code__.co_varnames[:func.__code__.co_argcount]
+        try:
+            results[name] = func(**{key: value for key, value in params.items() if key in accepted})
+        except ImportError as e:
+            # PyQt5 や QtWebEngine がない環境ではそのベンチマークだけ飛ばす
+            results[name] = {'skipped': str(e)}
+        except Exception as e:
+            # 1つが失敗しても残りは実行し、終了コードで知らせる
+            results[name] = {'error': f"{type(e).__name__}: {e}"}
+    return results
+
+
+def failed(result: dict) -> bool:
+    """エラーで終わったか、same_results などの正しさの確認が False になった結果か。"""
+    return 'error' in result or any(value is False for value in result.values())
+
+
+def _parse_param(text: str) -> tuple:
+    key, _, value = text.partition('=')
+    for convert in (int, float):
+        try:
+            return key, convert(value)
+        except ValueError:
+            pass
+    return key, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run Activity Logger micro-benchmarks.")
+    parser.add_argument('names', nargs='*', help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument('-p', '--param', action='append', default=[], metavar='NAME=VALUE',
+                        help="override a benchmark parameter, e.g. -p events=1000000")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+    status = 0
+    for name, result in run(args.names, **dict(map(_parse_param, args.param))).items():
+        metrics = "  ".join(f"{key}={value}" for key, value in result.items())
+        print(f"{name}: {metrics}")
+        if failed(result):
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
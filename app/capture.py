@@ -0,0 +1,217 @@
+# app/capture.py
+# キャプチャ元を専用スレッドで動かし、スレッドセーフなキューで Qt 側に受け渡す仕組み。
+# Quartz などのプラットフォーム固有のモジュールには依存しない。
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from typing import Callable, List, Tuple
+import datetime as _dt
+import queue
+import threading
+import time
+
+from .handoff import LatencyHistogram, SPSCRingBuffer
+
+# キャプチャ元が送る生イベントの種別
+KEY = 'KEY'    # (keycode: int, text: str)
+APP = 'APP'    # (app_name: str, None)
+
+RawEvent = Tuple[str, object, object]
+Emit = Callable[..., None]
+
+# macOS の仮想キーコード
+KEYCODE_RETURN = 36
+KEYCODE_ENTER = 76
+KEYCODE_ENTER_POWERBOOK = 52
+KEYCODE_DELETE = 51
+KEYCODE_SPACE = 49
+ENTER_KEYCODES = (KEYCODE_RETURN, KEYCODE_ENTER, KEYCODE_ENTER_POWERBOOK)
+
+
+class CaptureSource(ABC):
+    """キャプチャ元の共通インターフェース。
+
+    open() は呼び出し元のスレッドで権限確認などの準備を行い、run() はキャプチャ専用
+    スレッドで stop() が呼ばれるまでブロックする。キャプチャスレッドからは
+    emit(kind, first, second) で、それ以外のスレッドからは post() でイベントを送る。
+    一時停止中や入力がない間は CPU を使わずに待つこと。run() と stop() のないサブクラスは生成できない。
+    """
+
+    def open(self, emit: Emit, post: Emit) -> bool:
+        return True
+
+    @abstractmethod
+    def run(self, emit: Emit):
+        ...
+
+    @abstractmethod
+    def stop(self):
+        ...
+
+    def set_paused(self, paused: bool):
+        pass
+
+    def close(self):
+        pass
+
+
+class PacedSource(CaptureSource):
+    """時刻を指定してイベントを送る、ソフトウェア生成のキャプチャ元の共通部分。
+
+    待機は Event.wait で行うので、stop() で即座に抜け、一時停止中は CPU を使わない。
+    """
+
+    def __init__(self):
+        self._stop_event = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    def open(self, emit: Emit, post: Emit) -> bool:
+        self._stop_event.clear()
+        return True
+
+    def stop(self):
+        self._stop_event.set()
+        self._resumed.set()
+
+    def set_paused(self, paused: bool):
+        if paused:
+            self._resumed.clear()
+        else:
+            self._resumed.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop_event.is_set()
+
+    def wait_until(self, deadline: float) -> bool:
+        """time.monotonic() が deadline になるまで待つ。停止要求があれば False を返す。"""
+        delay = deadline - time.monotonic()
+        if delay > 0 and self._stop_event.wait(delay):
+            return False
+        if not self._resumed.is_set():
+            self._resumed.wait()
+        return not self._stop_event.is_set()
+
+
+class CaptureThread(threading.Thread):
+    """CaptureSource.run() を専用スレッドで動かし、イベントを消費側へ受け渡す。
+
+    キャプチャスレッドからの emit() は事前確保したリングバッファに記録するだけで、
+    チャンク化・DB・GUI の処理はすべて drain() を呼ぶ消費側で行う。
+    バッファが空から非空になったときだけ on_pending() を呼ぶので、受け手は
+    通知を受けてから drain() すればよく、ポーリングは不要。
+    """
+
+    def __init__(self, source: CaptureSource, on_pending: Callable[[], None], capacity: int = 8192):
+        super().__init__(name="CaptureThread", daemon=True)
+        self.source = source
+        self.on_pending = on_pending
+        self.ring = SPSCRingBuffer(capacity)
+        # キャプチャスレッド以外 (macOS の通知など) から届くイベント用
+        self.side_queue: queue.SimpleQueue[RawEvent] = queue.SimpleQueue()
+        self.callback_latency = LatencyHistogram()
+        self._notified = False
+
+    def emit(self, kind: str, first=None, second=None, started_ns: int = 0):
+        """キャプチャスレッド専用。started_ns を渡すとコールバック開始からの時間を記録する。"""
+        if not started_ns:
+            started_ns = time.perf_counter_ns()
+        self.ring.push(kind, first, second)
+        if not self._notified:
+            self._notified = True
+            self.on_pending()
+        self.callback_latency.record(time.perf_counter_ns() - started_ns)
+
+    def post(self, kind: str, first=None, second=None):
+        """任意のスレッドから呼べる emit()。"""
+        self.side_queue.put((kind, first, second))
+        if not self._notified:
+            self._notified = True
+            self.on_pending()
+
+    def drain(self) -> List[RawEvent]:
+        # 先に通知フラグを戻してから取り出すので、取りこぼしは起きない
+        self._notified = False
+        events = self.ring.pop_all()
+        try:
+            while True:
+                events.append(self.side_queue.get_nowait())
+        except queue.Empty:
+            pass
+        return events
+
+    @property
+    def dropped(self) -> int:
+        return self.ring.dropped
+
+    def stats(self) -> dict:
+        return {**self.callback_latency.summary(), 'dropped': self.ring.dropped}
+
+    def run(self):
+        self.source.run(self.emit)
+
+    def stop(self, timeout: float | None = 2.0):
+        self.source.stop()
+        self.join(timeout)
+
+
+class KeystrokeChunker:
+    """生のキー入力・アプリ切り替えを、DB に書くログ単位 (入力チャンク) に変換する。
+
+    on_log(event_type, content) と on_gui(text) に結果を渡すだけで Qt には依存しないので、
+    キャプチャ元を差し替えればそのまま負荷試験に使える。
+    """
+
+    def __init__(self, on_log: Callable[[str, str], None], on_gui: Callable[[str], None]):
+        self.on_log = on_log
+        self.on_gui = on_gui
+        self.buffer: List[str] = []
+        self.last_app_name = ""
+        self.just_switched_app = False
+
+    def feed(self, kind: str, first, second=None):
+        if kind == KEY:
+            self.handle_key(first, second)
+        elif kind == APP:
+            self.handle_app_switch(first)
+
+    def handle_key(self, keycode: int, text: str):
+        if keycode in ENTER_KEYCODES:
+            self.flush()
+            self.on_log('KEYSTROKE', '[ENTER]')
+            self.on_gui("\n")
+        elif keycode == KEYCODE_DELETE:
+            if self.buffer:
+                self.buffer.pop()
+            else:
+                self.on_log('KEYSTROKE', '[BACKSPACE]')
+                self.on_gui("[<-]")
+        elif keycode == KEYCODE_SPACE:
+            self.buffer.append(" ")
+        else:
+            if text and text.isprintable():
+                self.buffer.append(text)
+
+    def handle_app_switch(self, app_name: str):
+        self.flush()
+        if app_name != self.last_app_name:
+            self.last_app_name = app_name
+            stamp = _dt.datetime.now().strftime("%H:%M:%S")
+            self.on_log('APP_SWITCH', app_name)
+            self.on_gui(f"\n🗂️  APP  {app_name}  ({stamp})")
+            self.just_switched_app = True
+
+    def flush(self):
+        if not self.buffer: return
+
+        text_chunk = ''.join(self.buffer)
+        self.on_log('KEYSTROKE', text_chunk)
+
+        if self.just_switched_app:
+            log_text = f"\n\u3000{text_chunk}"
+            self.just_switched_app = False
+        else:
+            log_text = text_chunk
+
+        self.on_gui(log_text)
+        self.buffer.clear()
@@ -0,0 +1,20 @@
+# app/chart.py
+# ダッシュボードのグラフ (asset/dashboard.html) に渡すデータの組み立て
+from __future__ import annotations
+from typing import Dict, Sequence
+import json
+
+CHART_PAGE = 'asset/dashboard.html'
+
+
+def chart_update_script(app_durations: Dict[str, float]) -> str:
+    """読み込み済みのページでグラフだけを更新する JavaScript を返す。"""
+    labels = list(app_durations.keys())
+    data = [round(seconds, 1) for seconds in app_durations.values()]
+    return f"updateChart({json.dumps(labels, ensure_ascii=False)}, {json.dumps(data)});"
+
+
+def trend_update_script(labels: Sequence[str], keystrokes: Sequence[int], focus_seconds: Sequence[float]) -> str:
+    """トレンドのグラフ (入力文字数の棒とフォーカス時間の折れ線) を更新する JavaScript を返す。"""
+    hours = [round(seconds / 3600, 2) for seconds in focus_seconds]
+    return f"updateTrend({json.dumps(list(labels), ensure_ascii=False)}, {json.dumps(list(keystrokes))}, {json.dumps(hours)});"
@@ -0,0 +1,328 @@
+# app/cli.py
+# Qt を使わないコマンドライン。統計の表示・書き出し・DB の保守・ベンチマークの実行を行う。
+# cron やシェルのパイプから呼べるように、保存と集計のコードだけを読み込んで数十ミリ秒で起動する。
+#   python -m app.cli today
+#   python -m app.cli stats --range month --json
+#   python -m app.cli stats --range month --heatmap --sessions
+#   python -m app.cli top -n 5 --from 2025-01-01 --to 2025-03-31
+#   python -m app.cli export --kind intervals intervals.csv
+#   python -m app.cli maintain archive --days 90
+#   python -m app.cli --db merged.db merge laptop=~/sync/laptop/activity.db desktop.db
+#   python -m app.cli serve --port 8765
+#   python -m app.cli bench dashboard_range
+from __future__ import annotations
+import argparse
+import datetime as _dt
+import json
+import os
+import sqlite3
+import sys
+from typing import Optional
+
+from . import queries
+
+DEFAULT_DB = os.path.join(os.path.expanduser('~'), ".activity-logger", "activity.db")
+
+
+class SchemaVersionError(sqlite3.DatabaseError):
+    pass
+
+
+def _parse_date(text: str) -> _dt.date:
+    try:
+        return _dt.date.fromisoformat(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date: {text} (expected YYYY-MM-DD)")
+
+
+def _selected_range(args) -> tuple[_dt.date, _dt.date]:
+    # --from/--to があればその日付 (両端を含む)、なければ --range の今日までの期間
+    today = _dt.date.today()
+    if args.start or args.end:
+        start, last = sorted((args.start or args.end, args.end or today))
+        return start, last + _dt.timedelta(days=1)
+    return queries.preset_range(args.range, today)
+
+
+def _open_db(path: str):
+    # 書き出しと同じく DatabaseManager 経由で開く (スキーマが古ければここでマイグレーションされる)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"database not found: {path}")
+    from .database import DatabaseManager
+    return DatabaseManager(path, write_behind=False)
+
+
+def _open_reader(path: str) -> sqlite3.Connection:
+    # 統計の表示は読み取り専用で開き、マイグレーションしない (スキーマが古ければ案内して終わる)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"database not found: {path}")
+    from . import schema
+    from .database import connect_readonly
+    conn = connect_readonly(path)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version != schema.SCHEMA_VERSION:
+        conn.close()
+        hint = ("upgrade it with: python -m app.cli maintain migrate" if version < schema.SCHEMA_VERSION
+                else "it was written by a newer version of Activity Logger")
+        raise SchemaVersionError(f"database schema is v{version}, expected v{schema.SCHEMA_VERSION}; {hint}")
+    return conn
+
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+
+def _summary(args) -> queries.RangeSummary:
+    summary, _ = _summary_and_patterns(args)
+    return summary
+
+
+def _summary_and_patterns(args) -> tuple[queries.RangeSummary, Optional[dict]]:
+    start, end = _selected_range(args)
+    conn = _open_reader(args.db)
+    try:
+        summary = queries.range_summary(conn, start, end, getattr(args, 'bucket', None))
+        wanted = getattr(args, 'heatmap', False), getattr(args, 'sessions', False)
+        return summary, (_patterns(conn, start, end, *wanted) if any(wanted) else None)
+    finally:
+        conn.close()
+
+
+def _patterns(conn: sqlite3.Connection, start: _dt.date, end: _dt.date, heatmap: bool, sessions: bool) -> dict:
+    # 曜日×時の入力の分布と、同じアプリが続いたセッションの長さは analytics.py (NumPy) で求める
+    import numpy as np
+    from . import analytics
+    data = analytics.load(conn, start, end)
+    result = {}
+    if heatmap:
+        result['heatmap'] = {day: [int(chars) for chars in row] for day, row in zip(WEEKDAYS, analytics.hour_of_week(data))}
+    if sessions:
+        lengths = analytics.focus_sessions(data)
+        counts, edges = analytics.session_histogram(lengths)
+        result['sessions'] = {
+            'count': int(len(lengths)),
+            'median_seconds': round(float(np.median(lengths)), 3) if len(lengths) else 0,
+            'longest_seconds': round(float(lengths.max()), 3) if len(lengths) else 0,
+            'histogram': [{'from_seconds': float(low), 'to_seconds': float(high) if np.isfinite(high) else None, 'count': int(count)}
+                          for low, high, count in zip(edges[:-1], edges[1:], counts)],
+        }
+    return result
+
+
+def _print_json(value):
+    print(json.dumps(value, ensure_ascii=False, indent=2))
+
+
+def _hours(seconds: float) -> str:
+    return f"{seconds / 3600:.2f} h"
+
+
+def cmd_today(args) -> int:
+    args.start = args.end = None; args.range = 'day'
+    return cmd_stats(args)
+
+
+def _duration(seconds: float) -> str:
+    return f"{seconds / 3600:.1f}h" if seconds >= 3600 else f"{seconds / 60:.0f}m"
+
+
+def _print_patterns(patterns: dict):
+    if 'heatmap' in patterns:
+        # 曜日ごとの1行に 0〜23 時の入力文字数をタブ区切りで並べる
+        print("\nkeystrokes\t" + "\t".join(str(hour) for hour in range(24)))
+        for day, row in patterns['heatmap'].items():
+            print(day + "\t" + "\t".join(str(chars) for chars in row))
+    if 'sessions' in patterns:
+        sessions = patterns['sessions']
+        print(f"\nSessions:    {sessions['count']:,} (median {_duration(sessions['median_seconds'])}, "
+              f"longest {_duration(sessions['longest_seconds'])})")
+        for bucket in sessions['histogram']:
+            if bucket['count']:
+                high = _duration(bucket['to_seconds']) if bucket['to_seconds'] is not None else ''
+                print(f"  {_duration(bucket['from_seconds']):>6} – {high:<6} {bucket['count']:>6}")
+
+
+def cmd_stats(args) -> int:
+    summary, patterns = _summary_and_patterns(args)
+    if args.json:
+        _print_json({**summary.to_json(trend=not args.totals_only), **(patterns or {})})
+        return 0
+    last_day = summary.end - _dt.timedelta(days=1)
+    print(f"Period:      {summary.start} – {last_day}" if summary.start != last_day else f"Day:         {last_day}")
+    print(f"Keystrokes:  {summary.total_keys:,}")
+    print(f"Focus time:  {_hours(sum(summary.app_durations.values()))}")
+    for app, seconds in summary.sorted_apps()[:args.top]:
+        print(f"  {_hours(seconds):>10}  {app}")
+    if args.totals_only:
+        return 0
+    print(f"\n{summary.bucket}\tkeystrokes\tfocus_hours")
+    for key, keys, seconds in zip(summary.buckets, summary.keystrokes, summary.focus_seconds):
+        print(f"{key}\t{keys}\t{seconds / 3600:.2f}")
+    if patterns:
+        _print_patterns(patterns)
+    return 0
+
+
+def cmd_top(args) -> int:
+    summary = _summary(args)
+    apps = summary.sorted_apps()[:args.n]
+    if args.json:
+        _print_json([{'app': app, 'seconds': round(seconds, 3)} for app, seconds in apps])
+        return 0
+    # 1行1アプリのタブ区切り (sort や awk にそのまま渡せる)
+    for rank, (app, seconds) in enumerate(apps, start=1):
+        print(f"{rank}\t{seconds / 3600:.2f}\t{app}")
+    return 0
+
+
+def cmd_export(args) -> int:
+    from . import export
+    return export.main(['--db', args.db, *args.rest])
+
+
+def cmd_merge(args) -> int:
+    from . import merge
+    return merge.main(['--into', args.db, *args.rest])
+
+
+def cmd_serve(args) -> int:
+    from .server import QueryServer
+    db_manager = _open_db(args.db)
+
+    # 書き込むのは別のプロセス (アプリ) なので、キャッシュの世代は DB の最後のイベント ID を読む
+    def generation() -> int:
+        return db_manager.reader().execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    server = QueryServer(db_manager, args.socket, args.port, args.ttl, generation=generation)
+    try:
+        server.start()
+        print(f"Serving {args.db} on {server.address} (Ctrl+C to stop)", file=sys.stderr)
+        server.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        db_manager.close()
+    return 0
+
+
+def cmd_maintain(args) -> int:
+    if args.task == 'archive':
+        from . import retention
+        return retention.main(['--db', args.db, '--days', str(args.days)])
+    if args.task == 'rollups':
+        from . import rollups
+        return rollups.main(['--db', args.db])
+    db_manager = _open_db(args.db)
+    if args.task == 'migrate':
+        # 開いた時点でマイグレーションは済んでいる
+        from .schema import SCHEMA_VERSION
+        db_manager.close()
+        print(f"Schema is at v{SCHEMA_VERSION}")
+        return 0
+    # vacuum: アーカイブなどで空いたページを返し、WAL を切り詰める。
+    # --full は DB 全体を書き直して auto_vacuum=INCREMENTAL にする (古い DB で1回だけ必要。ファイルの大きさに比例して時間がかかる)
+    try:
+        if args.full:
+            db_manager.run_on_writer(_full_vacuum, timeout=None)
+        freed = db_manager.run_on_writer(_vacuum)
+    finally:
+        db_manager.close()
+    print(f"Freed {freed} pages")
+    return 0
+
+
+def _full_vacuum(conn: sqlite3.Connection):
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+def _vacuum(conn: sqlite3.Connection) -> int:
+    before = conn.execute("PRAGMA page_count").fetchone()[0]
+    conn.execute("PRAGMA incremental_vacuum").fetchall()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    return before - conn.execute("PRAGMA page_count").fetchone()[0]
+
+
+def cmd_bench(args) -> int:
+    from . import benchmarks
+    return benchmarks.main(args.rest)
+
+
+def _add_range_arguments(parser: argparse.ArgumentParser, default: str):
+    parser.add_argument('--range', choices=queries.DASHBOARD_RANGES, default=default,
+                        help=f"period ending today (default: {default})")
+    parser.add_argument('--from', dest='start', type=_parse_date, help="first day (YYYY-MM-DD); overrides --range")
+    parser.add_argument('--to', dest='end', type=_parse_date, help="last day, inclusive (YYYY-MM-DD)")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m app.cli',
+                                     description="Query and maintain an Activity Logger database without the GUI.")
+    parser.add_argument('--db', default=DEFAULT_DB, help=f"database file (default: {DEFAULT_DB})")
+    commands = parser.add_subparsers(dest='command', metavar='command', required=True)
+
+    today = commands.add_parser('today', help="today's keystrokes and focus time per app")
+    today.add_argument('--top', type=int, default=10, help="number of apps to list")
+    today.add_argument('--json', action='store_true', help="print JSON")
+    today.set_defaults(func=cmd_today, totals_only=True)
+
+    stats = commands.add_parser('stats', help="totals and a trend for a range of days")
+    _add_range_arguments(stats, 'week')
+    stats.add_argument('--bucket', choices=queries.BUCKETS, help="trend resolution (default: chosen from the range)")
+    stats.add_argument('--top', type=int, default=10, help="number of apps to list")
+    stats.add_argument('--json', action='store_true', help="print JSON")
+    stats.add_argument('--heatmap', action='store_true', help="keystrokes by weekday and hour (needs numpy)")
+    stats.add_argument('--sessions', action='store_true', help="lengths of uninterrupted focus on one app (needs numpy)")
+    stats.set_defaults(func=cmd_stats, totals_only=False)
+
+    top = commands.add_parser('top', help="apps with the most focus time")
+    _add_range_arguments(top, 'day')
+    top.add_argument('-n', type=int, default=10, help="number of apps")
+    top.add_argument('--json', action='store_true', help="print JSON")
+    top.set_defaults(func=cmd_top)
+
+    # 書き出しとベンチマークは各モジュールのコマンドラインに残りの引数をそのまま渡す
+    export = commands.add_parser('export', add_help=False, help="export events or intervals (see: export --help)")
+    export.set_defaults(func=cmd_export)
+    bench = commands.add_parser('bench', add_help=False, help="run micro-benchmarks (see: bench --help)")
+    bench.set_defaults(func=cmd_bench)
+    merge = commands.add_parser('merge', add_help=False,
+                                help="merge databases from other machines into --db (see: merge --help)")
+    merge.set_defaults(func=cmd_merge)
+
+    serve = commands.add_parser('serve', help="answer JSON queries over a Unix socket or a local port")
+    serve.add_argument('--socket', help="Unix socket path (default: ~/.activity-logger/server.sock)")
+    serve.add_argument('--port', type=int, default=0, help="listen on 127.0.0.1:PORT instead of a Unix socket")
+    serve.add_argument('--ttl', type=float, default=2.0, help="seconds to reuse a response while no events are written")
+    serve.set_defaults(func=cmd_serve)
+
+    maintain = commands.add_parser('maintain', help="database maintenance")
+    maintain.add_argument('task', choices=('migrate', 'archive', 'rollups', 'vacuum'),
+                          help="migrate: upgrade the schema; archive: move old rows to monthly archives; "
+                               "rollups: rebuild and verify aggregates; vacuum: return free pages and truncate the WAL")
+    maintain.add_argument('--days', type=int, default=90, help="archive: days to keep in the main database")
+    maintain.add_argument('--full', action='store_true',
+                          help="vacuum: rewrite the whole file once so later vacuums can return pages incrementally")
+    maintain.set_defaults(func=cmd_maintain)
+    return parser
+
+
+def main(argv=None) -> int:
+    parser = build_parser()
+    args, rest = parser.parse_known_args(argv)
+    args.rest = rest
+    if rest and args.func not in (cmd_export, cmd_bench, cmd_merge):
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+    try:
+        return args.func(args)
+    except BrokenPipeError:
+        # head などが出力を途中で閉じたときは、終了時の書き出しでも例外を出さないようにして終わる
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    except (OSError, sqlite3.Error) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
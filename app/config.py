@@ -7,7 +7,31 @@ class ConfigManager:
     def __init__(self, path):
         self.path = path
         self.defaults = {
-            'auto_start_logging': True
+            'auto_start_logging': True,
+            # Live Log の内容を標準出力にも書き出すか
+            'console_log': True,
+            # 書き込みをまとめてコミットするライタースレッドの設定
+            'write_behind': True,
+            'write_batch_size': 200,
+            'write_flush_interval_ms': 1000,
+            'write_queue_size': 10000,
+            # キャプチャ元: 'macos' / 'synthetic' / 'replay' (オプションは各クラスの引数)
+            'capture_source': 'macos',
+            'capture_source_options': {},
+            # ウィンドウを閉じてから web ビューを破棄し Live Log を切り詰めるまでの秒数 (0 以下で無効)
+            'background_release_after_s': 300,
+            # 切り詰め後に Live Log に残す行数
+            'background_log_tail_rows': 200,
+            # この日数より古いログは月ごとのアーカイブ DB に移す (0 以下で無効。設定画面か手動で有効にする)
+            'retention_hot_days': 0,
+            'retention_check_interval_h': 24,
+            # JSON で問い合わせられるローカルのクエリサーバー (server.py)。
+            # ポートが 0 なら Unix ソケット (空なら ~/.activity-logger/server.sock) で待ち受ける
+            'query_server': False,
+            'query_server_socket': '',
+            'query_server_port': 0,
+            # 書き込みがない間、同じ問い合わせに前の応答を返す秒数
+            'query_server_cache_ttl_s': 2.0
         }
 
     def load(self):
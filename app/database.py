@@ -1,41 +1,464 @@
 # app/database.py
 import sqlite3
 import os
+import pathlib
+import queue
+import threading
+import time
 import datetime as _dt
+from concurrent.futures import Future
+
+from . import intervals
+from . import merge
+from . import schema
+from . import retention
+from . import rollups
+from .intervals import IntervalTracker
+from .rollups import RollupUpdater
+from .search import SearchIndexer
+from .storage import NameInterner
+
+_INSERT_SQL = "INSERT INTO events (ts, type_id, app_id, content) VALUES (?, ?, ?, ?)"
+_STOP = object()
+# 書き込みタスク (call) の結果を待つ既定の秒数。ライターが応答しなくなっても呼び出し元を止め続けない
+CALL_TIMEOUT_S = 600.0
+# 終了時にライターが残りを書き込むのを待つ秒数。過ぎたら残りは破棄して GUI の終了を止めない
+CLOSE_TIMEOUT_S = 5.0
+# 接続ごとにプリペアド済みステートメントを保持する数
+STATEMENT_CACHE_SIZE = 256
+
+# WAL ではコミット毎の fsync が不要なので synchronous=NORMAL で十分
+_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+def to_epoch_us(moment: _dt.datetime) -> int:
+    """ローカル時刻の datetime をエポックマイクロ秒に変換する。"""
+    return int(moment.replace(microsecond=0).timestamp()) * 1_000_000 + moment.microsecond
+
+
+def day_range_us(day: _dt.date) -> tuple[int, int]:
+    """ローカル日付の [開始, 翌日開始) をエポックマイクロ秒で返す。"""
+    start = _dt.datetime.combine(day, _dt.time())
+    return to_epoch_us(start), to_epoch_us(start + _dt.timedelta(days=1))
+
+
+def _connect(db_path: str, readonly: bool = False) -> sqlite3.Connection:
+    if readonly:
+        uri = pathlib.Path(os.path.abspath(db_path)).as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=5.0, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+    else:
+        conn = sqlite3.connect(db_path, timeout=5.0, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        # 新しいファイルの auto_vacuum は WAL にする前に決める (schema.migrate を参照)
+        if not conn.execute("SELECT 1 FROM sqlite_master").fetchone():
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def connect_readonly(db_path: str) -> sqlite3.Connection:
+    """読み取り専用の接続を開く。DatabaseManager と違ってマイグレーションはしない。"""
+    return _connect(db_path, readonly=True)
+
+
+class ReadConnectionPool:
+    """分析クエリ用の読み取り専用接続をスレッドごとに1本ずつ貸し出すプール。"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns: list[tuple[threading.Thread, sqlite3.Connection]] = []
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = _connect(self.db_path, readonly=True)
+            self._local.conn = conn
+            with self._lock:
+                self._prune()
+                self._conns.append((threading.current_thread(), conn))
+        return conn
+
+    def _prune(self):
+        # 終了したスレッドに紐付いた接続は閉じる
+        alive = []
+        for thread, conn in self._conns:
+            if thread.is_alive():
+                alive.append((thread, conn))
+            else:
+                conn.close()
+        self._conns = alive
+
+    def close_all(self):
+        with self._lock:
+            for _, conn in self._conns:
+                conn.close()
+            self._conns = []
+        self._local = threading.local()
+
+
+class LogWriter(threading.Thread):
+    """キューに溜まったイベントをまとめて1トランザクションで書き込むライタースレッド。"""
+
+    def __init__(self, conn: sqlite3.Connection, write_batch, batch_size: int = 200, flush_interval: float = 1.0,
+                 max_queue: int = 10000, setup=None):
+        super().__init__(name="LogWriter", daemon=True)
+        self.conn = conn
+        self.write_batch = write_batch
+        self.setup = setup
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.queued = 0
+        self.committed = 0
+        self.dropped = 0
+        self._stats_lock = threading.Lock()
+        # run() を抜けたら True。以後はキューに積まず、積まれていたものは失敗させる
+        self._stopped = False
+
+    def submit(self, row: tuple) -> bool:
+        # キャプチャ側を絶対に待たせないため、満杯かライターが止まっていれば破棄してカウントだけする
+        try:
+            if self._stopped:
+                raise queue.Full
+            self.queue.put_nowait(row)
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            return False
+        with self._stats_lock:
+            self.queued += 1
+        if self._stopped:
+            self._fail_pending()
+        return True
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """キュー内のイベントがすべてコミットされるまで待つ。満杯のままかライターが止まっていれば False。"""
+        future = Future()
+        if not self._enqueue((lambda conn: None, future), timeout):
+            return False
+        try:
+            future.result(timeout)
+        except Exception:
+            return False
+        return True
+
+    def call(self, func, timeout: float | None = CALL_TIMEOUT_S):
+        """溜まっているイベントを書き込んだ後、ライタースレッド上で func(conn) を実行して結果を返す。"""
+        return self.call_async(func).result(timeout)
+
+    def call_async(self, func) -> Future:
+        """call() の結果を待たない版。ライターが止まっていれば失敗済みの Future を返す。"""
+        future = Future()
+        if not self._enqueue((func, future)):
+            future.set_exception(RuntimeError("log writer is not running"))
+        return future
+
+    def _enqueue(self, item, timeout: float | None = None) -> bool:
+        if self._stopped:
+            return False
+        try:
+            self.queue.put(item, timeout=timeout)
+        except queue.Full:
+            return False
+        # 積んでいる間にライターが止まったら、残ったものは自分で失敗させる
+        if self._stopped:
+            self._fail_pending()
+        return True
+
+    def _fail_pending(self):
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(item, tuple) and isinstance(item[-1], Future):
+                if item[-1].set_running_or_notify_cancel():
+                    item[-1].set_exception(RuntimeError("log writer stopped"))
+            elif item is not _STOP:
+                with self._stats_lock:
+                    self.dropped += 1
+
+    def close(self, timeout: float = CLOSE_TIMEOUT_S) -> bool:
+        """残りを書き込んでスレッドを終える。timeout 秒で終わらなければ、残りを破棄数に数えて False を返す。"""
+        if not self.is_alive():
+            return True
+        deadline = time.monotonic() + timeout
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self.join(max(0.0, deadline - time.monotonic()))
+        if not self.is_alive():
+            return True
+        # 長いタスクの途中などで止まらないライターは待たない (daemon スレッドなのでプロセスと一緒に終わる)
+        self._stopped = True
+        self._fail_pending()
+        return False
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {'queued': self.queued, 'committed': self.committed,
+                    'dropped': self.dropped, 'pending': self.queue.qsize()}
+
+    def run(self):
+        conn = self.conn
+        batch = []
+        deadline = 0.0
+        try:
+            # マイグレーションはライタースレッドで行い、その間のイベントはキューに溜めておく
+            if self.setup:
+                self.setup()
+            while True:
+                # バッチが空の間はタイムアウトなしで待つ (アイドル時にウェイクアップしない)
+                timeout = max(0.0, deadline - time.monotonic()) if batch else None
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                if item is _STOP:
+                    self._commit(conn, batch); batch = []
+                    break
+                if isinstance(item, tuple) and isinstance(item[-1], Future):
+                    self._commit(conn, batch); batch = []
+                    self._run_task(conn, *item)
+                    continue
+                if item is not None:
+                    if not batch:
+                        deadline = time.monotonic() + self.flush_interval
+                    batch.append(item)
+
+                if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                    self._commit(conn, batch); batch = []
+        except Exception as e:
+            print(f"Log writer stopped: {e}")
+        finally:
+            self._stopped = True
+            with self._stats_lock:
+                self.dropped += len(batch)
+            self._fail_pending()
+
+    def _run_task(self, conn: sqlite3.Connection, func, future: Future):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(conn))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _commit(self, conn: sqlite3.Connection, batch: list):
+        if not batch:
+            return
+        try:
+            self.write_batch(conn, batch)
+        except Exception as e:
+            # 1バッチの失敗ではスレッドを止めない (止まると以後のイベントと書き込みタスクがすべて失われる)
+            print(f"Database error: {e}")
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                pass
+            with self._stats_lock:
+                self.dropped += len(batch)
+            return
+        with self._stats_lock:
+            self.committed += len(batch)
+
 
 class DatabaseManager:
 
-    def __init__(self, db_path):
+    def __init__(self, db_path, write_behind: bool = True, batch_size: int = 200,
+                 flush_interval_ms: int = 1000, queue_size: int = 10000):
         self.db_path = db_path
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        # 複数のスレッドから呼び出される可能性があるため、check_same_thread=False を設定
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
-        self.cursor = self.conn.cursor()
-        self._setup_table()
+        # 書き込みは WAL モードの接続1本に限定し、読み取りは別接続のプールから行う。
+        # write-behind 時はライタースレッドだけがこの接続を使う。
+        self.conn = _connect(db_path)
+        self._write_lock = threading.Lock()
+        self.read_pool = ReadConnectionPool(db_path)
+        # スキーマの準備が終わるまで読み取りは待たせる
+        self.ready = threading.Event()
+        # イベント種別とアプリ名を整数IDにする辞書 (ライタースレッド専用)
+        self.event_types = NameInterner('event_types')
+        self.apps = NameInterner('apps')
+        self.rollups = RollupUpdater()
+        self.intervals = IntervalTracker(self.apps)
+        self.search_indexer = SearchIndexer()
+        # コミット済みの最大行ID。ダッシュボードのキャッシュキーなどに使う
+        self.last_row_id = 0
+        # 実行中のアーカイブ (archive_old_logs) の結果
+        self._archive_result = None
+
+        self.writer = None
+        if write_behind:
+            self.writer = LogWriter(self.conn, self._write_batch, batch_size, flush_interval_ms / 1000.0, queue_size,
+                                    setup=self._setup_table)
+            self.writer.start()
+        else:
+            self._setup_table()
 
     def _setup_table(self):
 
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                event_type TEXT NOT NULL,
-                content TEXT
-            )
-        ''')
-        self.conn.commit()
+        try:
+            schema.migrate(self.conn)
+            self.intervals.load_state(self.conn)
+            self.search_indexer.load_state(self.conn)
+            self.last_row_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+        finally:
+            self.ready.set()
+
+    def _write_batch(self, conn: sqlite3.Connection, rows: list):
+        # 生ログの挿入と集計テーブル・検索索引の更新を同じトランザクションで行う
+        try:
+            with conn:
+                conn.executemany(_INSERT_SQL, self._encode(conn, rows))
+                last_row_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                self.rollups.apply(conn, rows)
+                self.intervals.apply(conn, rows)
+                self.search_indexer.apply(conn, rows, last_row_id - len(rows) + 1)
+        except Exception:
+            # ロールバックで消えた辞書の行をキャッシュから使わないようにし、開いている区間や
+            # 今のアプリも DB に残っている状態から読み直す (起動時の _setup_table と同じ)
+            self.event_types.clear(); self.apps.clear()
+            self.intervals.load_state(conn)
+            self.search_indexer.load_state(conn)
+            raise
+        self.last_row_id = last_row_id
+
+    def _encode(self, conn: sqlite3.Connection, rows: list) -> list:
+        # (timestamp, ts, event_type, content) を events の行にする。APP_SWITCH のアプリ名は apps に持つ
+        encoded = []
+        for timestamp, ts, event_type, content in rows:
+            type_id = self.event_types.id(conn, event_type)
+            if event_type == 'APP_SWITCH':
+                encoded.append((ts, type_id, self.apps.id(conn, content), None))
+            else:
+                encoded.append((ts, type_id, None, content))
+        return encoded
 
-    def add_log_entry(self, event_type: str, content: str = ''):
+    def add_log_entry(self, event_type: str, content: str = '', when: _dt.datetime | None = None):
 
-        timestamp = _dt.datetime.now().isoformat()
+        # タイムスタンプは書き込み時ではなくイベント発生時に確定させる
+        now = when or _dt.datetime.now()
+        row = (now.isoformat(), to_epoch_us(now), event_type, content)
+        if self.writer:
+            self.writer.submit(row)
+            return
         try:
-            self.cursor.execute("INSERT INTO logs (timestamp, event_type, content) VALUES (?, ?, ?)",
-                                (timestamp, event_type, content))
-            self.conn.commit()
+            with self._write_lock:
+                self._write_batch(self.conn, [row])
         except sqlite3.Error as e:
             print(f"Database error: {e}")
 
+    def reader(self) -> sqlite3.Connection:
+        """呼び出し元スレッド専用の読み取り接続を返す。"""
+        self.ready.wait()
+        return self.read_pool.get()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        if self.writer:
+            return self.writer.flush(timeout)
+        return True
+
+    def run_on_writer(self, func, wait: bool = True, timeout: float | None = CALL_TIMEOUT_S):
+        """書き込み接続を使う処理 func(conn) を、ライターと競合しないように実行する。
+
+        wait=False なら結果を待たずに Future を返す。
+        """
+        if self.writer:
+            return self.writer.call(func, timeout) if wait else self.writer.call_async(func)
+        with self._write_lock:
+            result = func(self.conn)
+        if wait:
+            return result
+        future = Future(); future.set_result(result)
+        return future
+
+    def archive_old_logs(self, hot_days: int, wait: bool = True):
+        """hot_days 日より古いログを月ごとのアーカイブ DB に移す (retention.archive_old_rows)。
+
+        ライタースレッドでは1チャンクごとに別のタスクにして、長い履歴を移す間もキャプチャのバッチを書き込む。
+        zip への圧縮はライタースレッドの外で行う。前回がまだ終わっていなければ、その Future を返す。
+        """
+        writer = self.writer
+        if not writer:
+            return self.run_on_writer(lambda conn: retention.archive_old_rows(conn, hot_days), wait)
+        if self._archive_result and not self._archive_result.done():
+            return self._archive_result.result() if wait else self._archive_result
+        archive, result = retention.ArchivePass(hot_days), Future()
+        self._archive_result = result
+
+        def repeat(step, then):
+            # step(conn) が True を返す間、1回ずつキューの最後に積み直す
+            def done(future: Future):
+                if future.exception():
+                    result.set_exception(future.exception())
+                elif future.result():
+                    writer.call_async(step).add_done_callback(done)
+                else:
+                    then()
+            writer.call_async(step).add_done_callback(done)
+
+        def compress():
+            try:
+                archive.compress()
+            except Exception as e:
+                result.set_exception(e); return
+            repeat(archive.finish_step, lambda: result.set_result(archive.result()))
+
+        repeat(archive.move_step, lambda: threading.Thread(target=compress, name="ArchiveCompress", daemon=True).start())
+        return result.result() if wait else result
+
+    def merge_database(self, path: str, host: str | None = None, chunk: int = merge.MERGE_CHUNK, wait: bool = True):
+        """別の端末の DB を取り込み、取り込んだ期間の集計を更新する (merge.merge)。"""
+        def run(conn):
+            result = merge.merge(conn, path, host, chunk)
+            self.last_row_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+            return result
+        return self.run_on_writer(run, wait)
+
+    def rebuild_rollups(self) -> list:
+        """集計テーブルとアプリ区間を生ログから作り直し、集計の逐次更新値との食い違いを返す。"""
+        def rebuild(conn):
+            mismatches = rollups.rebuild_and_verify(conn, retention.archived_before_day(conn))
+            since_us = retention.archived_before_us(conn) or 0
+            with conn:
+                # アプリ別の集計は、作り直す前の区間と食い違っていないかを確かめる
+                before = rollups.snapshot(conn, intervals.ROLLUP_TABLES)
+                intervals.rebuild_rollups(conn, since_us)
+                mismatches += rollups.diff(before, rollups.snapshot(conn, intervals.ROLLUP_TABLES))
+                intervals.rebuild(conn, since_us)
+            self.intervals.load_state(conn)
+            return mismatches
+        return self.run_on_writer(rebuild)
+
+    def writer_stats(self) -> dict:
+        if not self.writer:
+            return {'queued': 0, 'committed': 0, 'dropped': 0, 'pending': 0}
+        return self.writer.stats()
+
     def close(self):
 
-        if self.conn:
+        stopped = True
+        if self.writer:
+            stopped = self.writer.close()
+            stats = self.writer.stats()
+            print(f"Log writer: queued={stats['queued']} committed={stats['committed']} dropped={stats['dropped']}"
+                  + ("" if stopped else " (did not stop in time)"))
+            self.writer = None
+        self.read_pool.close_all()
+        # 止まらなかったライターがまだ使っている接続は閉じない
+        if self.conn and stopped:
             self.conn.close()
+            self.conn = None
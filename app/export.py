@@ -0,0 +1,217 @@
+# app/export.py
+# 任意の期間の生ログ (logs) かアプリのフォーカス区間を CSV / JSONL / NumPy (.npz) に書き出す。
+# どの形式もキーセットのチャンクで読みながら書くので、期間が長くてもメモリ使用量は一定。
+# python -m app.export --from 2025-01-01 --to 2025-04-01 events.csv で実行する。
+from __future__ import annotations
+from typing import Callable, Iterator, Optional
+import argparse
+import csv
+import datetime as _dt
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import zipfile
+
+from . import queries
+from .database import to_epoch_us
+from .queries import TimeLike, as_epoch_us
+
+EXPORT_KINDS = ('events', 'intervals')
+EXPORT_FORMATS = ('csv', 'jsonl', 'npz')
+# この行数ごとに進捗を通知し、中断の要求を確かめる
+PROGRESS_EVERY = 5000
+
+COLUMNS = {
+    'events': ('id', 'ts', 'timestamp', 'event_type', 'content'),
+    'intervals': ('app', 'start_ts', 'end_ts', 'seconds'),
+}
+# .npz の構造化配列の列。文字列の幅は1回目の走査で決める。events の timestamp は ts から作れるので持たない
+_NPZ_FIELDS = {
+    'events': (('id', '<i8'), ('ts', '<i8'), ('event_type', 'U'), ('content', 'U')),
+    'intervals': (('app', 'U'), ('start_ts', '<i8'), ('end_ts', '<i8'), ('seconds', '<f8')),
+}
+
+# progress(書き出した行数, 0.0〜1.0 の進み具合)
+Progress = Callable[[int, float], None]
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def format_for_path(path: str) -> str:
+    """拡張子から書き出し形式を決める。"""
+    fmt = os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unknown export format: {fmt or path} (expected one of {', '.join(EXPORT_FORMATS)})")
+    return fmt
+
+
+def _iter_rows(conn: sqlite3.Connection, kind: str, start_us: int, end_us: int,
+               chunk_size: int) -> Iterator[tuple]:
+    # (進み具合を測る時刻, COLUMNS の順の行) を返す
+    if kind == 'events':
+        for event in queries.iter_events(conn, start_us, end_us, chunk_size=chunk_size):
+            yield event.ts, tuple(event)
+    else:
+        for interval in queries.iter_app_intervals(conn, start_us, end_us):
+            yield interval.start_ts, (*interval, round(interval.seconds, 6))
+
+
+class _Tracker:
+    """行数と範囲内の時刻から進み具合を計算し、PROGRESS_EVERY 行ごとに通知する。"""
+
+    def __init__(self, start_us: int, end_us: int, progress: Optional[Progress],
+                 cancelled: Optional[Callable[[], bool]], base: float = 0.0, weight: float = 1.0):
+        self.start_us = start_us
+        self.span = max(1, end_us - start_us)
+        self.progress = progress
+        self.cancelled = cancelled
+        self.base = base
+        self.weight = weight
+        self.rows = 0
+
+    def tick(self, ts: int):
+        self.rows += 1
+        if self.rows % PROGRESS_EVERY == 0:
+            self.report(min(1.0, max(0.0, (ts - self.start_us) / self.span)))
+
+    def report(self, fraction: float):
+        if self.cancelled and self.cancelled():
+            raise ExportCancelled()
+        if self.progress:
+            self.progress(self.rows, self.base + self.weight * fraction)
+
+
+def _write_csv(path: str, columns: tuple, rows: Iterator[tuple], tracker: _Tracker):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for ts, row in rows:
+            writer.writerow(row)
+            tracker.tick(ts)
+
+
+def _write_jsonl(path: str, columns: tuple, rows: Iterator[tuple], tracker: _Tracker):
+    with open(path, 'w', encoding='utf-8') as f:
+        for ts, row in rows:
+            f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+            f.write('\n')
+            tracker.tick(ts)
+
+
+def _write_npz(path: str, kind: str, rows: Callable[[], Iterator[tuple]], tracker: _Tracker,
+               chunk_size: int):
+    # numpy は .npz の書き出しのときだけ読み込む (CSV / JSONL の書き出しを重くしない)
+    import numpy as np
+
+    columns = COLUMNS[kind]
+    fields = _NPZ_FIELDS[kind]
+    positions = [columns.index(name) for name, _ in fields]
+    text = [i for i, (_, kind_code) in enumerate(fields) if kind_code == 'U']
+
+    # 1回目: .npy のヘッダに書く行数と、文字列の列の幅だけを数える
+    tracker.weight = 0.5
+    count, widths = 0, {i: 1 for i in text}
+    for ts, row in rows():
+        count += 1
+        for i in text:
+            widths[i] = max(widths[i], len(row[positions[i]] or ''))
+        tracker.tick(ts)
+    dtype = np.dtype([(name, f"<U{widths[i]}" if i in widths else code) for i, (name, code) in enumerate(fields)])
+
+    # 2回目: チャンクごとに構造化配列にして、zip の中の .npy に直接書く
+    tracker.base, tracker.rows = 0.5, 0
+    header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (count,)}
+    written = 0
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+        with zf.open(f"{kind}.npy", 'w', force_zip64=True) as f:
+            np.lib.format.write_array_header_2_0(f, header)
+            source = itertools.islice(rows(), count)
+            while True:
+                chunk = []
+                for ts, row in itertools.islice(source, chunk_size):
+                    chunk.append(tuple('' if row[p] is None else row[p] for p in positions))
+                    tracker.tick(ts)
+                if not chunk:
+                    break
+                f.write(np.array(chunk, dtype=dtype).tobytes())
+                written += len(chunk)
+    if written != count:
+        raise RuntimeError(f"rows changed during export ({written} of {count} written)")
+
+
+def export(conn: sqlite3.Connection, path: str, start: TimeLike, end: TimeLike, kind: str = 'events',
+           fmt: Optional[str] = None, progress: Optional[Progress] = None,
+           cancelled: Optional[Callable[[], bool]] = None, chunk_size: int = queries.CHUNK_SIZE) -> int:
+    """[start, end) の kind ('events' か 'intervals') を path に書き出し、行数を返す。
+
+    fmt を省略すると path の拡張子で決める。一時ファイルに書いてから置き換えるので、
+    失敗や中断 (cancelled() が True で ExportCancelled) のときに途中までのファイルは残らない。
+    まだ来ていない時刻は含めないので、書き出し中に記録されたイベントは入らない。
+    """
+    if kind not in EXPORT_KINDS:
+        raise ValueError(f"unknown export kind: {kind}")
+    fmt = fmt or format_for_path(path)
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unknown export format: {fmt}")
+    start_us = as_epoch_us(start)
+    end_us = min(as_epoch_us(end), to_epoch_us(_dt.datetime.now()) + 1)
+
+    rows = lambda: _iter_rows(conn, kind, start_us, end_us, chunk_size)
+    tracker = _Tracker(start_us, end_us, progress, cancelled)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        if fmt == 'csv':
+            _write_csv(tmp_path, COLUMNS[kind], rows(), tracker)
+        elif fmt == 'jsonl':
+            _write_jsonl(tmp_path, COLUMNS[kind], rows(), tracker)
+        else:
+            _write_npz(tmp_path, kind, rows, tracker, chunk_size)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    tracker.report(1.0)
+    return tracker.rows
+
+
+def _parse_date(text: str) -> _dt.date:
+    return _dt.date.fromisoformat(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export logged events or app focus intervals to CSV, JSONL or NumPy .npz.")
+    parser.add_argument('output', help="output file; the format is taken from the extension (.csv, .jsonl, .npz)")
+    parser.add_argument('--db', default=os.path.join(os.path.expanduser('~'), ".activity-logger", "activity.db"))
+    parser.add_argument('--kind', choices=EXPORT_KINDS, default='events')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, help="override the format implied by the extension")
+    parser.add_argument('--from', dest='start', type=_parse_date, default=_dt.date(1970, 1, 2), help="first day (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='end', type=_parse_date, default=_dt.date.today(), help="last day, inclusive (YYYY-MM-DD)")
+    parser.add_argument('-q', '--quiet', action='store_true', help="do not print progress")
+    args = parser.parse_args(argv)
+
+    from .database import DatabaseManager
+    db_manager = DatabaseManager(args.db, write_behind=False)
+
+    def report(rows: int, fraction: float):
+        print(f"\r{fraction * 100:5.1f}%  {rows:,} rows", end='', file=sys.stderr, flush=True)
+    try:
+        rows = export(db_manager.reader(), args.output, args.start, args.end + _dt.timedelta(days=1),
+                      args.kind, args.format, None if args.quiet else report)
+    except (ValueError, ImportError, OSError, sqlite3.Error) as e:
+        print(f"\nExport error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        db_manager.close()
+    if not args.quiet:
+        print(file=sys.stderr)
+    print(f"Exported {rows:,} rows ({args.kind}) to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
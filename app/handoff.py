@@ -0,0 +1,105 @@
+# app/handoff.py
+# キャプチャのコールバックから消費側へイベントを渡すためのリングバッファと、
+# コールバック所要時間を記録するヒストグラム。どちらも書き手1スレッド前提でロックを使わない。
+from __future__ import annotations
+from typing import Any, List, Tuple
+
+
+class SPSCRingBuffer:
+    """書き手1・読み手1のリングバッファ。
+
+    スロットは起動時に確保した並列リストで、push は添字への代入と tail の更新だけで済む。
+    tail は書き手だけが、head は読み手だけが更新するので、GIL の下ではロックが要らない。
+    満杯のときは待たずに破棄して dropped を数える。
+    """
+
+    def __init__(self, capacity: int = 8192):
+        capacity = 1 << max(1, capacity - 1).bit_length()
+        self.mask = capacity - 1
+        self.kinds: List[Any] = [None] * capacity
+        self.first: List[Any] = [None] * capacity
+        self.second: List[Any] = [None] * capacity
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.mask + 1
+
+    def __len__(self) -> int:
+        return self.tail - self.head
+
+    def push(self, kind, first=None, second=None) -> bool:
+        tail = self.tail
+        if tail - self.head > self.mask:
+            self.dropped += 1
+            return False
+        i = tail & self.mask
+        self.kinds[i] = kind
+        self.first[i] = first
+        self.second[i] = second
+        # スロットを書き終えてから公開する
+        self.tail = tail + 1
+        return True
+
+    def pop_all(self) -> List[Tuple[Any, Any, Any]]:
+        head, tail, mask = self.head, self.tail, self.mask
+        kinds, first, second = self.kinds, self.first, self.second
+        events = []
+        for n in range(head, tail):
+            i = n & mask
+            events.append((kinds[i], first[i], second[i]))
+            first[i] = second[i] = None
+        self.head = tail
+        return events
+
+
+class LatencyHistogram:
+    """ナノ秒単位の所要時間を対数バケットで数える (各バケットの幅は約12%)。"""
+
+    SUB_BUCKETS = 8
+
+    def __init__(self):
+        self.counts = [0] * (self.SUB_BUCKETS * 64)
+        self.count = 0
+        self.max_ns = 0
+
+    @classmethod
+    def _index(cls, ns: int) -> int:
+        if ns < cls.SUB_BUCKETS:
+            return max(0, ns)
+        shift = ns.bit_length() - 4
+        return cls.SUB_BUCKETS * (shift + 1) + (ns >> shift) - cls.SUB_BUCKETS
+
+    @classmethod
+    def _upper_bound(cls, index: int) -> int:
+        if index < cls.SUB_BUCKETS:
+            return index
+        shift = index // cls.SUB_BUCKETS - 1
+        mantissa = index % cls.SUB_BUCKETS + cls.SUB_BUCKETS
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, ns: int):
+        self.counts[self._index(ns)] += 1
+        self.count += 1
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def percentile(self, p: float) -> int:
+        """p パーセンタイル (0-100) の上限値をナノ秒で返す。"""
+        if not self.count:
+            return 0
+        target = max(1, round(self.count * p / 100))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(self._upper_bound(index), self.max_ns)
+        return self.max_ns
+
+    def summary(self) -> dict:
+        return {'count': self.count,
+                'p50_us': round(self.percentile(50) / 1000, 1),
+                'p99_us': round(self.percentile(99) / 1000, 1),
+                'max_us': round(self.max_ns / 1000, 1)}
@@ -0,0 +1,72 @@
+# app/icon_cache.py
+# SVG アイコンを (色, サイズ, 倍率) ごとに一度だけ PNG に描画してディスクに保存し、次回以降はそれを読む
+from __future__ import annotations
+from typing import Iterable, Optional
+import hashlib
+import os
+import shutil
+
+from PyQt5.QtGui import QIcon, QPixmap, QPainter
+from PyQt5.QtCore import Qt, QByteArray
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), ".activity-logger", "icon-cache")
+# トレイアイコンとして要求されうる論理サイズと、Retina などの倍率
+TRAY_ICON_SIZES = (16, 22, 32)
+DEVICE_PIXEL_RATIOS = (1, 2)
+TEMPLATE_COLOR = '#000000'
+
+
+def render_svg(svg_data: str, pixel_size: int) -> QPixmap:
+    # QtSvg の読み込みもキャッシュがないときだけにする
+    from PyQt5.QtSvg import QSvgRenderer
+    renderer = QSvgRenderer(QByteArray(svg_data.encode('utf-8')))
+    pixmap = QPixmap(pixel_size, pixel_size)
+    pixmap.fill(Qt.transparent)
+    painter = QPainter(pixmap)
+    renderer.render(painter)
+    painter.end()
+    return pixmap
+
+
+class IconCache:
+    """SVG テンプレートの描画結果を、SVG の内容のハッシュごとのディレクトリに PNG で持つ。
+
+    SVG を書き換えるとハッシュが変わるので、古い描画結果は使われずに削除される。
+    color を None にするとテンプレートの色のまま描画する。
+    """
+
+    def __init__(self, svg_template: str, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.svg_template = svg_template
+        self.key = hashlib.sha256(svg_template.encode('utf-8')).hexdigest()[:16]
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, self.key)
+
+    def png_path(self, color: Optional[str], pixel_size: int) -> str:
+        """pixel_size ピクセル四方の PNG のパス。なければ描画して保存する。"""
+        name = (color or 'template').lstrip('#').lower()
+        path = os.path.join(self.path, f"{name}_{pixel_size}.png")
+        if not os.path.exists(path):
+            svg_data = self.svg_template.replace(TEMPLATE_COLOR, color) if color else self.svg_template
+            os.makedirs(self.path, exist_ok=True)
+            # 途中まで書かれたファイルを読まないように、一時ファイルに書いてから置き換える
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            if not render_svg(svg_data, pixel_size).save(tmp_path, "PNG"):
+                raise OSError(f"could not write {tmp_path}")
+            os.replace(tmp_path, path)
+        return path
+
+    def icon(self, color: Optional[str], sizes: Iterable[int] = TRAY_ICON_SIZES,
+             ratios: Iterable[int] = DEVICE_PIXEL_RATIOS) -> QIcon:
+        """すべてのサイズ・倍率の PNG を持つ QIcon。表示先に合わせて Qt が選ぶ。"""
+        icon = QIcon()
+        for pixel_size in sorted({size * ratio for size in sizes for ratio in ratios}):
+            icon.addFile(self.png_path(color, pixel_size))
+        return icon
+
+    def prune(self):
+        """今の SVG 以外のハッシュのディレクトリを消す。"""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name != self.key:
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
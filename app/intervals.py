@@ -0,0 +1,290 @@
+# app/intervals.py
+# アプリのフォーカス区間 app_intervals(app_id, start_ts, end_ts)。アプリ名は storage の apps 辞書から引く。
+# APP_SWITCH で区間を開き、次の APP_SWITCH か SYSTEM の PAUSE/STOP で閉じる。
+# 閉じた区間はローカル時刻の1時間ごとに分けて rollup_app_hourly / rollup_app_daily にも足し込む。
+# 他の端末から取り込んだイベント (host_id あり) の区間は端末ごとに作るので、端末が違えば区間は重なりうる。
+from __future__ import annotations
+from collections import defaultdict
+from typing import Iterator, Optional
+import sqlite3
+import time
+
+from .storage import NameInterner
+
+CREATE_SQL = (
+    '''CREATE TABLE IF NOT EXISTS app_intervals (
+        id INTEGER PRIMARY KEY,
+        app_id INTEGER NOT NULL REFERENCES apps (id),
+        start_ts INTEGER NOT NULL,
+        end_ts INTEGER,
+        host_id INTEGER REFERENCES hosts (id)
+    )''',
+    # 開いている区間は end_ts が NULL
+    "CREATE INDEX IF NOT EXISTS idx_app_intervals_end ON app_intervals (end_ts)",
+    "CREATE INDEX IF NOT EXISTS idx_app_intervals_start ON app_intervals (start_ts)",
+    "CREATE INDEX IF NOT EXISTS idx_app_intervals_app ON app_intervals (app_id, start_ts)",
+    # アプリ別のフォーカス時間 (マイクロ秒) の時系列。ダッシュボードのグラフはここを束ね直して描き、
+    # 1日より粗い単位では日別の方を読む (1年分でもアプリ数 × 365 行)
+    '''CREATE TABLE IF NOT EXISTS rollup_app_hourly (
+        day TEXT NOT NULL,
+        hour INTEGER NOT NULL,
+        app_id INTEGER NOT NULL REFERENCES apps (id),
+        focus_us INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, hour, app_id)
+    ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS rollup_app_daily (
+        day TEXT NOT NULL,
+        app_id INTEGER NOT NULL REFERENCES apps (id),
+        focus_us INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, app_id)
+    ) WITHOUT ROWID''',
+)
+# host_id の列ができてから (v9) 作る索引。範囲の読み出しで端末ごとに直前の区間を引く
+HOST_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS idx_app_intervals_host ON app_intervals (host_id, start_ts)",
+)
+ROLLUP_TABLES = ('rollup_app_hourly', 'rollup_app_daily')
+US_PER_SECOND = 1_000_000
+
+_OPEN_SQL = "INSERT INTO app_intervals (app_id, start_ts) VALUES (?, ?)"
+_CLOSE_SQL = "UPDATE app_intervals SET end_ts = ? WHERE end_ts IS NULL"
+_UPSERT_HOURLY = '''
+    INSERT INTO rollup_app_hourly (day, hour, app_id, focus_us) VALUES (?, ?, ?, ?)
+    ON CONFLICT (day, hour, app_id) DO UPDATE SET focus_us = focus_us + excluded.focus_us
+'''
+_UPSERT_DAILY = '''
+    INSERT INTO rollup_app_daily (day, app_id, focus_us) VALUES (?, ?, ?)
+    ON CONFLICT (day, app_id) DO UPDATE SET focus_us = focus_us + excluded.focus_us
+'''
+
+# 1台の端末 (:host、この端末は NULL) の生ログから区間を作り直すクエリ。
+# ウィンドウ関数だけで書き込み側の状態遷移と同じ結果にする:
+#   - 一時停止中の APP_SWITCH は区間を開かない (アプリ名だけ覚えておく)
+#   - RESUME は区間が閉じていれば直前のアプリで開き直す
+#   - STOP なしで START が来たとき (異常終了) は、START 直前の行の時刻で閉じる
+# 区間の途中から作り直すときは、最初の APP_SWITCH までのアプリを :app で渡す
+_REBUILD_SQL = '''
+    WITH ev AS (
+        SELECT e.ts, e.id, e.app_id,
+               CASE t.name WHEN 'APP_SWITCH' THEN 'SWITCH' WHEN 'SYSTEM' THEN e.content END AS kind,
+               LAG(e.ts) OVER (ORDER BY e.ts, e.id) AS prev_ts
+        FROM events e JOIN event_types t ON t.id = e.type_id
+        WHERE e.ts >= :since AND e.host_id IS :host
+    ), marks AS (
+        SELECT ts, id, app_id, kind, prev_ts,
+               SUM(kind = 'SWITCH') OVER w AS app_grp,
+               SUM(kind <> 'SWITCH') OVER w AS sys_grp
+        FROM ev
+        WHERE kind IN ('SWITCH', 'PAUSE', 'RESUME', 'STOP', 'START')
+        WINDOW w AS (ORDER BY ts, id)
+    ), state AS (
+        SELECT ts, id, kind, prev_ts,
+               COALESCE(FIRST_VALUE(CASE WHEN kind = 'SWITCH' THEN app_id END) OVER (PARTITION BY app_grp ORDER BY ts, id),
+                        CASE WHEN app_grp = 0 THEN :app END) AS app_id,
+               FIRST_VALUE(kind) OVER (PARTITION BY sys_grp ORDER BY ts, id) AS sys_state
+        FROM marks
+    ), transitions AS (
+        SELECT ts, id, kind, app_id, prev_ts, LAG(kind) OVER (ORDER BY ts, id) AS prev_kind
+        FROM state
+        WHERE NOT (kind = 'SWITCH' AND sys_state = 'PAUSE')
+    ), effective AS (
+        SELECT ts, id, app_id, kind IN ('SWITCH', 'RESUME') AS opens,
+               CASE WHEN kind = 'START' THEN prev_ts ELSE ts END AS closes_at
+        FROM transitions
+        -- 区間が開いたままの RESUME (直前が APP_SWITCH か RESUME) は何もしない
+        WHERE NOT (kind = 'RESUME' AND (app_id IS NULL OR COALESCE(prev_kind IN ('SWITCH', 'RESUME'), 0)))
+    )
+    INSERT INTO app_intervals (app_id, start_ts, end_ts, host_id)
+    SELECT app_id, start_ts, end_ts, :host FROM (
+        SELECT opens, app_id, ts AS start_ts, LEAD(closes_at) OVER (ORDER BY ts, id) AS end_ts
+        FROM effective
+    )
+    WHERE opens
+    ORDER BY start_ts
+'''
+
+# 区間は端末ごとには重ならないので、:start を含みうるのは各端末で :start 以前に始まった最後の区間から。
+# その中で一番早い開始時刻 (端末が1台なら従来どおり直前の区間の開始) を返す式
+LANE_START_SQL = '''(
+    SELECT COALESCE(MIN(lane_start), 0) FROM (
+        SELECT (SELECT MAX(start_ts) FROM app_intervals WHERE host_id IS h.id AND start_ts <= :start) AS lane_start
+        FROM (SELECT NULL AS id UNION ALL SELECT id FROM hosts) h
+    )
+)'''
+# [start, end) に掛かる区間を範囲で切り詰めて合計する。開いている区間は now まで数える。
+_APP_SECONDS_SQL = f'''
+    SELECT a.name, s.us FROM (
+        SELECT app_id, SUM(MIN(COALESCE(end_ts, :now), :end) - MAX(start_ts, :start)) AS us
+        FROM app_intervals
+        WHERE start_ts >= {LANE_START_SQL}
+          AND start_ts < :end AND (end_ts > :start OR end_ts IS NULL)
+        GROUP BY app_id
+    ) s JOIN apps a ON a.id = s.app_id
+'''
+_INTERVALS_SQL = f'''
+    SELECT a.name, MAX(i.start_ts, :start), MIN(COALESCE(i.end_ts, :now), :end)
+    FROM app_intervals i JOIN apps a ON a.id = i.app_id
+    WHERE i.start_ts >= {LANE_START_SQL}
+      AND i.start_ts < :end AND (i.end_ts > :start OR i.end_ts IS NULL)
+    ORDER BY i.start_ts
+'''
+
+
+def hourly_pieces(start_us: int, end_us: int) -> Iterator[tuple[str, int, int]]:
+    """[start_us, end_us) をローカル時刻の1時間ごとに分け、(日付, 時, マイクロ秒) を返す。"""
+    ts = start_us
+    while ts < end_us:
+        local = time.localtime(ts // US_PER_SECOND)
+        # その時刻を含む1時間の終わり。UTC オフセットが時単位でなくても、分と秒から求めれば正しい
+        boundary = (ts // US_PER_SECOND - local.tm_min * 60 - local.tm_sec + 3600) * US_PER_SECOND
+        piece_end = min(end_us, boundary)
+        yield time.strftime('%Y-%m-%d', local), local.tm_hour, piece_end - ts
+        ts = piece_end
+
+
+def _pieces(rows, totals: Optional[dict] = None, sign: int = 1) -> dict:
+    # (アプリID, 開始, 終了) の区間を {(日付, 時, アプリID): マイクロ秒} に足す (sign=-1 なら引く)
+    totals = defaultdict(int) if totals is None else totals
+    for app_id, start_ts, end_ts in rows:
+        for day, hour, us in hourly_pieces(start_ts, end_ts):
+            totals[(day, hour, app_id)] += sign * us
+    return totals
+
+
+def _add_rollups(conn: sqlite3.Connection, hourly: dict):
+    # {(日付, 時, アプリID): マイクロ秒} を時間別と日別の集計に足す
+    daily = defaultdict(int)
+    for (day, hour, app_id), us in hourly.items():
+        daily[(day, app_id)] += us
+    conn.executemany(_UPSERT_HOURLY, [(day, hour, app_id, us) for (day, hour, app_id), us in hourly.items()])
+    conn.executemany(_UPSERT_DAILY, [(day, app_id, us) for (day, app_id), us in daily.items()])
+
+
+class IntervalTracker:
+    """書き込みバッチを見て app_intervals の区間を開閉する。ライタースレッド専用。"""
+
+    def __init__(self, apps: NameInterner):
+        self.apps = apps
+        self.open_app: Optional[str] = None
+        self.open_app_id = 0
+        self.open_start = 0
+        self.last_app: Optional[str] = None
+        self.paused = False
+        self.last_ts = 0
+
+    def load_state(self, conn: sqlite3.Connection):
+        # 取り込んだ端末の区間は開いたままにしないので、開いている区間はこの端末のもの
+        row = conn.execute("SELECT a.name, i.app_id, i.start_ts FROM app_intervals i JOIN apps a ON a.id = i.app_id "
+                           "WHERE i.end_ts IS NULL").fetchone()
+        self.open_app, self.open_app_id, self.open_start = row if row else (None, 0, 0)
+        row = conn.execute("SELECT content FROM logs WHERE event_type = 'APP_SWITCH' AND host IS NULL "
+                           "ORDER BY ts DESC, id DESC LIMIT 1").fetchone()
+        self.last_app = row[0] if row else None
+        row = conn.execute("SELECT content FROM logs WHERE event_type = 'SYSTEM' AND host IS NULL "
+                           "ORDER BY ts DESC, id DESC LIMIT 1").fetchone()
+        self.paused = bool(row) and row[0] == 'PAUSE'
+        self.last_ts = conn.execute("SELECT COALESCE(MAX(ts), 0) FROM events WHERE host_id IS NULL").fetchone()[0]
+
+    def _close(self, conn: sqlite3.Connection, ts: int):
+        if self.open_app is not None:
+            conn.execute(_CLOSE_SQL, (ts,))
+            _add_rollups(conn, _pieces([(self.open_app_id, self.open_start, ts)]))
+            self.open_app = None
+
+    def _open(self, conn: sqlite3.Connection, app: str, ts: int):
+        self.open_app_id = self.apps.id(conn, app)
+        conn.execute(_OPEN_SQL, (self.open_app_id, ts))
+        self.open_app, self.open_start = app, ts
+
+    def apply(self, conn: sqlite3.Connection, rows: list):
+        for timestamp, ts, event_type, content in rows:
+            if event_type == 'APP_SWITCH':
+                self.last_app = content
+                if not self.paused:
+                    self._close(conn, ts)
+                    self._open(conn, content, ts)
+            elif event_type == 'SYSTEM':
+                if content in ('PAUSE', 'STOP'):
+                    self._close(conn, ts)
+                    self.paused = content == 'PAUSE'
+                elif content == 'RESUME':
+                    self.paused = False
+                    if self.open_app is None and self.last_app is not None:
+                        self._open(conn, self.last_app, ts)
+                elif content == 'START':
+                    # STOP がないまま再起動した場合は、最後に記録された時刻で閉じる
+                    self._close(conn, self.last_ts)
+                    self.paused = False
+            self.last_ts = ts
+
+
+def create_tables(conn: sqlite3.Connection):
+    for sql in CREATE_SQL:
+        conn.execute(sql)
+
+
+def _rebuild_lane(conn: sqlite3.Connection, host_id: Optional[int], since_us: int, app_id: Optional[int] = None):
+    conn.execute("DELETE FROM app_intervals WHERE host_id IS ? AND start_ts >= ?", (host_id, since_us))
+    conn.execute(_REBUILD_SQL, {'since': since_us, 'host': host_id, 'app': app_id})
+    if host_id is not None:
+        # 取り込んだ端末の最後の区間は、その端末で最後に記録された時刻で閉じる
+        conn.execute("UPDATE app_intervals SET end_ts = (SELECT MAX(ts) FROM events WHERE host_id = :host AND ts >= :since) "
+                     "WHERE host_id = :host AND end_ts IS NULL", {'host': host_id, 'since': since_us})
+
+
+def rebuild(conn: sqlite3.Connection, since_us: int = 0):
+    """since_us 以降に始まる区間を端末ごとに生ログから作り直す (呼び出し側でトランザクションを管理する)。"""
+    create_tables(conn)
+    for (host_id,) in conn.execute("SELECT NULL UNION ALL SELECT id FROM hosts").fetchall():
+        _rebuild_lane(conn, host_id, since_us)
+    rebuild_rollups(conn, since_us)
+
+
+def rebuild_host(conn: sqlite3.Connection, host_id: int, since_us: int):
+    """取り込んだ端末の since_us 以降のイベントから区間を作り直し、アプリ別の集計は差分だけ直す。
+
+    since_us を含む区間の始めから作り直すので、それより前の区間と集計には触れない
+    (呼び出し側でトランザクションを管理する)。
+    """
+    row = conn.execute("SELECT start_ts, app_id FROM app_intervals WHERE host_id = ? AND start_ts <= ? "
+                       "ORDER BY start_ts DESC LIMIT 1", (host_id, since_us)).fetchone()
+    since_us, app_id = row if row else (0, None)
+    select = "SELECT app_id, start_ts, end_ts FROM app_intervals WHERE host_id = ? AND start_ts >= ? AND end_ts IS NOT NULL"
+    totals = _pieces(conn.execute(select, (host_id, since_us)), sign=-1)
+    _rebuild_lane(conn, host_id, since_us, app_id)
+    _add_rollups(conn, {key: us for key, us in _pieces(conn.execute(select, (host_id, since_us)), totals).items() if us})
+    # 差し引きで 0 になった行は、作り直したときと同じになるように消す
+    since_day = time.strftime('%Y-%m-%d', time.localtime(since_us // US_PER_SECOND)) if since_us else ''
+    for table in ROLLUP_TABLES:
+        conn.execute(f"DELETE FROM {table} WHERE day >= ? AND focus_us = 0", (since_day,))
+
+
+def local_midnight_us(ts_us: int) -> int:
+    """ts_us を含むローカル日付の0時 (エポックマイクロ秒)。"""
+    local = time.localtime(ts_us // US_PER_SECOND)
+    return int(time.mktime((local.tm_year, local.tm_mon, local.tm_mday, 0, 0, 0, 0, 0, -1))) * US_PER_SECOND
+
+
+def rebuild_rollups(conn: sqlite3.Connection, since_us: int = 0):
+    """since_us を含む日以降のアプリ別の集計を閉じた区間から作り直す (呼び出し側でトランザクションを管理する)。"""
+    create_tables(conn)
+    since_us = local_midnight_us(since_us) if since_us else 0
+    since_day = time.strftime('%Y-%m-%d', time.localtime(since_us // US_PER_SECOND)) if since_us else ''
+    for table in ROLLUP_TABLES:
+        conn.execute(f"DELETE FROM {table} WHERE day >= ?", (since_day,))
+    _add_rollups(conn, _pieces(conn.execute("SELECT app_id, MAX(start_ts, ?), end_ts FROM app_intervals WHERE end_ts > ?",
+                                            (since_us, since_us))))
+
+
+def app_seconds(conn: sqlite3.Connection, start_us: int, end_us: int, now_us: int) -> dict[str, float]:
+    """[start_us, end_us) のアプリ別フォーカス秒数。"""
+    params = {'start': start_us, 'end': end_us, 'now': now_us}
+    return {app: us / 1_000_000 for app, us in conn.execute(_APP_SECONDS_SQL, params) if us > 0}
+
+
+def iter_intervals(conn: sqlite3.Connection, start_us: int, end_us: int, now_us: int) -> Iterator[tuple]:
+    """[start_us, end_us) に掛かる (app, start_ts, end_ts) を範囲で切り詰めて開始順に返す。"""
+    params = {'start': start_us, 'end': end_us, 'now': now_us}
+    for app, start_ts, end_ts in conn.execute(_INTERVALS_SQL, params):
+        if end_ts > start_ts:
+            yield app, start_ts, end_ts
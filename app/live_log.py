@@ -0,0 +1,130 @@
+# app/live_log.py
+# Live Log の表示用モデル。直近のイベントだけをリングに持ち、古い履歴は DB からページ単位で読む。
+from __future__ import annotations
+from collections import deque
+from typing import Callable, Deque, List
+import datetime as _dt
+import sqlite3
+
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, QTimer, Qt
+from PyQt5.QtGui import QColor
+
+from .database import to_epoch_us
+from .log_sink import FRAME_INTERVAL_MS
+from .queries import Event, events_before
+
+LIVE_LOG_CAPACITY = 20000
+HISTORY_PAGE_SIZE = 200
+
+_SYSTEM_LABELS = {'START': "🟢 Logging started", 'STOP': "⏹ Logging stopped",
+                  'PAUSE': "⏸️ Logging paused", 'RESUME': "▶️ Logging resumed"}
+_KEY_LABELS = {'[ENTER]': "⏎", '[BACKSPACE]': "[<-]"}
+_SYSTEM_COLOR = QColor("#64748b")
+
+
+def format_event(event: Event) -> str:
+    clock = event.timestamp[11:19]
+    if event.event_type == 'APP_SWITCH':
+        return f"{clock}  🗂️  APP  {event.content}"
+    if event.event_type == 'SYSTEM':
+        return f"{clock}  {_SYSTEM_LABELS.get(event.content, event.content)}"
+    return f"{clock}  {_KEY_LABELS.get(event.content, event.content)}"
+
+
+class LiveLogModel(QAbstractListModel):
+    """1行1イベントのリストモデル。
+
+    追加は1フレーム分をまとめて末尾に挿入し、capacity を超えた分は先頭から捨てるので、
+    セッションが長くなっても追加のコストとメモリは一定。fetch_older() は先頭より前の
+    イベントを DB からキーセット (ts, id) で1ページ読んで先頭に足す。履歴の読み込みも
+    capacity までで、それより古い行はその時点では表示しない。
+    """
+
+    def __init__(self, reader: Callable[[], sqlite3.Connection], capacity: int = LIVE_LOG_CAPACITY,
+                 page_size: int = HISTORY_PAGE_SIZE, parent=None):
+        super().__init__(parent)
+        self.reader = reader
+        self.capacity = capacity
+        self.page_size = page_size
+        self._rows: Deque[Event] = deque()
+        self._pending: List[Event] = []
+        # これより前 (ts, id) の行は DB から読む。起動時点より前が履歴になる
+        self._history_before = (to_epoch_us(_dt.datetime.now()), 0)
+        self.history_exhausted = False
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(FRAME_INTERVAL_MS)
+        self._timer.timeout.connect(self.flush)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        event = self._rows[index.row()]
+        if role == Qt.DisplayRole:
+            return format_event(event)
+        if role == Qt.ForegroundRole and event.event_type == 'SYSTEM':
+            return _SYSTEM_COLOR
+        return None
+
+    def append(self, event: Event):
+        self._pending.append(event)
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def notice(self, text: str):
+        """DB に残さないお知らせ (記録を始められなかったときなど) を SYSTEM の行として足す。"""
+        now = _dt.datetime.now()
+        self.append(Event(None, to_epoch_us(now), now.isoformat(), 'SYSTEM', text))
+
+    def flush(self):
+        self._timer.stop()
+        if not self._pending:
+            return
+        pending, self._pending = self._pending[-self.capacity:], []
+        overflow = len(self._rows) + len(pending) - self.capacity
+        if overflow > 0:
+            self._drop_front(min(overflow, len(self._rows)))
+        first = len(self._rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(pending) - 1)
+        self._rows.extend(pending)
+        self.endInsertRows()
+
+    def _drop_front(self, count: int):
+        self.beginRemoveRows(QModelIndex(), 0, count - 1)
+        for _ in range(count):
+            self._rows.popleft()
+        self.endRemoveRows()
+        # 捨てた行はまた DB から読めるように、境界を新しい先頭に合わせる
+        head = self._rows[0] if self._rows else None
+        if head is not None:
+            self._history_before = (head.ts, head.id or 0)
+            self.history_exhausted = False
+
+    def trim(self, keep: int):
+        """末尾 keep 行だけを残す (ウィンドウを閉じている間のメモリ削減用)。"""
+        self.flush()
+        if len(self._rows) > keep:
+            self._drop_front(len(self._rows) - keep)
+
+    def fetch_older(self) -> int:
+        """先頭より前の履歴を1ページ読んで先頭に足し、足した行数を返す。"""
+        if self.history_exhausted or len(self._rows) >= self.capacity:
+            return 0
+        limit = min(self.page_size, self.capacity - len(self._rows))
+        try:
+            rows = events_before(self.reader(), *self._history_before, limit)
+        except sqlite3.Error as e:
+            print(f"Live Log history error: {e}")
+            return 0
+        if len(rows) < limit:
+            self.history_exhausted = True
+        if not rows:
+            return 0
+        self.beginInsertRows(QModelIndex(), 0, len(rows) - 1)
+        self._rows.extendleft(rows)
+        self.endInsertRows()
+        self._history_before = (rows[-1].ts, rows[-1].id)
+        return len(rows)
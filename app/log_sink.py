@@ -0,0 +1,59 @@
+# app/log_sink.py
+# Live Log へのテキスト出力をまとめて反映するシンク
+from __future__ import annotations
+from typing import Callable, List, TextIO
+import sys
+
+from PyQt5.QtCore import QObject, QTimer
+
+FRAME_INTERVAL_MS = 16
+
+
+class ConsoleLogHandler:
+    """コンソールへの出力。イベント毎に flush せず、ストリームのバッファに任せる。"""
+
+    def __init__(self, stream: TextIO | None = None):
+        self.stream = stream or sys.stdout
+
+    def __call__(self, text: str):
+        self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class CoalescingLogSink(QObject):
+    """gui_log_received のテキストを溜めておき、1フレームに1回だけまとめて出力先に渡す。
+
+    タイマーはテキストが溜まっている間だけ動くので、アイドル時にウェイクアップはしない。
+    """
+
+    def __init__(self, interval_ms: int = FRAME_INTERVAL_MS, parent: QObject | None = None):
+        super().__init__(parent)
+        self._pending: List[str] = []
+        self._outputs: List[Callable[[str], None]] = []
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(interval_ms)
+        self._timer.timeout.connect(self.flush)
+
+    def add_output(self, output: Callable[[str], None]):
+        self._outputs.append(output)
+
+    def remove_output(self, output: Callable[[str], None]):
+        if output in self._outputs:
+            self._outputs.remove(output)
+
+    def append(self, text: str):
+        self._pending.append(text)
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def flush(self):
+        self._timer.stop()
+        if not self._pending:
+            return
+        text = ''.join(self._pending)
+        self._pending.clear()
+        for output in self._outputs:
+            output(text)
@@ -1,31 +1,68 @@
 # app/main.py
+import time
+_STARTED_AT = time.perf_counter()
+
 import sys
 import signal
 import os
 
 from PyQt5.QtWidgets import QApplication, QMessageBox, QSystemTrayIcon, QAction, QMenu
 from PyQt5.QtGui import QIcon
+from PyQt5.QtCore import QCoreApplication, Qt, QTimer
 
 from .main_window import AppWindow
 from .database import DatabaseManager
 from .config import ConfigManager
 from .event_monitor import EventTapManager
-from .utils import resource_path, create_icon_from_svg
+from .icon_cache import IconCache
+from .profiling import StartupProfiler, profiling_requested
+from .sources import create_source
+from .utils import resource_path
 
 def main():
+    # --profile-startup: トレイ表示・最初のキャプチャまでの時間を stderr に出す
+    profiler = StartupProfiler(_STARTED_AT, profiling_requested())
+    profiler.mark("imports")
+
+    # QtWebEngine をダッシュボードを開くまで読み込まないために必要 (QApplication 生成前に設定する)
+    QCoreApplication.setAttribute(Qt.AA_ShareOpenGLContexts)
+    # Retina では @2x の PNG を使う
+    QCoreApplication.setAttribute(Qt.AA_UseHighDpiPixmaps)
     app = QApplication(sys.argv)
     app.setQuitOnLastWindowClosed(False)
 
 
     storage_path = os.path.join(os.path.expanduser('~'), ".activity-logger")
-    db_manager = DatabaseManager(os.path.join(storage_path, "activity.db"))
     config_manager = ConfigManager(os.path.join(storage_path, "config.json"))
-    event_manager = EventTapManager()
+    config = config_manager.load()
+    db_manager = DatabaseManager(os.path.join(storage_path, "activity.db"),
+                                 write_behind=config['write_behind'],
+                                 batch_size=config['write_batch_size'],
+                                 flush_interval_ms=config['write_flush_interval_ms'],
+                                 queue_size=config['write_queue_size'])
+    event_manager = EventTapManager(create_source(config['capture_source'], **config['capture_source_options']))
     
 
+    # ウィンドウの各ページは初めて開いたときに作る
     window = AppWindow(db_manager, config_manager, event_manager)
+    profiler.mark("window_created")
+    event_manager.events_captured.connect(lambda count: profiler.mark("first_captured_event"))
+
 
+    # ローカルのクエリサーバー (既定では無効)。読み取り接続だけを使い、GUI スレッドでは答えない
+    if config['query_server']:
+        from .server import QueryServer
+        query_server = QueryServer(db_manager, config['query_server_socket'] or None, config['query_server_port'], config['query_server_cache_ttl_s'])
+        try:
+            query_server.start(); app.aboutToQuit.connect(query_server.close)
+        except OSError as e:
+            print(f"Query server error: {e}")
 
+    # 入力途中のチャンクをキューに積んでから、ライターを閉じて書き出す。
+    # 終了時も STOP を記録して、アプリのフォーカス区間を閉じる
+    app.aboutToQuit.connect(lambda: window.stop_logging() if event_manager.is_running() else None)
+    app.aboutToQuit.connect(event_manager.flush_buffer)
+    app.aboutToQuit.connect(window.flush_log_output)
     app.aboutToQuit.connect(db_manager.close)
     
  
@@ -38,8 +75,11 @@ def main():
         with open(ICON_PATH, 'r', encoding='utf-8') as f:
             svg_template_string = f.read()
         COLOR_ACTIVE = "#007AFF"; COLOR_INACTIVE = "#8E8E93"
-        icon_active = create_icon_from_svg(svg_template_string, COLOR_ACTIVE)
-        icon_inactive = create_icon_from_svg(svg_template_string, COLOR_INACTIVE)
+        # 描画済みの PNG があれば SVG は描画しない
+        icon_cache = IconCache(svg_template_string, os.path.join(storage_path, "icon-cache"))
+        icon_active = icon_cache.icon(COLOR_ACTIVE)
+        icon_inactive = icon_cache.icon(COLOR_INACTIVE)
+        icon_cache.prune()
     except Exception as e:
         print(f"Icon setup error: {e}"); icon_active, icon_inactive = QIcon(), QIcon()
         
@@ -55,6 +95,7 @@ def main():
     show_window_action = QAction("Open Window...", menu); show_window_action.triggered.connect(window.show)
     menu.addAction(show_window_action)
     view_db_action = QAction("Open Database...", menu); view_db_action.triggered.connect(window.open_database_viewer); menu.addAction(view_db_action)
+    export_action = QAction("Export Data...", menu); export_action.triggered.connect(window.open_export_dialog); menu.addAction(export_action)
     menu.addSeparator(); quit_action = QAction("Quit", menu); quit_action.triggered.connect(app.quit); menu.addAction(quit_action)
     
     tray_icon.setContextMenu(menu)
@@ -74,6 +115,27 @@ def main():
             tray_icon.setIcon(icon_inactive); pause_action.setText("Pause")
 
     window.logging_status_changed.connect(update_tray_menu)
+    profiler.mark("tray_visible")
+
+    # トレイを出してからキャプチャを始める
+    if config.get('auto_start_logging', True):
+        window.start_logging()
+    profiler.mark("capture_started")
+
+    # 古いログのアーカイブはライタースレッドで行い、GUI は待たない
+    def run_retention():
+        def report(future):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Retention error: {e}"); return
+            if result['moved'] or result['compressed']:
+                print(f"Retention: archived {result['moved']} rows, compressed {result['compressed']} months, freed {result['freed_pages']} pages")
+        db_manager.archive_old_logs(config['retention_hot_days'], wait=False).add_done_callback(report)
+    if config['retention_hot_days'] > 0:
+        retention_timer = QTimer(app); retention_timer.timeout.connect(run_retention)
+        retention_timer.start(int(config['retention_check_interval_h'] * 3600 * 1000))
+        QTimer.singleShot(60 * 1000, run_retention)
 
     signal.signal(signal.SIGINT, signal.SIG_DFL)
     sys.exit(app.exec_())
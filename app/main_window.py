@@ -1,23 +1,38 @@
 # app/main_window.py
 from __future__ import annotations
-from typing import Dict
 import datetime as _dt
+import html
+import importlib.util
 import os
+import time
 import webbrowser
 import subprocess
-from collections import defaultdict
 
 from PyQt5.QtWidgets import (
-    QMainWindow, QTextEdit, QPushButton, QVBoxLayout, QHBoxLayout,
-    QWidget, QMessageBox, QLabel, QFrame, QStackedWidget, QCheckBox
+    QMainWindow, QListView, QAbstractItemView, QPushButton, QVBoxLayout, QHBoxLayout,
+    QWidget, QMessageBox, QLabel, QFrame, QStackedWidget, QCheckBox,
+    QLineEdit, QDateEdit, QComboBox, QTextBrowser, QDialog, QDialogButtonBox, QFormLayout,
+    QFileDialog, QProgressDialog
 )
 from PyQt5.QtGui import QFont
-from PyQt5.QtCore import pyqtSignal, Qt
-from PyQt5.QtWebEngineWidgets import QWebEngineView
+from PyQt5.QtCore import pyqtSignal, Qt, QDate, QThreadPool, QTimer, QUrl
 
-from .database import DatabaseManager
+from . import queries
+from . import search
+from .database import DatabaseManager, day_range_us, to_epoch_us
 from .config import ConfigManager
 from .event_monitor import EventTapManager
+from .chart import CHART_PAGE, chart_update_script, trend_update_script
+from .live_log import LiveLogModel
+from .log_sink import CoalescingLogSink, ConsoleLogHandler
+from .profiling import format_mb, resident_memory_bytes
+from .utils import resource_path
+from .workers import DashboardRefreshTask, ExportTask, SearchTask
+
+# 今日を含む期間の集計を使い回す秒数 (開いている区間のフォーカス時間は行が増えなくても伸びる)
+DASHBOARD_LIVE_CACHE_S = 60
+# 設定画面でアーカイブを有効にしたときに本体の DB に残す日数
+ARCHIVE_HOT_DAYS = 90
 
 class AppWindow(QMainWindow):
     logging_status_changed = pyqtSignal(bool, bool, str)
@@ -29,18 +44,32 @@ class AppWindow(QMainWindow):
         self.config = self.config_manager.load()
         self.event_manager = event_manager
 
+        # ダッシュボードの集計はバックグラウンドで行い、(期間, 最大行ID[, 分]) をキーに結果を使い回す
+        self.thread_pool = QThreadPool(self); self.thread_pool.setMaxThreadCount(2)
+        self._dashboard_generation = 0
+        self._dashboard_cache = None
+        self._search_generation = 0; self._search_started = 0.0
+
         self.setWindowTitle('Activity Logger')
         self.setGeometry(150, 150, 900, 700)
         self.setStyleSheet("QMainWindow { background-color: #f1f5f9; } QPushButton { font-size: 14px; }")
 
         # Connect event monitor signals to this window's slots
-        self.event_manager.log_event_received.connect(self.db_manager.add_log_entry)
-        self.event_manager.gui_log_received.connect(self.update_gui_log_slot)
+        self.event_manager.log_event_received.connect(self.record_log_event)
+        # Live Log は1イベント1行のモデルで、ページを開く前から直近の分だけを持っておく
+        self.log_model = LiveLogModel(self.db_manager.reader, parent=self); self._log_follow = True
+        # コンソールへの出力は1フレームに1回まとめて反映する
+        self.log_sink = CoalescingLogSink(parent=self)
+        self.console_log = ConsoleLogHandler() if self.config.get('console_log', True) else None
+        if self.console_log: self.log_sink.add_output(self.console_log)
+        self.event_manager.gui_log_received.connect(self.log_sink.append)
 
+        # ウィンドウを閉じてしばらくしたら web ビューを破棄し、Live Log を末尾だけにする
+        self._background_timer = QTimer(self); self._background_timer.setSingleShot(True)
+        self._background_timer.timeout.connect(self.enter_background_mode)
+
+        # 自動開始は main でトレイを表示してから行う
         self.init_ui()
-        
-        if self.config.get('auto_start_logging', True):
-            self.start_logging()
 
     def init_ui(self):
         central_widget = QWidget(self)
@@ -54,45 +83,102 @@ class AppWindow(QMainWindow):
         
         self.dashboard_button = QPushButton("Dashboard")
         self.log_button = QPushButton("Live Log")
+        self.search_button = QPushButton("Search")
         self.settings_button = QPushButton("Settings")
         self.dashboard_button.clicked.connect(lambda: self.switch_view(0))
         self.log_button.clicked.connect(lambda: self.switch_view(1))
-        self.settings_button.clicked.connect(lambda: self.switch_view(2))
+        self.search_button.clicked.connect(lambda: self.switch_view(2))
+        self.settings_button.clicked.connect(lambda: self.switch_view(3))
         
-        nav_layout.addWidget(self.dashboard_button); nav_layout.addWidget(self.log_button)
+        nav_layout.addWidget(self.dashboard_button); nav_layout.addWidget(self.log_button); nav_layout.addWidget(self.search_button)
         nav_layout.addWidget(self.settings_button); nav_layout.addStretch()
         main_layout.addWidget(nav_bar)
 
         self.stacked_widget = QStackedWidget(); main_layout.addWidget(self.stacked_widget)
         
-        self.stacked_widget.addWidget(self.create_dashboard_page())
-        self.stacked_widget.addWidget(self.create_log_page())
-        self.stacked_widget.addWidget(self.create_settings_page())
-        
-        self.switch_view(0)
+        # ページは初めて表示するときに作る (QtWebEngine の読み込みもダッシュボードを開くまで遅らせる)
+        self._page_factories = [self.create_dashboard_page, self.create_log_page, self.create_search_page, self.create_settings_page]
+        self._pages_built = [False] * len(self._page_factories)
+        for _ in self._page_factories: self.stacked_widget.addWidget(QWidget())
+        self._current_view = 0
+
 
+    def ensure_page(self, index: int):
+        if self._pages_built[index]: return
+        placeholder = self.stacked_widget.widget(index); page = self._page_factories[index]()
+        self.stacked_widget.insertWidget(index, page); self.stacked_widget.removeWidget(placeholder); placeholder.deleteLater()
+        self._pages_built[index] = True
+    def release_page(self, index: int):
+        if not self._pages_built[index]: return
+        page = self.stacked_widget.widget(index)
+        self.stacked_widget.insertWidget(index, QWidget()); self.stacked_widget.removeWidget(page); page.deleteLater()
+        self._pages_built[index] = False
 
     def create_dashboard_page(self) -> QWidget:
+        from PyQt5.QtWebEngineWidgets import QWebEngineView
         page = QWidget(); layout = QVBoxLayout(page); layout.setContentsMargins(20, 20, 20, 20); layout.setSpacing(20)
-        title = QLabel("Today's Activity Summary"); title_font = QFont(); title_font.setPointSize(24); title_font.setBold(True); title.setFont(title_font)
-        title.setAlignment(Qt.AlignCenter); layout.addWidget(title)
+        self.dashboard_title = QLabel("Today's Activity Summary"); title_font = QFont(); title_font.setPointSize(24); title_font.setBold(True); self.dashboard_title.setFont(title_font)
+        self.dashboard_title.setAlignment(Qt.AlignCenter); layout.addWidget(self.dashboard_title)
+        # 期間を選ぶ。どの期間も時間別・日別の集計から作るので、長い期間でも生ログは読まない
+        range_layout = QHBoxLayout(); today = QDate.currentDate()
+        self.dashboard_range = QComboBox()
+        for label, key in (("Today", 'day'), ("Last 7 days", 'week'), ("Last 30 days", 'month'), ("Last 12 months", 'year'), ("Custom", 'custom')): self.dashboard_range.addItem(label, key)
+        self.dashboard_from = QDateEdit(today.addDays(-6)); self.dashboard_from.setCalendarPopup(True); self.dashboard_to = QDateEdit(today); self.dashboard_to.setCalendarPopup(True)
+        self.dashboard_custom = QWidget(); custom_layout = QHBoxLayout(self.dashboard_custom); custom_layout.setContentsMargins(0, 0, 0, 0)
+        custom_layout.addWidget(QLabel("From")); custom_layout.addWidget(self.dashboard_from); custom_layout.addWidget(QLabel("To")); custom_layout.addWidget(self.dashboard_to); self.dashboard_custom.setVisible(False)
+        range_layout.addStretch(1); range_layout.addWidget(self.dashboard_range); range_layout.addWidget(self.dashboard_custom); range_layout.addStretch(1); layout.addLayout(range_layout)
+        self.dashboard_range.currentIndexChanged.connect(self.on_dashboard_range_changed)
+        self.dashboard_from.dateChanged.connect(self.refresh_dashboard_data); self.dashboard_to.dateChanged.connect(self.refresh_dashboard_data)
         stats_layout = QHBoxLayout(); stats_layout.setSpacing(20)
         self.keystrokes_label_val = QLabel("Calculating..."); self.top_apps_label_val = QLabel("No data")
-        stats_layout.addWidget(self.create_stat_card("Today's Total Keystrokes", self.keystrokes_label_val))
+        stats_layout.addWidget(self.create_stat_card("Total Keystrokes", self.keystrokes_label_val))
         stats_layout.addWidget(self.create_stat_card("Top 3 Most Used Apps", self.top_apps_label_val)); layout.addLayout(stats_layout)
+        # グラフのページは一度だけ読み込み、更新は runJavaScript でデータだけ送る
         self.chart_view = QWebEngineView(); layout.addWidget(self.chart_view)
+        self._chart_ready = False; self._pending_chart = None
+        self.chart_view.loadFinished.connect(self.on_chart_loaded)
+        self.chart_view.load(QUrl.fromLocalFile(resource_path(CHART_PAGE)))
         return page
     def create_log_page(self) -> QWidget:
         page = QWidget(); layout = QVBoxLayout(page)
-        self.log_text_edit = QTextEdit(); self.log_text_edit.setReadOnly(True)
-        self.log_text_edit.setFont(QFont("Monaco", 12)); self.log_text_edit.setStyleSheet("background-color: #ffffff; border: none; padding: 10px;")
-        layout.addWidget(self.log_text_edit)
+        # 行の高さを揃えて、見えている行だけを描画する
+        self.log_view = QListView(); self.log_view.setModel(self.log_model); self.log_view.setUniformItemSizes(True)
+        self.log_view.setVerticalScrollMode(QAbstractItemView.ScrollPerItem); self.log_view.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.log_view.setFont(QFont("Monaco", 12)); self.log_view.setStyleSheet("background-color: #ffffff; border: none; padding: 10px;")
+        self.log_model.rowsAboutToBeInserted.connect(self.on_log_rows_about_to_be_inserted); self.log_model.rowsInserted.connect(self.on_log_rows_inserted)
+        self.log_view.verticalScrollBar().valueChanged.connect(self.on_log_scrolled)
+        layout.addWidget(self.log_view)
+        # 起動前の履歴も1ページ分だけ見せておく
+        self.log_model.fetch_older(); self.log_view.scrollToBottom()
+        return page
+    def create_search_page(self) -> QWidget:
+        page = QWidget(); layout = QVBoxLayout(page); layout.setContentsMargins(20, 20, 20, 20); layout.setSpacing(10)
+        controls = QHBoxLayout(); today = QDate.currentDate()
+        self.search_input = QLineEdit(); self.search_input.setPlaceholderText("Search typed text..."); self.search_input.setClearButtonEnabled(True)
+        self.search_from = QDateEdit(today.addDays(-30)); self.search_from.setCalendarPopup(True)
+        self.search_to = QDateEdit(today); self.search_to.setCalendarPopup(True)
+        self.search_app = QComboBox(); self.search_app.addItem("All apps", None)
+        try:
+            for app in search.search_apps(self.db_manager.reader()): self.search_app.addItem(app, app)
+        except Exception as e: print(f"Search app list error: {e}")
+        controls.addWidget(self.search_input, 1); controls.addWidget(QLabel("From")); controls.addWidget(self.search_from)
+        controls.addWidget(QLabel("To")); controls.addWidget(self.search_to); controls.addWidget(self.search_app); layout.addLayout(controls)
+        self.search_status = QLabel(""); self.search_status.setStyleSheet("color: #64748b;"); layout.addWidget(self.search_status)
+        self.search_results = QTextBrowser(); self.search_results.setStyleSheet("background-color: #ffffff; border: none; padding: 10px;"); layout.addWidget(self.search_results)
+        # 入力中は少し待ってから検索し、古い検索の結果は捨てる
+        self._search_timer = QTimer(self); self._search_timer.setSingleShot(True); self._search_timer.setInterval(150); self._search_timer.timeout.connect(self.run_search)
+        self.search_input.textChanged.connect(self._search_timer.start); self.search_input.returnPressed.connect(self.run_search)
+        self.search_from.dateChanged.connect(self.run_search); self.search_to.dateChanged.connect(self.run_search); self.search_app.currentIndexChanged.connect(self.run_search)
         return page
     def create_settings_page(self) -> QWidget:
         page = QWidget(); layout = QVBoxLayout(page); layout.setContentsMargins(30, 30, 30, 30); layout.setSpacing(25)
         title = QLabel("Settings"); title_font = QFont(); title_font.setPointSize(24); title_font.setBold(True); title.setFont(title_font); layout.addWidget(title)
         self.auto_start_checkbox = QCheckBox("Start logging automatically on launch"); self.auto_start_checkbox.setChecked(self.config.get('auto_start_logging', True))
-        self.auto_start_checkbox.stateChanged.connect(self.save_settings); layout.addWidget(self.auto_start_checkbox); layout.addStretch(1)
+        self.auto_start_checkbox.stateChanged.connect(self.save_settings); layout.addWidget(self.auto_start_checkbox)
+        hot_days = self.config.get('retention_hot_days', 0)
+        self.archive_checkbox = QCheckBox(f"Move logs older than {hot_days if hot_days > 0 else ARCHIVE_HOT_DAYS} days to monthly archives (takes effect on next launch)")
+        self.archive_checkbox.setToolTip("Archived months are zipped next to activity.db and no longer visible when opening the database directly.")
+        self.archive_checkbox.setChecked(hot_days > 0); self.archive_checkbox.stateChanged.connect(self.save_settings); layout.addWidget(self.archive_checkbox); layout.addStretch(1)
         login_items_frame = QFrame(); login_items_frame.setFrameShape(QFrame.StyledPanel); login_items_layout = QVBoxLayout(login_items_frame)
         login_items_title = QLabel("How to run this app on computer startup:"); login_items_title.setFont(QFont("sans-serif", 16, QFont.Bold))
         login_items_text = QLabel("1. Open System Settings > General > Login Items.\n2. Click the '+' button.\n3. Find and select 'ActivityLogger.app' in your Applications folder.")
@@ -105,28 +191,67 @@ class AppWindow(QMainWindow):
         value_label.setStyleSheet("color: #0f172a; font-size: 28px; font-weight: bold;"); value_label.setWordWrap(True); layout.addWidget(title_label); layout.addWidget(value_label)
         return frame
     def switch_view(self, index):
+        self._current_view = index; self.ensure_page(index)
         self.stacked_widget.setCurrentIndex(index); style_active = "background-color: #ffffff; border: none; padding: 8px 12px; border-radius: 6px;"; style_inactive = "background-color: transparent; border: none; padding: 8px 12px;"
-        self.dashboard_button.setStyleSheet(style_inactive); self.log_button.setStyleSheet(style_inactive); self.settings_button.setStyleSheet(style_inactive)
+        for button in (self.dashboard_button, self.log_button, self.search_button, self.settings_button): button.setStyleSheet(style_inactive)
         if index == 0: self.refresh_dashboard_data(); self.dashboard_button.setStyleSheet(style_active)
         elif index == 1: self.log_button.setStyleSheet(style_active)
-        elif index == 2: self.settings_button.setStyleSheet(style_active)
+        elif index == 2: self.search_button.setStyleSheet(style_active); self.search_input.setFocus()
+        elif index == 3: self.settings_button.setStyleSheet(style_active)
+    def on_dashboard_range_changed(self):
+        self.dashboard_custom.setVisible(self.dashboard_range.currentData() == 'custom'); self.refresh_dashboard_data()
+    def selected_dashboard_range(self) -> tuple:
+        key = self.dashboard_range.currentData()
+        if key != 'custom': return queries.preset_range(key, _dt.date.today())
+        start, end = sorted((self.dashboard_from.date().toPyDate(), self.dashboard_to.date().toPyDate()))
+        return start, end + _dt.timedelta(days=1)
     def refresh_dashboard_data(self):
-        today_str = _dt.date.today().isoformat()
-        self.db_manager.cursor.execute("SELECT content FROM logs WHERE event_type = 'KEYSTROKE' AND date(timestamp) = ?", (today_str,))
-        total_keys = sum(len(row[0]) for row in self.db_manager.cursor.fetchall() if not row[0].startswith('[')); self.keystrokes_label_val.setText(f"{total_keys:,}")
-        self.db_manager.cursor.execute("SELECT timestamp, content FROM logs WHERE event_type = 'APP_SWITCH' AND date(timestamp) = ? ORDER BY timestamp ASC", (today_str,))
-        app_switches = self.db_manager.cursor.fetchall(); app_durations = defaultdict(float)
-        if len(app_switches) > 1:
-            for i in range(len(app_switches) - 1):
-                duration = (_dt.datetime.fromisoformat(app_switches[i+1][0]) - _dt.datetime.fromisoformat(app_switches[i][0])).total_seconds()
-                app_durations[app_switches[i][1]] += duration
-        sorted_apps = sorted(app_durations.items(), key=lambda item: item[1], reverse=True)
-        top_apps_text = "".join([f"{i+1}. {app} ({int(dur/60)} min)<br>" for i, (app, dur) in enumerate(sorted_apps[:3])]); self.top_apps_label_val.setText(top_apps_text or "No data available")
-        self.update_chart(app_durations)
-    def update_chart(self, app_durations: Dict[str, float]):
-        labels = list(app_durations.keys()); data = list(app_durations.values())
-        chart_html = f"""<html><head><script src="https://cdn.jsdelivr.net/npm/chart.js"></script></head><body style="display: flex; justify-content: center; align-items: center; height: 100vh; margin: 0;"><canvas id="chart"></canvas><script>new Chart(document.getElementById('chart'), {{type: 'doughnut', data: {{ labels: {labels}, datasets: [{{ label: 'Time (seconds)', data: {data}, backgroundColor: ['#3b82f6','#ef4444','#10b981','#f97316','#8b5cf6','#eab308','#64748b'] }}] }}, options: {{ responsive: true, maintainAspectRatio: false, plugins: {{ legend: {{ position: 'right' }} }} }} }});</script></body></html>"""
-        self.chart_view.setHtml(chart_html)
+        start, end = self.selected_dashboard_range(); cache_key = (start, end, self.db_manager.last_row_id)
+        if end > _dt.date.today(): cache_key += (int(time.time() // DASHBOARD_LIVE_CACHE_S),)
+        if self._dashboard_cache and self._dashboard_cache[0] == cache_key: return
+        self._dashboard_generation += 1
+        task = DashboardRefreshTask(self.db_manager, start, end, self._dashboard_generation, cache_key, self.is_current_dashboard_request)
+        task.signals.finished.connect(self.on_dashboard_data_ready); task.signals.failed.connect(self.on_dashboard_data_failed)
+        self.thread_pool.start(task)
+    def is_current_dashboard_request(self, generation: int) -> bool:
+        return generation == self._dashboard_generation
+    def on_dashboard_data_ready(self, generation: int, cache_key, summary: queries.RangeSummary):
+        if not self.is_current_dashboard_request(generation): return
+        self._dashboard_cache = (cache_key, summary); last_day = summary.end - _dt.timedelta(days=1)
+        title = f"Activity Summary: {summary.start} – {last_day}" if summary.start != last_day else "Today's Activity Summary" if last_day == _dt.date.today() else f"Activity Summary: {last_day}"; self.dashboard_title.setText(title)
+        self.keystrokes_label_val.setText(f"{summary.total_keys:,}")
+        sorted_apps = sorted(summary.app_durations.items(), key=lambda item: item[1], reverse=True)
+        duration_text = lambda dur: f"{dur/3600:.1f} h" if dur >= 36000 else f"{int(dur/60)} min"
+        top_apps_text = "".join([f"{i+1}. {app} ({duration_text(dur)})<br>" for i, (app, dur) in enumerate(sorted_apps[:3])]); self.top_apps_label_val.setText(top_apps_text or "No data available")
+        self.update_chart(summary)
+    def on_dashboard_data_failed(self, generation: int, message: str):
+        if self.is_current_dashboard_request(generation): print(f"Dashboard refresh error: {message}")
+    def run_search(self):
+        self._search_timer.stop(); self._search_generation += 1
+        query = self.search_input.text().strip()
+        if not query: self.search_results.clear(); self.search_status.setText(""); return
+        start_us = day_range_us(self.search_from.date().toPyDate())[0]; end_us = day_range_us(self.search_to.date().toPyDate())[1]
+        task = SearchTask(self.db_manager, query, start_us, end_us, self.search_app.currentData(), self._search_generation, self.is_current_search)
+        task.signals.finished.connect(self.on_search_results); task.signals.failed.connect(self.on_search_failed)
+        self._search_started = time.perf_counter(); self.thread_pool.start(task)
+    def is_current_search(self, generation: int) -> bool:
+        return generation == self._search_generation
+    def on_search_results(self, generation: int, query: str, hits: list):
+        if not self.is_current_search(generation): return
+        elapsed_ms = (time.perf_counter() - self._search_started) * 1000
+        self.search_status.setText(f"{len(hits)} results for \"{query}\" ({elapsed_ms:.0f} ms)")
+        self.search_results.setHtml("".join(f"<p><span style='color:#64748b;'>{hit.timestamp} · {html.escape(hit.app or '-')}</span><br>{search.snippet_html(hit.snippet)}</p>" for hit in hits))
+    def on_search_failed(self, generation: int, message: str):
+        if self.is_current_search(generation): self.search_status.setText(f"Search error: {message}")
+    def on_chart_loaded(self, ok: bool):
+        self._chart_ready = ok
+        if ok and self._pending_chart is not None: self.update_chart(self._pending_chart)
+    def update_chart(self, summary: queries.RangeSummary):
+        if not self._chart_ready: self._pending_chart = summary; return
+        self._pending_chart = None
+        # 1日分の時間ごとの棒は日付を省いて時刻だけにする
+        labels = [key[-5:] for key in summary.buckets] if summary.bucket == 'hour' and (summary.end - summary.start).days == 1 else summary.buckets
+        self.chart_view.page().runJavaScript(chart_update_script(summary.app_durations) + trend_update_script(labels, summary.keystrokes, summary.focus_seconds))
 
     def start_logging(self):
         if self.event_manager.start():
@@ -152,6 +277,8 @@ class AppWindow(QMainWindow):
 
     def save_settings(self):
         self.config['auto_start_logging'] = self.auto_start_checkbox.isChecked()
+        if self.archive_checkbox.isChecked() != (self.config.get('retention_hot_days', 0) > 0):
+            self.config['retention_hot_days'] = ARCHIVE_HOT_DAYS if self.archive_checkbox.isChecked() else 0
         self.config_manager.save(self.config)
 
     def open_login_items(self):
@@ -166,8 +293,37 @@ class AppWindow(QMainWindow):
         else:
             if QMessageBox.question(self, "DB Viewer Not Found", "DB Browser for SQLite is recommended.\n\nOpen download page?", QMessageBox.Yes | QMessageBox.No, QMessageBox.No) == QMessageBox.Yes: webbrowser.open(download_url)
 
+    def open_export_dialog(self):
+        dialog = QDialog(self); dialog.setWindowTitle("Export Data"); form = QFormLayout(dialog); today = QDate.currentDate()
+        kind = QComboBox(); kind.addItem("Events (raw log)", 'events'); kind.addItem("App focus intervals", 'intervals')
+        fmt = QComboBox(); fmt.addItem("CSV", 'csv'); fmt.addItem("JSON Lines", 'jsonl')
+        if importlib.util.find_spec('numpy'): fmt.addItem("NumPy arrays (.npz)", 'npz')  # numpy がない環境では .npz を出さない
+        date_from = QDateEdit(today.addDays(-30)); date_from.setCalendarPopup(True); date_to = QDateEdit(today); date_to.setCalendarPopup(True)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel); buttons.accepted.connect(dialog.accept); buttons.rejected.connect(dialog.reject)
+        form.addRow("Data", kind); form.addRow("Format", fmt); form.addRow("From", date_from); form.addRow("To", date_to); form.addRow(buttons)
+        if dialog.exec_() != QDialog.Accepted: return
+        start = date_from.date().toPyDate(); end = date_to.date().toPyDate(); extension = fmt.currentData()
+        default_path = os.path.join(os.path.expanduser('~'), f"activity-{kind.currentData()}-{start}-{end}.{extension}")
+        path, _ = QFileDialog.getSaveFileName(self, "Export Data", default_path)
+        if not path: return
+        if not path.lower().endswith(f".{extension}"): path += f".{extension}"
+        self.start_export(path, start, end + _dt.timedelta(days=1), kind.currentData())
+
+    def start_export(self, path: str, start: _dt.date, end: _dt.date, kind: str):
+        # 書き出しはバックグラウンドで行い、進み具合をダイアログに出す
+        task = ExportTask(self.db_manager, path, start, end, kind); name = os.path.basename(path)
+        progress = QProgressDialog(f"Exporting {name}...", "Cancel", 0, 1000, self); progress.setWindowTitle("Export Data")
+        progress.setMinimumDuration(0); progress.setAutoClose(False); progress.setAutoReset(False); progress.canceled.connect(task.cancel)
+        def on_progress(rows: int, fraction: float): progress.setValue(int(fraction * 1000)); progress.setLabelText(f"Exporting {name}... {rows:,} rows")
+        def on_finished(path: str, rows: int): progress.close(); QMessageBox.information(self, "Export Data", f"Exported {rows:,} rows to\n{path}")
+        def on_failed(message: str): progress.close(); QMessageBox.critical(self, "Export Error", f"Could not export data: {message}")
+        task.signals.progress.connect(on_progress); task.signals.finished.connect(on_finished); task.signals.failed.connect(on_failed)
+        progress.show(); self.thread_pool.start(task)
+
     def show_accessibility_prompt(self):
+        # コンソールだけでなく Live Log とステータスにも出す (ログとしては記録しない)
         self.event_manager.gui_log_received.emit("❌ Logging failed: Accessibility permission required.\n")
+        self.log_model.notice("❌ Logging failed: Accessibility permission required"); self.logging_status_changed.emit(False, False, "Status: Permission required")
         msg_box = QMessageBox(self); msg_box.setIcon(QMessageBox.Warning); msg_box.setText("<b>Permission Required</b>")
         msg_box.setInformativeText("To monitor keyboard input, this application needs 'Accessibility' permissions from macOS.\n\n<b>How to enable:</b>\n1. Click 'Open System Settings' below.\n2. Find 'ActivityLogger' in the list.\n3. Turn on the switch next to it.\n\nYou may need to restart the application after granting permission.")
         open_settings_button = msg_box.addButton("Open System Settings", QMessageBox.ActionRole)
@@ -176,11 +332,45 @@ class AppWindow(QMainWindow):
             url_scheme = "x-apple.systempreferences:com.apple.preference.security&path=Privacy_Accessibility"
             subprocess.run(["open", url_scheme])
 
-    def update_gui_log_slot(self, log_text: str):
-        if hasattr(self, 'log_text_edit'):
-            self.log_text_edit.moveCursor(self.log_text_edit.textCursor().End)
-            self.log_text_edit.insertPlainText(log_text)
-        print(log_text, end='', flush=True)
+    def record_log_event(self, event_type: str, content: str):
+        # DB と Live Log で同じ時刻を使い、さかのぼり読み込みの境界で重複しないようにする
+        now = _dt.datetime.now()
+        self.db_manager.add_log_entry(event_type, content, now)
+        self.log_model.append(queries.Event(None, to_epoch_us(now), now.isoformat(), event_type, content))
+
+    def on_log_rows_about_to_be_inserted(self, parent, first: int, last: int):
+        # 末尾への追加で、いちばん下を見ていたときだけ追従する
+        scroll_bar = self.log_view.verticalScrollBar()
+        self._log_follow = first == self.log_model.rowCount() and scroll_bar.value() >= scroll_bar.maximum()
+    def on_log_rows_inserted(self, parent, first: int, last: int):
+        if self._log_follow: self.log_view.scrollToBottom()
+    def on_log_scrolled(self, value: int):
+        if value != self.log_view.verticalScrollBar().minimum() or self.log_model.history_exhausted: return
+        loaded = self.log_model.fetch_older()
+        # 読み込んだ分だけ下にずらして、見ていた行をそのまま表示する
+        if loaded: self.log_view.scrollTo(self.log_model.index(loaded, 0), QAbstractItemView.PositionAtTop)
+
+    def flush_log_output(self):
+        self.log_model.flush(); self.log_sink.flush()
+        if self.console_log: self.console_log.flush()
+
+    def enter_background_mode(self):
+        if self.isVisible(): return
+        self.flush_log_output(); rss_before = resident_memory_bytes(); released = []
+        if self._pages_built[0]:
+            self.release_page(0); self.chart_view = None; self._chart_ready = False; self._pending_chart = None
+            # 実行中の集計結果は破棄したラベルに届かないように捨てる
+            self._dashboard_cache = None; self._dashboard_generation += 1; released.append("web view")
+        tail_rows = self.config.get('background_log_tail_rows', 200); rows = self.log_model.rowCount()
+        if rows > tail_rows: self.log_model.trim(tail_rows); released.append(f"log {rows:,}->{tail_rows:,} rows")
+        # deleteLater の破棄はイベントループに戻ってから行われるので、その後で測る
+        QTimer.singleShot(0, lambda: print(f"Background mode: released {', '.join(released) or 'nothing'}; RSS {format_mb(rss_before)} -> {format_mb(resident_memory_bytes())}"))
+
+    def showEvent(self, event):
+        self._background_timer.stop()
+        super().showEvent(event); self.switch_view(self._current_view)
 
     def closeEvent(self, event):
         self.hide(); event.ignore()
+        release_after_s = self.config.get('background_release_after_s', 300)
+        if release_after_s > 0: self._background_timer.start(int(release_after_s * 1000))
@@ -0,0 +1,270 @@
+# app/merge.py
+# 複数の端末の activity.db を1つの DB にまとめる。取り込み元を ATTACH して INSERT ... SELECT を
+# 大きなトランザクションごとに実行するので、数千万行でも行を Python に読み込まない。
+# 行には端末 (hosts) と取り込み元での id (source_id) を付け、(host_id, source_id) の一意索引で同じ行は
+# 2回入らない。端末ごとに取り込み済みの id を覚えておくので、取り込み直しでは新しい行だけを読む。
+# 集計・フォーカス区間・検索索引は、新しく入った行とその行が掛かる期間だけを更新する。
+#   python -m app.merge --into merged.db laptop=~/sync/laptop/activity.db ~/sync/desktop/activity.db
+from __future__ import annotations
+from contextlib import contextmanager
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+import argparse
+import datetime as _dt
+import os
+import sqlite3
+import sys
+
+from . import intervals
+from . import retention
+from . import rollups
+from . import search
+from .storage import NameInterner
+
+# 1トランザクションでコピーする取り込み元の id の幅
+MERGE_CHUNK = 100_000
+SOURCE_SCHEMA = 'merge_source'
+ARCHIVE_SCHEMA = 'merge_archive'
+
+# 端末ごとの取り込みの進み具合:
+#   last_source_id: 取り込み元の id をここまで取り込んだ (取り込み元の id は増える一方)
+#   merged_through: この DB の events.id をここまで集計・区間・索引に反映した
+#   archived_through: 取り込み元の圧縮済み (もう変わらない) アーカイブをこの月まで読んだ
+CREATE_SQL = '''
+    CREATE TABLE IF NOT EXISTS merge_sources (
+        host_id INTEGER PRIMARY KEY REFERENCES hosts (id),
+        last_source_id INTEGER NOT NULL DEFAULT 0,
+        merged_through INTEGER NOT NULL DEFAULT 0,
+        archived_through TEXT NOT NULL DEFAULT '',
+        merged_at TEXT
+    )
+'''
+
+# v7 以降の取り込み元 (events と辞書テーブル)。辞書のIDは名前で付け替える
+_COPY_EVENTS_SQL = '''
+    INSERT OR IGNORE INTO main.events (ts, type_id, app_id, content, host_id, source_id)
+    SELECT e.ts, t.id, a.id, e.content, :host, e.id
+    FROM {db}.events e
+    JOIN {db}.event_types st ON st.id = e.type_id
+    JOIN main.event_types t ON t.name = st.name
+    LEFT JOIN {db}.apps sa ON sa.id = e.app_id
+    LEFT JOIN main.apps a ON a.name = sa.name
+    WHERE e.id > :lower AND e.id <= :upper {local_only}
+    ORDER BY e.id
+'''
+# v6 以前の取り込み元と、アーカイブの月 (どちらも logs テーブル)
+_COPY_LOGS_SQL = '''
+    INSERT OR IGNORE INTO main.events (ts, type_id, app_id, content, host_id, source_id)
+    SELECT l.ts, t.id, a.id, CASE WHEN a.id IS NULL THEN l.content END, :host, l.id
+    FROM {db}.logs l
+    JOIN main.event_types t ON t.name = l.event_type
+    LEFT JOIN main.apps a ON l.event_type = 'APP_SWITCH' AND a.name = l.content
+    WHERE l.id > :lower AND l.id <= :upper
+    ORDER BY l.id
+'''
+_EVENT_NAMES_SQL = (
+    "INSERT OR IGNORE INTO main.event_types (name) SELECT name FROM {db}.event_types",
+    "INSERT OR IGNORE INTO main.apps (name) SELECT name FROM {db}.apps",
+)
+_LOG_NAMES_SQL = (
+    "INSERT OR IGNORE INTO main.event_types (name) SELECT DISTINCT event_type FROM {db}.logs WHERE id > ?",
+    "INSERT OR IGNORE INTO main.apps (name) SELECT DISTINCT content FROM {db}.logs "
+    "WHERE event_type = 'APP_SWITCH' AND content IS NOT NULL AND id > ?",
+)
+
+
+class MergeResult(NamedTuple):
+    host: str
+    rows: int             # 新しく取り込んだ行数
+    months: List[str]     # 読んだ取り込み元のアーカイブの月
+
+
+def create_tables(conn: sqlite3.Connection):
+    conn.execute(CREATE_SQL)
+
+
+def default_host(path: str) -> str:
+    """取り込み元の端末名。ファイル名が activity.db なら親ディレクトリの名前にする。"""
+    path = os.path.abspath(path)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if stem == 'activity':
+        return os.path.basename(os.path.dirname(path)).lstrip('.') or stem
+    return stem
+
+
+def parse_source(spec: str) -> Tuple[str, str]:
+    """'HOST=PATH' か 'PATH' を (端末名, パス) にする。"""
+    host, sep, path = spec.partition('=')
+    if not sep or not host or os.path.exists(spec):
+        return default_host(spec), spec
+    return host, os.path.expanduser(path)
+
+
+@contextmanager
+def _attached(conn: sqlite3.Connection, path: str, schema: str) -> Iterator[str]:
+    conn.execute("ATTACH DATABASE ? AS " + schema, (path,))
+    try:
+        yield schema
+    finally:
+        conn.execute("DETACH DATABASE " + schema)
+
+
+def _tables(conn: sqlite3.Connection, schema: str) -> set:
+    return {row[0] for row in conn.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'")}
+
+
+def _columns(conn: sqlite3.Connection, schema: str, table: str) -> set:
+    return {row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")}
+
+
+def _copy(conn: sqlite3.Connection, schema: str, table: str, sql: str, host_id: int, after_id: int,
+          chunk: int) -> Tuple[int, int]:
+    # after_id より後の行をチャンクごとにコミットしながらコピーし、(挿入した行数, 取り込み元の最大の id) を返す。
+    # 途中で落ちても、コピー済みの行は次回一意索引で無視される
+    first, top = conn.execute(f"SELECT MIN(id), COALESCE(MAX(id), 0) FROM {schema}.{table} WHERE id > ?",
+                              (after_id,)).fetchone()
+    rows, lower = 0, max(after_id, (first or 1) - 1)
+    while lower < top:
+        upper = min(top, lower + chunk)
+        with conn:
+            rows += conn.execute(sql, {'host': host_id, 'lower': lower, 'upper': upper}).rowcount
+        lower = upper
+    return rows, top
+
+
+def _copy_logs(conn: sqlite3.Connection, schema: str, host_id: int, after_id: int, chunk: int) -> Tuple[int, int]:
+    with conn:
+        for sql in _LOG_NAMES_SQL:
+            conn.execute(sql.format(db=schema), (after_id,))
+    return _copy(conn, schema, 'logs', _COPY_LOGS_SQL.format(db=schema), host_id, after_id, chunk)
+
+
+def _copy_events(conn: sqlite3.Connection, schema: str, host_id: int, after_id: int, chunk: int) -> Tuple[int, int]:
+    with conn:
+        for sql in _EVENT_NAMES_SQL:
+            conn.execute(sql.format(db=schema))
+    # 取り込み元がさらに他の端末から取り込んだ行は、その端末の行ではないので除く
+    local_only = "AND e.host_id IS NULL" if 'host_id' in _columns(conn, schema, 'events') else ""
+    sql = _COPY_EVENTS_SQL.format(db=schema, local_only=local_only)
+    return _copy(conn, schema, 'events', sql, host_id, after_id, chunk)
+
+
+def merge(conn: sqlite3.Connection, path: str, host: Optional[str] = None, chunk: int = MERGE_CHUNK) -> MergeResult:
+    """path の DB (とそのアーカイブ) を端末 host の行として取り込み、集計を更新する。書き込み接続から呼ぶ。
+
+    前回の取り込みより後の行だけを読むので、同じファイルを何度取り込んでもよい。
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"database not found: {path}")
+    for _, name, main_path in conn.execute("PRAGMA database_list").fetchall():
+        if name == 'main' and main_path and os.path.samefile(path, main_path):
+            raise ValueError(f"cannot merge a database into itself: {path}")
+    host = host or default_host(path)
+    # 集計や区間の作り直しでは取り込んだ行をまとめて並べ替えるので、一時データはメモリでなくファイルに置く
+    temp_store = conn.execute("PRAGMA temp_store").fetchone()[0]
+    conn.execute("PRAGMA temp_store = FILE")
+    try:
+        return _merge(conn, path, host, chunk)
+    finally:
+        conn.execute(f"PRAGMA temp_store = {temp_store}")
+
+
+def _merge(conn: sqlite3.Connection, path: str, host: str, chunk: int) -> MergeResult:
+    with _attached(conn, path, SOURCE_SCHEMA):
+        tables = _tables(conn, SOURCE_SCHEMA)
+        if 'events' in tables:
+            copy = _copy_events
+        elif 'logs' in tables and 'ts' in _columns(conn, SOURCE_SCHEMA, 'logs'):
+            copy = _copy_logs
+        else:
+            raise ValueError(f"not an activity database (or too old; open it with the app once): {path}")
+        with conn:
+            create_tables(conn)
+            host_id = NameInterner('hosts').id(conn, host)
+            # 新しい端末は、この時点より後の行だけを集計に反映すればよい
+            conn.execute("INSERT OR IGNORE INTO merge_sources (host_id, merged_through) "
+                         "SELECT ?, COALESCE(MAX(id), 0) FROM events", (host_id,))
+        after_id, archived_through = conn.execute(
+            "SELECT last_source_id, archived_through FROM merge_sources WHERE host_id = ?", (host_id,)).fetchone()
+
+        rows, months, newest = 0, [], after_id
+        # アーカイブの月を古い順に読んでから本体を読む
+        if 'archive_months' in tables:
+            archived = conn.execute(f"SELECT month, compressed FROM {SOURCE_SCHEMA}.archive_months ORDER BY month").fetchall()
+            archive_dir = os.path.join(os.path.dirname(os.path.abspath(path)), retention.ARCHIVE_DIR_NAME)
+            for month, compressed in archived:
+                if compressed and month <= archived_through:
+                    continue
+                count, top = _merge_archive_month(conn, archive_dir, month, host_id, after_id, chunk)
+                if top is None:
+                    print(f"Merge: archive of {month} not found in {archive_dir}")
+                    continue
+                rows += count; newest = max(newest, top); months.append(month)
+                if compressed:
+                    archived_through = max(archived_through, month)
+        count, top = copy(conn, SOURCE_SCHEMA, host_id, after_id, chunk)
+        rows += count; newest = max(newest, top)
+
+    with conn:
+        conn.execute("UPDATE merge_sources SET last_source_id = ?, archived_through = ?, merged_at = ? WHERE host_id = ?",
+                     (newest, archived_through, _dt.datetime.now().isoformat(timespec='seconds'), host_id))
+    update_aggregates(conn, host_id)
+    return MergeResult(host, rows, months)
+
+
+def _merge_archive_month(conn: sqlite3.Connection, archive_dir: str, month: str, host_id: int, after_id: int,
+                         chunk: int) -> Tuple[int, Optional[int]]:
+    # 圧縮された月は一時ディレクトリに展開して読み、読み終えたら消す (取り込み元のフォルダには書かない)
+    import tempfile
+    with tempfile.TemporaryDirectory() as cache_dir:
+        archive_path = retention.ArchiveStore(archive_dir, cache_dir).readable_path(month)
+        if archive_path is None:
+            return 0, None
+        with _attached(conn, archive_path, ARCHIVE_SCHEMA):
+            return _copy_logs(conn, ARCHIVE_SCHEMA, host_id, after_id, chunk)
+
+
+def update_aggregates(conn: sqlite3.Connection, host_id: int):
+    """端末 host_id のまだ反映していない行を、キー数の集計・フォーカス区間・アプリ別の集計・検索索引に反映する。
+
+    1トランザクションで反映するので、取り込みの途中で落ちても次回の取り込みで続きから反映される。
+    """
+    host, after_id = conn.execute("SELECT h.name, m.merged_through FROM merge_sources m JOIN hosts h ON h.id = m.host_id "
+                                  "WHERE m.host_id = ?", (host_id,)).fetchone()
+    since_us, newest = conn.execute("SELECT MIN(ts), MAX(id) FROM events WHERE id > ? AND host_id = ?",
+                                    (after_id, host_id)).fetchone()
+    if newest is None:
+        return
+    with conn:
+        rollups.add_host_rows(conn, host, after_id)
+        search.index_host_rows(conn, host_id, after_id)
+        # 区間は新しい行の最も古い時刻を含む区間から作り直す (それより前は変わらない)
+        intervals.rebuild_host(conn, host_id, since_us)
+        conn.execute("UPDATE merge_sources SET merged_through = ? WHERE host_id = ?", (newest, host_id))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge activity databases from several machines into one database.")
+    parser.add_argument('sources', nargs='+', metavar='[HOST=]PATH',
+                        help="database to import; HOST defaults to the file name (or its folder for activity.db)")
+    parser.add_argument('--into', required=True, help="database to merge into (created if missing)")
+    parser.add_argument('--chunk', type=int, default=MERGE_CHUNK, help="source ids copied per transaction")
+    args = parser.parse_args(argv)
+
+    from .database import DatabaseManager
+    db_manager = DatabaseManager(os.path.abspath(args.into), write_behind=False)
+    try:
+        for spec in args.sources:
+            host, path = parse_source(spec)
+            result = db_manager.merge_database(path, host, chunk=args.chunk)
+            archives = f" (archives: {', '.join(result.months)})" if result.months else ""
+            print(f"{result.host}: merged {result.rows:,} new rows from {path}{archives}")
+    except (ValueError, OSError, sqlite3.Error) as e:
+        print(f"Merge error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        db_manager.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,54 @@
+# app/profiling.py
+# 起動時間の計測 (--profile-startup または ACTIVITY_LOGGER_PROFILE=1 で有効) と常駐メモリの取得
+from __future__ import annotations
+import os
+import subprocess
+import sys
+import time
+
+PROFILE_FLAG = '--profile-startup'
+PROFILE_ENV = 'ACTIVITY_LOGGER_PROFILE'
+
+
+def profiling_requested(argv=None) -> bool:
+    argv = sys.argv if argv is None else argv
+    return PROFILE_FLAG in argv or os.environ.get(PROFILE_ENV, '') not in ('', '0')
+
+
+class StartupProfiler:
+    """起動開始からの経過時間を区間ごとに記録して表示する。無効時は何もしない。"""
+
+    def __init__(self, started_at: float, enabled: bool):
+        self.started_at = started_at
+        self.enabled = enabled
+        self.marks: dict[str, float] = {}
+
+    def mark(self, name: str):
+        # 同じ名前は最初の1回だけ記録する (初回イベントなど)
+        if not self.enabled or name in self.marks:
+            return
+        elapsed_ms = (time.perf_counter() - self.started_at) * 1000
+        self.marks[name] = elapsed_ms
+        print(f"[startup] {name}: {elapsed_ms:.1f} ms", file=sys.stderr, flush=True)
+
+
+def resident_memory_bytes() -> int:
+    """このプロセスの現在の常駐メモリ (RSS)。取得できなければ 0。
+
+    QtWebEngine のレンダラーは別プロセスなので含まれない。
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        # macOS には /proc がないので ps で取る (KB 単位)
+        out = subprocess.run(['ps', '-o', 'rss=', '-p', str(os.getpid())], capture_output=True, text=True, timeout=2).stdout
+        return int(out.strip()) * 1024
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return 0
+
+
+def format_mb(num_bytes: int) -> str:
+    return f"{num_bytes / (1024 * 1024):.1f}MB"
@@ -0,0 +1,251 @@
+# app/queries.py
+# 分析・エクスポート用の読み取りクエリ。結果は固定サイズのチャンクでストリーミングする。
+from __future__ import annotations
+from collections import defaultdict
+from typing import Iterator, List, NamedTuple, Optional, Sequence
+import datetime as _dt
+import heapq
+import sqlite3
+
+from . import intervals
+from . import retention
+from .database import day_range_us, to_epoch_us
+
+CHUNK_SIZE = 1000
+
+TimeLike = int | _dt.datetime | _dt.date
+
+
+class Event(NamedTuple):
+    id: int
+    ts: int
+    timestamp: str
+    event_type: str
+    content: str
+
+
+class AppInterval(NamedTuple):
+    app: str
+    start_ts: int
+    end_ts: int
+
+    @property
+    def seconds(self) -> float:
+        return (self.end_ts - self.start_ts) / 1_000_000
+
+
+def as_epoch_us(value: TimeLike) -> int:
+    """エポックマイクロ秒・datetime・date (その日の0時) のいずれかをエポックマイクロ秒にする。"""
+    if isinstance(value, int):
+        return value
+    if not isinstance(value, _dt.datetime):
+        value = _dt.datetime.combine(value, _dt.time())
+    return to_epoch_us(value)
+
+
+# SQL 文字列を固定しておくと、sqlite3 の接続ごとのステートメントキャッシュで
+# プリペアド済みの文がそのまま再利用される。{db} は本体なら 'main'、範囲がアーカイブに
+# 掛かるときは ATTACH した月のスキーマ名になる。
+_EVENTS_SQL = '''
+    SELECT id, ts, timestamp, event_type, content FROM {db}.logs
+    WHERE ts >= ? AND ts < ? AND (ts, id) > (?, ?)
+    ORDER BY ts, id LIMIT ?
+'''
+_KEYSTROKE_COUNT_SQL = '''
+    SELECT COALESCE(SUM(length(content)), 0) FROM {db}.logs
+    WHERE event_type = 'KEYSTROKE' AND ts >= ? AND ts < ? AND substr(content, 1, 1) <> '['
+'''
+_EVENTS_BEFORE_SQL = '''
+    SELECT id, ts, timestamp, event_type, content FROM {db}.logs
+    WHERE ts <= ? AND (ts, id) < (?, ?)
+    ORDER BY ts DESC, id DESC LIMIT ?
+'''
+_DAILY_KEYSTROKES_SQL = "SELECT keystrokes FROM rollup_daily WHERE day = ?"
+
+
+_EVENTS_BY_TYPE_SQL = '''
+    SELECT id, ts, timestamp, event_type, content FROM {db}.logs
+    WHERE event_type = ? AND ts >= ? AND ts < ? AND (ts, id) > (?, ?)
+    ORDER BY ts, id LIMIT ?
+'''
+
+
+def _iter_chunks(conn: sqlite3.Connection, sql: str, prefix: tuple, start_us: int, end_us: int,
+                 chunk_size: int) -> Iterator[Event]:
+    # キーセット方式でチャンクごとに問い合わせ直すので、長い範囲でもメモリ使用量は一定で、
+    # 読み取りトランザクションを握り続けることもない。行値の比較 (ts, id) > (?, ?) だけでは
+    # インデックスの探索位置にならないので、ts の下限も前のチャンクの末尾に進める。
+    last_ts, last_id = start_us - 1, 0
+    while True:
+        rows = conn.execute(sql, (*prefix, max(start_us, last_ts), end_us, last_ts, last_id, chunk_size)).fetchall()
+        for row in rows:
+            yield Event(*row)
+        if len(rows) < chunk_size:
+            return
+        last_ts, last_id = rows[-1][1], rows[-1][0]
+
+
+def iter_events(conn: sqlite3.Connection, start: TimeLike, end: TimeLike,
+                types: Optional[Sequence[str]] = None, chunk_size: int = CHUNK_SIZE) -> Iterator[Event]:
+    """[start, end) のイベントを (ts, id) 順に返す。アーカイブに掛かる範囲は古い月から順に読む。"""
+    start_us, end_us = as_epoch_us(start), as_epoch_us(end)
+    for db in retention.sources(conn, start_us, end_us):
+        if not types:
+            yield from _iter_chunks(conn, _EVENTS_SQL.format(db=db), (), start_us, end_us, chunk_size)
+            continue
+        # 種別ごとに (event_type, ts) インデックス順で読み、ソートせずにマージする
+        streams = [_iter_chunks(conn, _EVENTS_BY_TYPE_SQL.format(db=db), (event_type,), start_us, end_us, chunk_size)
+                   for event_type in dict.fromkeys(types)]
+        yield from heapq.merge(*streams, key=lambda event: (event.ts, event.id))
+
+
+def iter_app_intervals(conn: sqlite3.Connection, start: TimeLike, end: TimeLike) -> Iterator[AppInterval]:
+    """app_intervals のフォーカス区間を、範囲の境界 (と現在時刻) で切り詰めて返す。一時停止中は含まない。"""
+    now_us = to_epoch_us(_dt.datetime.now())
+    for row in intervals.iter_intervals(conn, as_epoch_us(start), as_epoch_us(end), now_us):
+        yield AppInterval(*row)
+
+
+def events_before(conn: sqlite3.Connection, ts: int, event_id: int, limit: int = CHUNK_SIZE) -> List[Event]:
+    """(ts, id) より前のイベントを新しい順に最大 limit 件返す。さかのぼって表示するときのページ単位。"""
+    events = []
+    for db in retention.sources(conn, 0, ts + 1, newest_first=True):
+        events.extend(Event(*row) for row in conn.execute(_EVENTS_BEFORE_SQL.format(db=db), (ts, ts, event_id, limit - len(events))))
+        if len(events) >= limit:
+            break
+    return events
+
+
+def keystroke_count(conn: sqlite3.Connection, start: TimeLike, end: TimeLike) -> int:
+    """[start, end) に入力された文字数 ([ENTER] などの特殊キーを除く)。"""
+    start_us, end_us = as_epoch_us(start), as_epoch_us(end)
+    return sum(conn.execute(_KEYSTROKE_COUNT_SQL.format(db=db), (start_us, end_us)).fetchone()[0]
+               for db in retention.sources(conn, start_us, end_us))
+
+
+def daily_keystrokes(conn: sqlite3.Connection, day: _dt.date) -> int:
+    row = conn.execute(_DAILY_KEYSTROKES_SQL, (day.isoformat(),)).fetchone()
+    return row[0] if row else 0
+
+
+def daily_app_seconds(conn: sqlite3.Connection, day: _dt.date) -> dict[str, float]:
+    return intervals.app_seconds(conn, *day_range_us(day), to_epoch_us(_dt.datetime.now()))
+
+
+# ダッシュボードの期間と、グラフの1本の棒にまとめる単位
+DASHBOARD_RANGES = ('day', 'week', 'month', 'year')
+BUCKETS = ('hour', 'day', 'week', 'month')
+
+# 時間単位のグラフは時間別の集計 (rollup_hourly / rollup_app_hourly) から、それより粗い単位は
+# 日別の集計 (rollup_daily / rollup_app_daily) から読む。どちらも主キーの順に日ごとの合計を読み、
+# 週や月への束ね直しは Python で行う (1年分でも365行)
+_KEYSTROKE_TREND_SQL = {
+    'hourly': "SELECT day, hour, keystrokes FROM rollup_hourly WHERE day >= ? AND day < ?",
+    'daily': "SELECT day, 0, keystrokes FROM rollup_daily WHERE day >= ? AND day < ?",
+}
+_FOCUS_TREND_SQL = {
+    'hourly': "SELECT day, hour, SUM(focus_us) FROM rollup_app_hourly WHERE day >= ? AND day < ? GROUP BY day, hour",
+    'daily': "SELECT day, 0, SUM(focus_us) FROM rollup_app_daily WHERE day >= ? AND day < ? GROUP BY day",
+}
+_RANGE_APP_SECONDS_SQL = '''
+    SELECT a.name, s.us FROM (
+        SELECT app_id, SUM(focus_us) AS us FROM rollup_app_{tier} WHERE day >= ? AND day < ? GROUP BY app_id
+    ) s JOIN apps a ON a.id = s.app_id
+'''
+_OPEN_INTERVAL_SQL = "SELECT a.name, i.start_ts FROM app_intervals i JOIN apps a ON a.id = i.app_id WHERE i.end_ts IS NULL"
+
+
+class RangeSummary(NamedTuple):
+    start: _dt.date                  # 最初の日
+    end: _dt.date                    # 最後の日の翌日
+    bucket: str
+    total_keys: int
+    app_durations: dict[str, float]  # アプリ → 秒
+    buckets: list[str]               # 区切りのキー ('YYYY-MM-DD HH:00' / 'YYYY-MM-DD' / 週の月曜 / 'YYYY-MM')
+    keystrokes: list[int]
+    focus_seconds: list[float]
+
+    def sorted_apps(self) -> list[tuple[str, float]]:
+        """(アプリ, 秒) を時間の長い順に。"""
+        return sorted(self.app_durations.items(), key=lambda item: item[1], reverse=True)
+
+    def to_json(self, trend: bool = True) -> dict:
+        """JSON にできる dict。end は最後の日 (両端を含む)。"""
+        result = {
+            'start': self.start.isoformat(),
+            'end': (self.end - _dt.timedelta(days=1)).isoformat(),
+            'keystrokes': self.total_keys,
+            'focus_seconds': round(sum(self.app_durations.values()), 3),
+            'apps': [{'app': app, 'seconds': round(seconds, 3)} for app, seconds in self.sorted_apps()],
+        }
+        if trend:
+            result['bucket'] = self.bucket
+            result['trend'] = [{'bucket': key, 'keystrokes': keys, 'focus_seconds': round(seconds, 3)}
+                               for key, keys, seconds in zip(self.buckets, self.keystrokes, self.focus_seconds)]
+        return result
+
+
+def current_app(conn: sqlite3.Connection) -> Optional[tuple[str, int]]:
+    """フォーカス中のアプリと、その区間の開始 (エポックマイクロ秒)。記録していないか一時停止中なら None。"""
+    return conn.execute(_OPEN_INTERVAL_SQL).fetchone()
+
+
+def preset_range(name: str, today: _dt.date) -> tuple[_dt.date, _dt.date]:
+    """DASHBOARD_RANGES の名前を、今日で終わる [最初の日, 最後の日の翌日) にする。"""
+    days = {'day': 1, 'week': 7, 'month': 30, 'year': 365}[name]
+    return today - _dt.timedelta(days=days - 1), today + _dt.timedelta(days=1)
+
+
+def bucket_for(start: _dt.date, end: _dt.date) -> str:
+    """グラフの棒が数十本程度になる単位を選ぶ。"""
+    days = (end - start).days
+    return 'hour' if days <= 2 else 'day' if days <= 92 else 'week' if days <= 366 else 'month'
+
+
+def _bucket_key(bucket: str, day: str, hour: int) -> str:
+    # 'YYYY-MM-DD HH:00' / 'YYYY-MM-DD' / 週の月曜の日付 / 'YYYY-MM'
+    if bucket == 'hour':
+        return f"{day} {hour:02d}:00"
+    if bucket == 'week':
+        date = _dt.date.fromisoformat(day)
+        return (date - _dt.timedelta(days=date.weekday())).isoformat()
+    return day[:7] if bucket == 'month' else day
+
+
+def _bucket_keys(start: _dt.date, end: _dt.date, bucket: str) -> list[str]:
+    keys = {}
+    for offset in range((end - start).days):
+        day = (start + _dt.timedelta(days=offset)).isoformat()
+        for hour in range(24 if bucket == 'hour' else 1):
+            keys[_bucket_key(bucket, day, hour)] = None
+    return list(keys)
+
+
+def range_summary(conn: sqlite3.Connection, start: _dt.date, end: _dt.date, bucket: Optional[str] = None,
+                  now: Optional[_dt.datetime] = None) -> RangeSummary:
+    """[start, end) の日の合計とトレンド。集計テーブルだけを読むので、1年分でも1日分とほぼ同じ時間で済む。
+
+    閉じた区間は rollup_app_hourly から読み、開いている区間だけを now (既定は現在) まで足す。
+    """
+    bucket = bucket or bucket_for(start, end)
+    days = (start.isoformat(), end.isoformat())
+    tier = 'hourly' if bucket == 'hour' else 'daily'
+    keys, focus = defaultdict(int), defaultdict(int)
+    for day, hour, count in conn.execute(_KEYSTROKE_TREND_SQL[tier], days):
+        keys[_bucket_key(bucket, day, hour)] += count
+    for day, hour, us in conn.execute(_FOCUS_TREND_SQL[tier], days):
+        focus[_bucket_key(bucket, day, hour)] += us
+    app_us = defaultdict(int, conn.execute(_RANGE_APP_SECONDS_SQL.format(tier=tier), days))
+
+    row = current_app(conn)
+    if row:
+        app, start_ts = row
+        for day, hour, us in intervals.hourly_pieces(start_ts, to_epoch_us(now or _dt.datetime.now())):
+            if days[0] <= day < days[1]:
+                focus[_bucket_key(bucket, day, hour)] += us
+                app_us[app] += us
+
+    buckets = _bucket_keys(start, end, bucket)
+    return RangeSummary(start, end, bucket, sum(keys.values()),
+                        {app: us / 1_000_000 for app, us in app_us.items() if us > 0}, buckets,
+                        [keys.get(key, 0) for key in buckets], [focus.get(key, 0) / 1_000_000 for key in buckets])
@@ -0,0 +1,346 @@
+# app/retention.py
+# 古いログを月ごとのアーカイブ DB に移して本体の DB を小さく保つ。
+# 締まった月は zip に圧縮し、クエリの範囲がアーカイブに掛かるときだけ ATTACH して読む。
+from __future__ import annotations
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+import argparse
+import datetime as _dt
+import os
+import sqlite3
+
+ARCHIVE_DIR_NAME = 'archive'
+MOVE_CHUNK = 5000
+VACUUM_PAGES = 2000
+
+CREATE_SQL = '''
+    CREATE TABLE IF NOT EXISTS archive_months (
+        month TEXT PRIMARY KEY,
+        start_ts INTEGER NOT NULL,
+        end_ts INTEGER NOT NULL,
+        rows INTEGER NOT NULL DEFAULT 0,
+        compressed INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+'''
+_ARCHIVE_LOGS_SQL = '''
+    CREATE TABLE IF NOT EXISTS {db}.logs (
+        id INTEGER PRIMARY KEY,
+        timestamp TEXT NOT NULL,
+        ts INTEGER NOT NULL,
+        event_type TEXT NOT NULL,
+        content TEXT,
+        host TEXT
+    )
+'''
+_ARCHIVE_INDEX_SQL = "CREATE INDEX IF NOT EXISTS {db}.idx_logs_ts ON logs (ts)"
+_ARCHIVE_TYPE_INDEX_SQL = "CREATE INDEX IF NOT EXISTS {db}.idx_logs_type_ts ON logs (event_type, ts)"
+_UPSERT_MONTH_SQL = '''
+    INSERT INTO archive_months (month, start_ts, end_ts, rows) VALUES (?, ?, ?, ?)
+    ON CONFLICT (month) DO UPDATE SET end_ts = max(end_ts, excluded.end_ts), rows = rows + excluded.rows
+'''
+_MONTHS_IN_RANGE_SQL = '''
+    SELECT month FROM archive_months WHERE start_ts < ? AND end_ts > ? ORDER BY month
+'''
+
+
+def create_tables(conn: sqlite3.Connection):
+    conn.execute(CREATE_SQL)
+
+
+def month_range_us(month: str) -> Tuple[int, int]:
+    """'YYYY-MM' のローカル時刻での [月初, 翌月初) をエポックマイクロ秒で返す。"""
+    from .database import to_epoch_us
+    year, mon = map(int, month.split('-'))
+    start = _dt.datetime(year, mon, 1)
+    end = _dt.datetime(year + mon // 12, mon % 12 + 1, 1)
+    return to_epoch_us(start), to_epoch_us(end)
+
+
+def cutoff_us(hot_days: int, today: Optional[_dt.date] = None) -> int:
+    """hot_days 日前の0時。これより前の行をアーカイブする (日単位で切るので日別集計とずれない)。"""
+    from .database import to_epoch_us
+    day = (today or _dt.date.today()) - _dt.timedelta(days=hot_days)
+    return to_epoch_us(_dt.datetime.combine(day, _dt.time()))
+
+
+def _main_path(conn: sqlite3.Connection) -> str:
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == 'main':
+            return path
+    return ''
+
+
+def _schema_name(month: str) -> str:
+    return 'archive_' + month.replace('-', '_')
+
+
+class ArchiveStore:
+    """archive/logs-YYYY-MM.db と、締まった月を圧縮した logs-YYYY-MM.db.zip を管理する。
+
+    圧縮した月を読むときは archive/cache (cache_dir を渡せばそこ) に展開したものを使う。
+    展開物は次のアーカイブ処理で消える。
+    """
+
+    def __init__(self, archive_dir: str, cache_dir: Optional[str] = None):
+        self.archive_dir = archive_dir
+        self.cache_dir = cache_dir or os.path.join(archive_dir, 'cache')
+
+    @classmethod
+    def for_connection(cls, conn: sqlite3.Connection) -> 'ArchiveStore':
+        return cls(os.path.join(os.path.dirname(_main_path(conn)), ARCHIVE_DIR_NAME))
+
+    def db_path(self, month: str) -> str:
+        return os.path.join(self.archive_dir, f"logs-{month}.db")
+
+    def zip_path(self, month: str) -> str:
+        return self.db_path(month) + '.zip'
+
+    def readable_path(self, month: str) -> Optional[str]:
+        """読み取り用に ATTACH できるファイル。圧縮済みなら展開する。"""
+        path = self.db_path(month)
+        if os.path.exists(path):
+            return path
+        cached = os.path.join(self.cache_dir, os.path.basename(path))
+        if os.path.exists(cached):
+            return cached
+        if not os.path.exists(self.zip_path(month)):
+            return None
+        # zip を扱うときだけ読み込む (統計だけを見るコマンドラインの起動を軽くする)
+        import tempfile
+        import zipfile
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # 同時に展開しても壊れたファイルを読まないように、一時ファイル経由で置き換える
+        with zipfile.ZipFile(self.zip_path(month)) as archive:
+            with archive.open(os.path.basename(path)) as src, \
+                    tempfile.NamedTemporaryFile(dir=self.cache_dir, delete=False) as dst:
+                while chunk := src.read(1 << 20):
+                    dst.write(chunk)
+        os.replace(dst.name, cached)
+        return cached
+
+    def compress(self, month: str):
+        path, zip_path = self.db_path(month), self.zip_path(month)
+        tmp_path = zip_path + '.tmp'
+        try:
+            import pyminizip
+            pyminizip.compress(path, None, tmp_path, None, 9)
+        except ImportError:
+            # 同じ zip 形式なので、pyminizip がなければ標準ライブラリで作る
+            import zipfile
+            with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=9) as archive:
+                archive.write(path, os.path.basename(path))
+        os.replace(tmp_path, zip_path)
+        os.remove(path)
+
+    def clear_cache(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+
+
+def archived_months(conn: sqlite3.Connection, start_us: int, end_us: int) -> List[str]:
+    """[start_us, end_us) と重なるアーカイブ済みの月 (古い順)。"""
+    try:
+        return [row[0] for row in conn.execute(_MONTHS_IN_RANGE_SQL, (end_us, start_us))]
+    except sqlite3.OperationalError:
+        # まだマイグレーションしていない DB
+        return []
+
+
+def archived_before_us(conn: sqlite3.Connection) -> Optional[int]:
+    """この時刻 (エポックマイクロ秒) より前の行はアーカイブに移っている。アーカイブがなければ None。"""
+    try:
+        row = conn.execute("SELECT MAX(end_ts) FROM archive_months").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def archived_before_day(conn: sqlite3.Connection) -> Optional[str]:
+    """この日付 (YYYY-MM-DD) より前はアーカイブに移っている。アーカイブがなければ None。"""
+    before_us = archived_before_us(conn)
+    if before_us is None:
+        return None
+    return _dt.datetime.fromtimestamp(before_us / 1_000_000).date().isoformat()
+
+
+@contextmanager
+def attached(conn: sqlite3.Connection, store: ArchiveStore, month: str) -> Iterator[Optional[str]]:
+    """アーカイブの月を読み取り専用で ATTACH し、スキーマ名を返す。"""
+    path = store.readable_path(month)
+    if path is None:
+        yield None
+        return
+    schema = _schema_name(month)
+    # ATTACH したファイルは本体と同じフラグで開かれるので、読み取り専用接続からは読み取り専用になる
+    conn.execute("ATTACH DATABASE ? AS " + schema, (path,))
+    try:
+        yield schema
+    finally:
+        conn.execute("DETACH DATABASE " + schema)
+
+
+def sources(conn: sqlite3.Connection, start_us: int, end_us: int, newest_first: bool = False) -> Iterator[str]:
+    """[start_us, end_us) の行を持つスキーマ名を古い順に返す (最後は本体の 'main')。
+
+    アーカイブは範囲が掛かるときだけ、1つずつ ATTACH しては DETACH する。
+    newest_first なら 'main' から新しい順に返す。
+    """
+    months = archived_months(conn, start_us, end_us)
+    if newest_first:
+        yield 'main'
+        months.reverse()
+    if months:
+        store = ArchiveStore.for_connection(conn)
+        for month in months:
+            with attached(conn, store, month) as schema:
+                if schema:
+                    yield schema
+    if not newest_first:
+        yield 'main'
+
+
+def _move_chunk(conn: sqlite3.Connection, store: ArchiveStore, month: str, end_us: int, chunk: int) -> int:
+    # 月の古い方から最大 chunk 行を1トランザクションで移す。アーカイブへの挿入は冪等なので、途中で落ちても次回やり直せる
+    start_us, month_end_us = month_range_us(month)
+    end_us = min(end_us, month_end_us)
+    os.makedirs(store.archive_dir, exist_ok=True)
+    schema = _schema_name(month)
+    conn.execute("ATTACH DATABASE ? AS " + schema, (store.db_path(month),))
+    try:
+        last = conn.execute(
+            "SELECT ts, id FROM events WHERE ts >= ? AND ts < ? ORDER BY ts, id LIMIT 1 OFFSET ?",
+            (start_us, end_us, chunk - 1)).fetchone()
+        upper = tuple(last) if last else (end_us, 0)
+        # アーカイブは単体で読めるように、logs ビューからアプリ名などを展開した形で持つ
+        with conn:
+            conn.execute(_ARCHIVE_LOGS_SQL.format(db=schema))
+            # 端末名 (merge.py) を持つ前に作ったアーカイブには列を足す
+            if 'host' not in {row[1] for row in conn.execute(f"PRAGMA {schema}.table_info(logs)")}:
+                conn.execute(f"ALTER TABLE {schema}.logs ADD COLUMN host TEXT")
+            conn.execute(_ARCHIVE_INDEX_SQL.format(db=schema))
+            conn.execute(_ARCHIVE_TYPE_INDEX_SQL.format(db=schema))
+            conn.execute(f'''
+                INSERT OR IGNORE INTO {schema}.logs (id, timestamp, ts, event_type, content, host)
+                SELECT id, timestamp, ts, event_type, content, host FROM logs
+                WHERE ts >= ? AND (ts, id) <= (?, ?) AND ts < ?''', (start_us, *upper, end_us))
+            count = conn.execute("DELETE FROM events WHERE ts >= ? AND (ts, id) <= (?, ?) AND ts < ?",
+                                 (start_us, *upper, end_us)).rowcount
+            conn.execute(_UPSERT_MONTH_SQL, (month, start_us, end_us, count))
+    finally:
+        conn.execute("DETACH DATABASE " + schema)
+    return count
+
+
+class ArchivePass:
+    """archive_old_rows を小さな手順に分けたもの。
+
+    move_step() と finish_step() は書き込み接続で False を返すまで1回ずつ呼び、その間に compress() を
+    書き込み接続の外で1回呼ぶ。ライタースレッドではそれぞれを別のタスクにして、間にキャプチャのバッチを書き込む。
+    """
+
+    def __init__(self, hot_days: int, chunk: int = MOVE_CHUNK, today: Optional[_dt.date] = None):
+        self.cutoff = cutoff_us(hot_days, today)
+        self.chunk = chunk
+        self.store: Optional[ArchiveStore] = None
+        self.moved = 0
+        self.months: List[str] = []
+        self._to_compress: List[str] = []
+        self._to_mark: List[str] = []
+        self.compressed = 0
+        self.freed = 0
+
+    def move_step(self, conn: sqlite3.Connection) -> bool:
+        """最も古い1チャンクを移す。まだ移す行があれば True。"""
+        if self.store is None:
+            create_tables(conn)
+            self.store = ArchiveStore.for_connection(conn)
+            self.store.clear_cache()
+        row = conn.execute("SELECT timestamp FROM logs WHERE ts < ? ORDER BY ts LIMIT 1", (self.cutoff,)).fetchone()
+        if row:
+            month = row[0][:7]
+            count = _move_chunk(conn, self.store, month, self.cutoff, self.chunk)
+            if count:
+                self.moved += count
+                if month not in self.months:
+                    self.months.append(month)
+                return True
+            # timestamp と ts の月が食い違う行 (タイムゾーン変更など) で止まらないようにする
+            print(f"Retention: could not archive rows of {month}")
+        # 月末までアーカイブ済みの月は、もう行が増えないので圧縮する
+        self._to_compress = [month for (month,) in conn.execute(
+            "SELECT month FROM archive_months WHERE compressed = 0 ORDER BY month")
+            if month_range_us(month)[1] <= self.cutoff and os.path.exists(self.store.db_path(month))]
+        return False
+
+    def compress(self):
+        """移し終えた月を zip にする。ファイルを読むだけなので、書き込み接続を使わない。"""
+        for month in self._to_compress:
+            try:
+                self.store.compress(month)
+            except OSError as e:
+                print(f"Retention error: could not compress {month}: {e}")
+                continue
+            self._to_mark.append(month)
+
+    def finish_step(self, conn: sqlite3.Connection) -> bool:
+        """圧縮した月を記録し、空いたページを VACUUM_PAGES ずつファイルから切り詰める。まだ切り詰められれば True。"""
+        if self._to_mark:
+            with conn:
+                conn.executemany("UPDATE archive_months SET compressed = 1 WHERE month = ?",
+                                 [(month,) for month in self._to_mark])
+            self.compressed += len(self._to_mark)
+            self._to_mark = []
+        # auto_vacuum=INCREMENTAL なので、空いたページを少しずつ返せる
+        if not self.moved or conn.execute("PRAGMA freelist_count").fetchone()[0] == 0:
+            return False
+        before = conn.execute("PRAGMA page_count").fetchone()[0]
+        conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})").fetchall()
+        after = conn.execute("PRAGMA page_count").fetchone()[0]
+        if after >= before:
+            return False
+        self.freed += before - after
+        return True
+
+    def result(self) -> dict:
+        return {'moved': self.moved, 'months': self.months, 'compressed': self.compressed, 'freed_pages': self.freed}
+
+
+def archive_old_rows(conn: sqlite3.Connection, hot_days: int, chunk: int = MOVE_CHUNK,
+                     today: Optional[_dt.date] = None) -> dict:
+    """hot_days 日より古い行を月ごとのアーカイブに移し、締まった月を圧縮して空き領域を返す。
+
+    書き込み接続から一度に行う。ライタースレッドでは DatabaseManager.archive_old_logs が手順ごとに分けて実行する。
+    """
+    archive = ArchivePass(hot_days, chunk, today)
+    while archive.move_step(conn):
+        pass
+    archive.compress()
+    while archive.finish_step(conn):
+        pass
+    return archive.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move old log rows into monthly archive databases.")
+    parser.add_argument('--db', default=os.path.join(os.path.expanduser('~'), ".activity-logger", "activity.db"))
+    parser.add_argument('--days', type=int, default=90, help="keep this many days in the main database")
+    args = parser.parse_args(argv)
+
+    from .database import DatabaseManager
+    db_manager = DatabaseManager(args.db, write_behind=False)
+    try:
+        result = db_manager.archive_old_logs(args.days)
+    finally:
+        db_manager.close()
+    print(f"Archived {result['moved']} rows ({', '.join(result['months']) or 'none'}); "
+          f"compressed {result['compressed']} months; freed {result['freed_pages']} pages")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,141 @@
+# app/rollups.py
+# ダッシュボード用の集計テーブル (日別・時間別キー数)。アプリ別の時間は intervals.py
+import argparse
+import os
+import sqlite3
+from collections import defaultdict
+
+ROLLUP_TABLES = ('rollup_daily', 'rollup_hourly')
+
+CREATE_SQL = (
+    '''CREATE TABLE IF NOT EXISTS rollup_daily (
+        day TEXT PRIMARY KEY,
+        keystrokes INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS rollup_hourly (
+        day TEXT NOT NULL,
+        hour INTEGER NOT NULL,
+        keystrokes INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, hour)
+    ) WITHOUT ROWID''',
+)
+
+# 生の logs から集計を作り直すクエリ。[ENTER] などの特殊キーは文字数に含めない。
+_SELECT_HOURLY = '''
+    SELECT substr(timestamp, 1, 10) AS day, CAST(substr(timestamp, 12, 2) AS INTEGER) AS hour, SUM(length(content))
+    FROM logs
+    WHERE event_type = 'KEYSTROKE' AND substr(content, 1, 1) <> '['
+    GROUP BY 1, 2
+'''
+# 取り込んだ端末の新しい行だけの時間別キー数
+_SELECT_HOST_HOURLY = '''
+    SELECT substr(timestamp, 1, 10) AS day, CAST(substr(timestamp, 12, 2) AS INTEGER) AS hour, SUM(length(content))
+    FROM logs
+    WHERE id > ? AND host = ? AND event_type = 'KEYSTROKE' AND substr(content, 1, 1) <> '['
+    GROUP BY 1, 2
+'''
+_SELECT_DAILY = '''
+    SELECT day, SUM(keystrokes) FROM rollup_hourly GROUP BY day
+'''
+
+_UPSERT_HOURLY = '''
+    INSERT INTO rollup_hourly (day, hour, keystrokes) VALUES (?, ?, ?)
+    ON CONFLICT (day, hour) DO UPDATE SET keystrokes = keystrokes + excluded.keystrokes
+'''
+_UPSERT_DAILY = '''
+    INSERT INTO rollup_daily (day, keystrokes) VALUES (?, ?)
+    ON CONFLICT (day) DO UPDATE SET keystrokes = keystrokes + excluded.keystrokes
+'''
+
+
+def counts_as_keystrokes(content: str | None) -> bool:
+    return bool(content) and not content.startswith('[')
+
+
+class RollupUpdater:
+    """書き込みバッチごとに集計テーブルへ差分を加算する。ライタースレッド専用。"""
+
+    def apply(self, conn: sqlite3.Connection, rows: list):
+        hourly = defaultdict(int); daily = defaultdict(int)
+        for timestamp, ts, event_type, content in rows:
+            if event_type == 'KEYSTROKE' and counts_as_keystrokes(content):
+                day = timestamp[:10]
+                hourly[(day, int(timestamp[11:13]))] += len(content)
+                daily[day] += len(content)
+        if hourly:
+            conn.executemany(_UPSERT_HOURLY, [(d, h, n) for (d, h), n in hourly.items()])
+            conn.executemany(_UPSERT_DAILY, list(daily.items()))
+
+
+def create_tables(conn: sqlite3.Connection):
+    for sql in CREATE_SQL:
+        conn.execute(sql)
+
+
+def add_host_rows(conn: sqlite3.Connection, host: str, after_id: int):
+    """取り込んだ端末 host の after_id より後の行を集計に足す (呼び出し側でトランザクションを管理する)。"""
+    hourly = conn.execute(_SELECT_HOST_HOURLY, (after_id, host)).fetchall()
+    daily = defaultdict(int)
+    for day, hour, keystrokes in hourly:
+        daily[day] += keystrokes
+    conn.executemany(_UPSERT_HOURLY, hourly)
+    conn.executemany(_UPSERT_DAILY, list(daily.items()))
+
+
+def rebuild(conn: sqlite3.Connection, since_day: str | None = None):
+    """集計テーブルを生の logs から作り直す (呼び出し側でトランザクションを管理する)。
+
+    since_day を指定すると、その日以降だけを作り直す (それより前の行はアーカイブに移っている)。
+    """
+    create_tables(conn)
+    since = since_day or ''
+    for table in ROLLUP_TABLES:
+        conn.execute(f"DELETE FROM {table} WHERE day >= ?", (since,))
+    conn.execute(f"INSERT INTO rollup_hourly (day, hour, keystrokes) SELECT * FROM ({_SELECT_HOURLY}) WHERE day >= ?", (since,))
+    conn.execute(f"INSERT INTO rollup_daily (day, keystrokes) SELECT * FROM ({_SELECT_DAILY}) WHERE day >= ?", (since,))
+
+
+def snapshot(conn: sqlite3.Connection, tables: tuple = ROLLUP_TABLES) -> dict:
+    """集計テーブルの中身を {テーブル: {キー: 値}} にする。"""
+    return {table: {row[:-1]: row[-1] for row in conn.execute(f"SELECT * FROM {table}")} for table in tables}
+
+
+def diff(before: dict, after: dict) -> list:
+    """2つのスナップショットの食い違いを (テーブル, キー, 前, 後) のリストで返す。"""
+    mismatches = []
+    for table in sorted(before.keys() | after.keys()):
+        old, new = before.get(table, {}), after.get(table, {})
+        for key in sorted(old.keys() | new.keys()):
+            if old.get(key, 0) != new.get(key, 0):
+                mismatches.append((table, key, old.get(key), new.get(key)))
+    return mismatches
+
+
+def rebuild_and_verify(conn: sqlite3.Connection, since_day: str | None = None) -> list:
+    """集計を作り直し、逐次更新されていた値との食い違いを返す。"""
+    with conn:
+        before = snapshot(conn)
+        rebuild(conn, since_day)
+        after = snapshot(conn)
+    return diff(before, after)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the dashboard rollup tables from the raw logs table.")
+    parser.add_argument('--db', default=os.path.join(os.path.expanduser('~'), ".activity-logger", "activity.db"))
+    args = parser.parse_args(argv)
+
+    from .database import DatabaseManager
+    db_manager = DatabaseManager(args.db, write_behind=False)
+    try:
+        mismatches = db_manager.rebuild_rollups()
+    finally:
+        db_manager.close()
+    for table, key, old, new in mismatches[:20]:
+        print(f"{table} {key}: incremental={old} rebuilt={new}")
+    print(f"Rollups rebuilt: {len(mismatches)} mismatching rows")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,161 @@
+# app/schema.py
+# PRAGMA user_version によるスキーマのバージョン管理とマイグレーション
+import sqlite3
+
+from . import intervals
+from . import merge
+from . import retention
+from . import rollups
+from . import search
+from . import storage
+
+BACKFILL_CHUNK = 20000
+
+# ISO 形式のローカル時刻 (datetime.isoformat()) をエポックマイクロ秒に変換する SQL 式
+TS_FROM_TIMESTAMP_SQL = (
+    "CAST(strftime('%s', timestamp, 'utc') AS INTEGER) * 1000000"
+    " + CASE WHEN length(timestamp) > 20 THEN CAST(substr(timestamp || '00000', 21, 6) AS INTEGER) ELSE 0 END"
+)
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> set:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _migrate_v1(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            content TEXT
+        )
+    ''')
+    conn.commit()
+
+
+def _migrate_v2(conn: sqlite3.Connection):
+    # 整数のエポックマイクロ秒列を追加し、既存行はチャンク単位で埋める。
+    # チャンク毎にコミットするので、途中で終了しても次回起動時に続きから再開できる。
+    if 'ts' not in _columns(conn, 'logs'):
+        conn.execute("ALTER TABLE logs ADD COLUMN ts INTEGER")
+        conn.commit()
+
+    max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM logs").fetchone()[0]
+    # 直近のデータから埋めて、当日のダッシュボードを先に使えるようにする
+    upper = max_id
+    while upper > 0:
+        lower = max(0, upper - BACKFILL_CHUNK)
+        with conn:
+            conn.execute(f"UPDATE logs SET ts = {TS_FROM_TIMESTAMP_SQL} WHERE id > ? AND id <= ? AND ts IS NULL",
+                         (lower, upper))
+        upper = lower
+
+    with conn:
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_type_ts ON logs (event_type, ts)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_ts ON logs (ts)")
+
+
+def _migrate_v3(conn: sqlite3.Connection):
+    # ダッシュボード用の集計テーブルを作成し、既存データから初期値を作る
+    with conn:
+        rollups.rebuild(conn)
+
+
+def _migrate_v4(conn: sqlite3.Connection):
+    # アーカイブ済みの月の一覧を作る。既存のファイルを auto_vacuum=INCREMENTAL にするには VACUUM で
+    # 全体を書き直す必要があり、起動を長く止めるので、ここでは行わない (python -m app.cli maintain vacuum --full)
+    with conn:
+        retention.create_tables(conn)
+
+
+def _migrate_v5(conn: sqlite3.Connection):
+    # 入力テキストの全文検索索引。既存行はチャンクごとにコミットしながら埋める
+    with conn:
+        search.create_tables(conn, 'logs')
+    search.backfill(conn)
+
+
+def _migrate_v6(conn: sqlite3.Connection):
+    # アプリ別の日次集計はフォーカス区間 (v7 で作る) で置き換える
+    with conn:
+        conn.execute("DROP TABLE IF EXISTS rollup_app_daily")
+
+
+def _migrate_v7(conn: sqlite3.Connection):
+    # アプリ名とイベント種別を辞書テーブルに移し、logs を同じ形のビューにする
+    storage.migrate_logs(conn)
+    with conn:
+        search.create_tables(conn)
+        if 'app' in _columns(conn, 'app_intervals'):
+            # 名前で持っていた区間は、アーカイブ済みの期間も含めてそのまま ID に置き換える
+            for index in ('end', 'start', 'app'):
+                conn.execute(f"DROP INDEX IF EXISTS idx_app_intervals_{index}")
+            conn.execute("ALTER TABLE app_intervals RENAME TO app_intervals_v6")
+            intervals.create_tables(conn)
+            conn.execute("INSERT OR IGNORE INTO apps (name) SELECT DISTINCT app FROM app_intervals_v6")
+            conn.execute('''INSERT INTO app_intervals (id, app_id, start_ts, end_ts)
+                            SELECT i.id, a.id, i.start_ts, i.end_ts
+                            FROM app_intervals_v6 i JOIN apps a ON a.name = i.app''')
+            conn.execute("DROP TABLE app_intervals_v6")
+        else:
+            intervals.rebuild(conn, retention.archived_before_us(conn) or 0)
+    # 元の logs テーブルのページをファイルから切り詰める
+    conn.execute("PRAGMA incremental_vacuum").fetchall()
+
+
+def _migrate_v8(conn: sqlite3.Connection):
+    # 期間ダッシュボード用に、アプリ別のフォーカス時間を時間別・日別に持つ (アーカイブ済みの期間も含む)
+    with conn:
+        intervals.rebuild_rollups(conn)
+
+
+def _migrate_v9(conn: sqlite3.Connection):
+    # 他の端末の DB を取り込めるように、イベントと区間に端末を持たせる (merge.py)。
+    # v7 以降に作ったテーブルには列がすでにある
+    with conn:
+        storage.create_tables(conn)
+        for table, columns in (('events', ('host_id', 'source_id')), ('app_intervals', ('host_id',))):
+            existing = _columns(conn, table)
+            for column in columns:
+                if column not in existing:
+                    references = " REFERENCES hosts (id)" if column == 'host_id' else ""
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER{references}")
+        for sql in storage.HOST_INDEX_SQL + intervals.HOST_INDEX_SQL:
+            conn.execute(sql)
+        conn.execute("DROP VIEW IF EXISTS logs")
+        conn.execute(storage.VIEW_SQL)
+        merge.create_tables(conn)
+
+
+MIGRATIONS = [
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+    _migrate_v4,
+    _migrate_v5,
+    _migrate_v6,
+    _migrate_v7,
+    _migrate_v8,
+    _migrate_v9,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(conn: sqlite3.Connection, target_version: int = SCHEMA_VERSION) -> int:
+    """未適用のマイグレーションを target_version まで順に適用し、最終的なスキーマバージョンを返す。
+
+    target_version を指定すると古いレイアウトの DB を作れる (ベンチマークやマイグレーションの確認用)。
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version == 0 and not conn.execute("SELECT 1 FROM sqlite_master").fetchone():
+        # 新しいファイルは、テーブルを作る前なら VACUUM なしで INCREMENTAL にできる。
+        # アーカイブなどで空いたページを PRAGMA incremental_vacuum で少しずつ返せるようにする
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    for target, step in enumerate(MIGRATIONS[version:target_version], start=version + 1):
+        step(conn)
+        conn.execute(f"PRAGMA user_version = {target}")
+        conn.commit()
+        version = target
+    return version
@@ -0,0 +1,153 @@
+# app/search.py
+# 入力テキスト (KEYSTROKE) の全文検索。FTS5 の trigram トークナイザで部分一致を索引する。
+from __future__ import annotations
+from typing import List, NamedTuple, Optional
+import datetime as _dt
+import html
+import sqlite3
+
+from .rollups import counts_as_keystrokes
+
+BACKFILL_CHUNK = 20000
+# snippet() で一致箇所を囲む文字。表示側で置き換える
+MARK_START, MARK_END = '\x02', '\x03'
+
+CREATE_SQL = (
+    # logs.id を rowid にする。app と ts は絞り込み用で、全文索引には含めない
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        content, app UNINDEXED, ts UNINDEXED, tokenize = 'trigram'
+    )''',
+)
+# アーカイブなどで生ログから消えた行は索引からも消す。索引にない行の削除は何もしない
+_DELETE_TRIGGER_SQL = '''
+    CREATE TRIGGER IF NOT EXISTS {table}_search_delete AFTER DELETE ON {table}
+    BEGIN DELETE FROM search_index WHERE rowid = old.id; END
+'''
+_INSERT_SQL = "INSERT INTO search_index (rowid, content, app, ts) VALUES (?, ?, ?, ?)"
+# 既存行の索引付け。アプリはその時点の直前の APP_SWITCH を (event_type, ts) インデックスで引く
+_BACKFILL_SQL = '''
+    INSERT INTO search_index (rowid, content, app, ts)
+    SELECT k.id, k.content,
+           (SELECT a.content FROM logs a WHERE a.event_type = 'APP_SWITCH' AND a.ts <= k.ts
+            ORDER BY a.ts DESC LIMIT 1),
+           k.ts
+    FROM logs k
+    WHERE k.event_type = 'KEYSTROKE' AND k.id > ? AND k.id <= ? AND substr(k.content, 1, 1) <> '['
+'''
+# 他の端末から取り込んだ行の索引付け。アプリは同じ端末の直前の APP_SWITCH を部分索引 (host_id, type_id, ts) で引く
+_HOST_INDEX_SQL = '''
+    INSERT INTO search_index (rowid, content, app, ts)
+    SELECT k.id, k.content,
+           (SELECT a.name FROM events s JOIN apps a ON a.id = s.app_id
+            WHERE s.host_id = k.host_id AND s.type_id = (SELECT id FROM event_types WHERE name = 'APP_SWITCH')
+              AND s.ts <= k.ts
+            ORDER BY s.ts DESC LIMIT 1),
+           k.ts
+    FROM events k
+    WHERE k.id > ? AND k.host_id = ? AND substr(k.content, 1, 1) <> '['
+      AND k.type_id = (SELECT id FROM event_types WHERE name = 'KEYSTROKE')
+'''
+_SEARCH_SQL = '''
+    SELECT rowid, ts, app, snippet(search_index, 0, ?, ?, '…', 16), bm25(search_index)
+    FROM search_index
+    WHERE search_index MATCH ? AND ts >= ? AND ts < ? {app_filter}
+    ORDER BY rank LIMIT ?
+'''
+# trigram は3文字未満の語を索引できないので、短い語は LIKE で走査して新しい順に返す
+_SCAN_SQL = '''
+    SELECT rowid, ts, app, content, 0.0
+    FROM search_index
+    WHERE content LIKE ? ESCAPE '\\' AND ts >= ? AND ts < ? {app_filter}
+    ORDER BY ts DESC LIMIT ?
+'''
+MIN_MATCH_CHARS = 3
+
+
+class SearchHit(NamedTuple):
+    id: int
+    ts: int
+    app: Optional[str]
+    snippet: str
+    rank: float
+
+    @property
+    def timestamp(self) -> str:
+        return _dt.datetime.fromtimestamp(self.ts / 1_000_000).isoformat(sep=' ', timespec='seconds')
+
+
+class SearchIndexer:
+    """書き込みバッチの KEYSTROKE 行を、そのときのアプリと一緒に索引に加える。ライタースレッド専用。"""
+
+    def __init__(self):
+        self.current_app = None
+
+    def load_state(self, conn: sqlite3.Connection):
+        row = conn.execute("SELECT content FROM logs WHERE event_type = 'APP_SWITCH' AND host IS NULL "
+                           "ORDER BY ts DESC, id DESC LIMIT 1").fetchone()
+        self.current_app = row[0] if row else None
+
+    def apply(self, conn: sqlite3.Connection, rows: list, first_id: int):
+        # 1本の書き込み接続から1トランザクションで挿入するので、行IDは連番になる
+        entries = []
+        for row_id, (timestamp, ts, event_type, content) in enumerate(rows, start=first_id):
+            if event_type == 'APP_SWITCH':
+                self.current_app = content
+            elif event_type == 'KEYSTROKE' and counts_as_keystrokes(content):
+                entries.append((row_id, content, self.current_app, ts))
+        if entries:
+            conn.executemany(_INSERT_SQL, entries)
+
+
+def create_tables(conn: sqlite3.Connection, table: str = 'events'):
+    """索引と、生ログのテーブル table からの削除を索引に反映するトリガーを作る。"""
+    for sql in CREATE_SQL:
+        conn.execute(sql)
+    conn.execute(_DELETE_TRIGGER_SQL.format(table=table))
+
+
+def backfill(conn: sqlite3.Connection, chunk: int = BACKFILL_CHUNK):
+    """既存の KEYSTROKE 行を新しい方からチャンクごとに索引してコミットする。
+
+    索引済みの範囲は連続しているので、中断しても次回は残りから再開する。
+    """
+    lowest = conn.execute("SELECT MIN(rowid) FROM search_index").fetchone()[0]
+    upper = lowest - 1 if lowest is not None else conn.execute("SELECT COALESCE(MAX(id), 0) FROM logs").fetchone()[0]
+    while upper > 0:
+        lower = max(0, upper - chunk)
+        with conn:
+            conn.execute(_BACKFILL_SQL, (lower, upper))
+        upper = lower
+
+
+def index_host_rows(conn: sqlite3.Connection, host_id: int, after_id: int) -> int:
+    """取り込んだ端末 host_id の after_id より後の KEYSTROKE 行を索引に加える (呼び出し側でトランザクションを管理する)。"""
+    return conn.execute(_HOST_INDEX_SQL, (after_id, host_id)).rowcount
+
+
+def search(conn: sqlite3.Connection, query: str, start_us: int = 0, end_us: int = 1 << 62,
+           app: Optional[str] = None, limit: int = 50,
+           markers: tuple = (MARK_START, MARK_END)) -> List[SearchHit]:
+    """query を含む入力を関連度順に返す。[start_us, end_us) とアプリで絞り込める。"""
+    query = query.strip()
+    if not query:
+        return []
+    app_filter = "AND app = ?" if app else ""
+    filters = [start_us, end_us, *([app] if app else []), limit]
+    if len(query) >= MIN_MATCH_CHARS:
+        # 入力全体を1つのフレーズとして扱い、FTS5 の演算子として解釈させない
+        phrase = '"' + query.replace('"', '""') + '"'
+        rows = conn.execute(_SEARCH_SQL.format(app_filter=app_filter), [*markers, phrase, *filters])
+    else:
+        escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        rows = conn.execute(_SCAN_SQL.format(app_filter=app_filter), [f"%{escaped}%", *filters])
+    return [SearchHit(*row) for row in rows]
+
+
+def snippet_html(snippet: str) -> str:
+    """search() の既定の印を <b> に置き換えた HTML。"""
+    return html.escape(snippet).replace(MARK_START, '<b>').replace(MARK_END, '</b>')
+
+
+def search_apps(conn: sqlite3.Connection) -> List[str]:
+    """絞り込みの候補にするアプリ名 (アプリ名の辞書から)。"""
+    return [row[0] for row in conn.execute("SELECT name FROM apps ORDER BY name")]
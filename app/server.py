@@ -0,0 +1,279 @@
+# app/server.py
+# ローカルのクエリサーバー。今のアプリ・今日の合計・期間の集計・最近のイベントを JSON で返す。
+# 既定ではユーザーだけが読み書きできる Unix ソケットで待ち受ける (入力テキストを返すので、他のユーザーや
+# ブラウザのページからは読めないようにする)。ポートを指定したときだけ 127.0.0.1 の TCP で待ち受ける。
+#   curl --unix-socket ~/.activity-logger/server.sock http://localhost/today
+#   python -m app.cli serve --port 8765
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Callable, Optional
+from urllib.parse import parse_qs, urlsplit
+import datetime as _dt
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from . import queries
+from .database import to_epoch_us
+
+DEFAULT_SOCKET = os.path.join(os.path.expanduser('~'), ".activity-logger", "server.sock")
+DEFAULT_TTL_S = 2.0
+DEFAULT_WORKERS = 4
+# 応答を返し終えるまで1つの接続に待つ秒数 (遅いクライアントがスレッドを占有しないように)
+REQUEST_TIMEOUT_S = 5.0
+# /range で受け付ける最長の日数 (トレンドの単位ごと)。長すぎる期間でプールのスレッドを塞がないように
+MAX_RANGE_DAYS = {'hour': 366, 'day': 3660, 'week': 3660, 'month': 3660}
+EVENTS_LIMIT = 50
+MAX_EVENTS_LIMIT = 1000
+# これより多くなったら古い応答を捨てる (from/to を変えながら問い合わせても増え続けないように)
+CACHE_ENTRIES = 256
+
+ENDPOINTS = ('/current', '/today', '/range', '/events')
+
+
+class BadRequest(ValueError):
+    pass
+
+
+class ResponseCache:
+    """応答本文の短時間キャッシュ。ttl 秒経つか、書き込みで世代 (最後のイベント ID) が変わると使わない。"""
+
+    def __init__(self, ttl: float, generation: Callable[[], int]):
+        self.ttl = ttl
+        self._generation = generation
+        self._entries: dict[tuple, tuple[int, float, bytes]] = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def generation(self) -> int:
+        return self._generation()
+
+    def get(self, key: tuple, compute: Callable[[], bytes]) -> tuple[bytes, bool]:
+        """(本文, キャッシュから返したか)。世代はクエリの前に読むので、実行中の書き込みは次の問い合わせで反映される。"""
+        if self.ttl <= 0:
+            return compute(), False
+        generation, now = self.generation(), time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == generation and entry[1] > now:
+                self.hits += 1
+                return entry[2], True
+            self.misses += 1
+        body = compute()
+        with self._lock:
+            if len(self._entries) >= CACHE_ENTRIES:
+                self._entries = {k: v for k, v in self._entries.items() if v[0] == generation and v[1] > now}
+                if len(self._entries) >= CACHE_ENTRIES:
+                    self._entries.clear()
+            self._entries[key] = (generation, now + self.ttl, body)
+        return body, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'ttl_s': self.ttl}
+
+
+class _PooledMixIn:
+    # 固定数のスレッドで処理する。ThreadingMixIn のようにリクエストごとにスレッドを作ると、
+    # スレッドごとの読み取り接続 (ReadConnectionPool) を毎回開き直すことになる
+    executor: ThreadPoolExecutor
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class _TCPServer(_PooledMixIn, HTTPServer):
+    pass
+
+
+class _UnixServer(_PooledMixIn, socketserver.UnixStreamServer):
+
+    def server_bind(self):
+        # 作った瞬間から所有者だけが接続できるようにする
+        old_umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(old_umask)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    timeout = REQUEST_TIMEOUT_S
+    server_version = "ActivityLogger"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        path = url.path.rstrip('/') or '/'
+        server: QueryServer = self.server.query_server
+        if path == '/':
+            return self._send(HTTPStatus.OK, server.index())
+        if path not in ENDPOINTS:
+            return self._send(HTTPStatus.NOT_FOUND, {'error': f"unknown endpoint: {url.path}", 'endpoints': ENDPOINTS})
+        try:
+            body, hit = server.respond(path, params)
+        except BadRequest as e:
+            return self._send(HTTPStatus.BAD_REQUEST, {'error': str(e)})
+        except Exception as e:
+            print(f"Query server error: {e}")
+            return self._send(HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)})
+        self._send(HTTPStatus.OK, body, 'hit' if hit else 'miss')
+
+    def _send(self, status: HTTPStatus, body, cache: Optional[str] = None):
+        if not isinstance(body, bytes):
+            body = _encode(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        if cache:
+            self.send_header('X-Cache', cache)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # アクセスログは出さない (Unix ソケットでは client_address が文字列で、既定の書式では出せない)
+        pass
+
+
+def _encode(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False).encode('utf-8')
+
+
+def _date(text: str) -> _dt.date:
+    try:
+        return _dt.date.fromisoformat(text)
+    except ValueError:
+        raise BadRequest(f"invalid date: {text} (expected YYYY-MM-DD)")
+
+
+def _selected_range(params: dict, today: _dt.date) -> tuple[_dt.date, _dt.date]:
+    # cli と同じく from/to があればその日付 (両端を含む)、なければ range の今日までの期間
+    if params.get('from') or params.get('to'):
+        start = _date(params['from']) if params.get('from') else None
+        last = _date(params['to']) if params.get('to') else today
+        start, last = sorted((start or last, last))
+        return start, last + _dt.timedelta(days=1)
+    name = params.get('range', 'week')
+    if name not in queries.DASHBOARD_RANGES:
+        raise BadRequest(f"range must be one of {', '.join(queries.DASHBOARD_RANGES)}")
+    return queries.preset_range(name, today)
+
+
+class QueryServer:
+    """DatabaseManager の読み取り接続で問い合わせに答えるサーバー。start() で専用スレッドで待ち受ける。"""
+
+    def __init__(self, db_manager, socket_path: Optional[str] = None, port: int = 0, ttl: float = DEFAULT_TTL_S,
+                 workers: int = DEFAULT_WORKERS, generation: Optional[Callable[[], int]] = None):
+        self.db_manager = db_manager
+        self.port = port
+        self.workers = workers
+        self.socket_path = None if port else (socket_path or DEFAULT_SOCKET)
+        # 既定の世代はライターが最後にコミットした行の ID (同じプロセスで書いているとき)
+        self.cache = ResponseCache(ttl, generation or (lambda: db_manager.last_row_id))
+        self._routes = {'/current': self._current, '/today': self._today, '/range': self._range, '/events': self._events}
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def address(self) -> str:
+        return self.socket_path or f"http://127.0.0.1:{self._httpd.server_address[1] if self._httpd else self.port}"
+
+    def start(self):
+        if self.socket_path:
+            os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+            _remove_stale_socket(self.socket_path)
+            httpd = _UnixServer(self.socket_path, _Handler)
+        else:
+            httpd = _TCPServer(('127.0.0.1', self.port), _Handler)
+        httpd.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='query-server')
+        httpd.query_server = self
+        self._httpd = httpd
+        self._thread = threading.Thread(target=httpd.serve_forever, name='query-server', daemon=True)
+        self._thread.start()
+
+    def wait(self):
+        """close() されるまで待つ (python -m app.cli serve 用)。"""
+        self._thread.join()
+
+    def close(self):
+        if self._httpd is None:
+            return
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._httpd.executor.shutdown(wait=True)
+        self._httpd = None
+        if self.socket_path:
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+    def respond(self, path: str, params: dict) -> tuple[bytes, bool]:
+        """ENDPOINTS のいずれかへの応答の (本文, キャッシュから返したか)。引数の誤りは BadRequest。"""
+        handler = self._routes[path]
+        key = (path, tuple(sorted(params.items())))
+        return self.cache.get(key, lambda: _encode(handler(self.db_manager.reader(), params)))
+
+    def index(self) -> dict:
+        return {'endpoints': ENDPOINTS, 'last_row_id': self.cache.generation(), 'cache': self.cache.stats()}
+
+    def _current(self, conn, params) -> dict:
+        now = _dt.datetime.now()
+        row = queries.current_app(conn)
+        if not row:
+            return {'app': None, 'since': None, 'seconds': 0}
+        app, start_ts = row
+        since = _dt.datetime.fromtimestamp(start_ts / 1_000_000)
+        return {'app': app, 'since': since.isoformat(), 'seconds': round(max(0, to_epoch_us(now) - start_ts) / 1_000_000, 3)}
+
+    def _today(self, conn, params) -> dict:
+        today = _dt.date.today()
+        return queries.range_summary(conn, today, today + _dt.timedelta(days=1)).to_json(trend=False)
+
+    def _range(self, conn, params) -> dict:
+        bucket = params.get('bucket')
+        if bucket is not None and bucket not in queries.BUCKETS:
+            raise BadRequest(f"bucket must be one of {', '.join(queries.BUCKETS)}")
+        start, end = _selected_range(params, _dt.date.today())
+        bucket = bucket or queries.bucket_for(start, end)
+        if (end - start).days > MAX_RANGE_DAYS[bucket]:
+            raise BadRequest(f"range too long for bucket={bucket} (at most {MAX_RANGE_DAYS[bucket]} days)")
+        return queries.range_summary(conn, start, end, bucket).to_json()
+
+    def _events(self, conn, params) -> list:
+        try:
+            limit = int(params.get('limit', EVENTS_LIMIT))
+        except ValueError:
+            raise BadRequest("limit must be an integer")
+        limit = max(1, min(limit, MAX_EVENTS_LIMIT))
+        return [event._asdict() for event in queries.events_before(conn, to_epoch_us(_dt.datetime.now()), sys.maxsize, limit)]
+
+
+def _remove_stale_socket(path: str):
+    # 前回の終了で残ったソケットは消す。まだ応答するなら別のプロセスが使っている
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+    else:
+        raise OSError(f"query server already running at {path}")
+    finally:
+        probe.close()
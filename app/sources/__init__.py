@@ -0,0 +1,21 @@
+# app/sources/__init__.py
+# キャプチャ元 (CaptureSource) の実装。macOS 以外でも synthetic / replay で動作確認できる。
+from __future__ import annotations
+
+from ..capture import CaptureSource
+
+SOURCE_NAMES = ('macos', 'synthetic', 'replay')
+
+
+def create_source(name: str = 'macos', **options) -> CaptureSource:
+    """名前からキャプチャ元を作る。プラットフォーム固有のモジュールは必要になるまで読み込まない。"""
+    if name == 'macos':
+        from .macos import QuartzEventSource
+        return QuartzEventSource(**options)
+    if name == 'synthetic':
+        from .synthetic import SyntheticSource
+        return SyntheticSource(**options)
+    if name == 'replay':
+        from .replay import ReplaySource
+        return ReplaySource(**options)
+    raise ValueError(f"Unknown capture source: {name}")
@@ -0,0 +1,110 @@
+# app/sources/macos.py
+# Quartz のイベントタップと NSWorkspace の通知を使う macOS 用のキャプチャ元
+
+from __future__ import annotations
+import time
+
+import objc
+from Cocoa import NSObject, NSWorkspace, NSWorkspaceDidActivateApplicationNotification
+from Quartz import (
+    CGEventTapCreate, CGEventTapEnable, CGEventKeyboardGetUnicodeString,
+    CGEventGetIntegerValueField, CFMachPortCreateRunLoopSource,
+    CFRunLoopAddSource, CFRunLoopRemoveSource, CFRunLoopGetCurrent,
+    CFRunLoopRun, CFRunLoopStop, kCGSessionEventTap,
+    kCGHeadInsertEventTap, kCGEventTapOptionDefault, kCGEventKeyDown,
+    kCGEventFlagsChanged, kCGKeyboardEventKeycode, kCFRunLoopCommonModes,
+    kCGEventTapDisabledByTimeout, kCGEventTapDisabledByUserInput
+)
+
+from ..capture import APP, KEY, CaptureSource, Emit
+
+
+def keyboard_cb(proxy, etype, event, source):
+    # キャプチャスレッド上で呼ばれる。遅いとタップが無効化されるので、
+    # キーコードと文字を取り出してリングバッファに記録するだけにする
+    started_ns = time.perf_counter_ns()
+    if etype in (kCGEventTapDisabledByTimeout, kCGEventTapDisabledByUserInput):
+        source.reenable()
+        return event
+    if etype != kCGEventKeyDown:
+        return event
+
+    _, text = CGEventKeyboardGetUnicodeString(event, 1, None, None)
+    keycode = CGEventGetIntegerValueField(event, kCGKeyboardEventKeycode)
+    source.emit(KEY, keycode, text, started_ns)
+    return event
+
+class AppObserver(NSObject):
+    def initWithPost_(self, post):
+        self = objc.super(AppObserver, self).init()
+        if self is None: return None
+        self.post = post
+        return self
+
+    def didActivateApp_(self, notification):
+        # メインスレッドで呼ばれるので、リングバッファではなく post() で渡す
+        app_name = notification.userInfo()["NSWorkspaceApplicationKey"].localizedName()
+        self.post(APP, app_name)
+
+class QuartzEventSource(CaptureSource):
+    """Quartz のイベントタップと NSWorkspace の通知を使う macOS 用のキャプチャ元。"""
+
+    def __init__(self):
+        self.event_tap = None
+        self.run_loop = None
+        self.app_observer = None
+        self.emit: Emit | None = None
+        self.is_paused = False
+        self._stop_requested = False
+
+    def open(self, emit: Emit, post: Emit) -> bool:
+        mask = (1 << kCGEventKeyDown) | (1 << kCGEventFlagsChanged)
+        self.event_tap = CGEventTapCreate(kCGSessionEventTap, kCGHeadInsertEventTap,
+                                          kCGEventTapOptionDefault, mask, keyboard_cb, self)
+        if not self.event_tap: return False
+        self.emit = emit
+        self.is_paused = False
+        self._stop_requested = False
+
+        # アプリ切り替えの通知はメインスレッドの run loop に届くので、ここで登録しておく
+        self.app_observer = AppObserver.alloc().initWithPost_(post)
+        nc = NSWorkspace.sharedWorkspace().notificationCenter()
+        nc.addObserver_selector_name_object_(self.app_observer,
+                                             objc.selector(self.app_observer.didActivateApp_, signature=b"v@:@"),
+                                             NSWorkspaceDidActivateApplicationNotification, None)
+        return True
+
+    def run(self, emit: Emit):
+        # キャプチャスレッド自身の run loop でタップを待ち受ける。イベントが来るまでブロックする
+        self.run_loop = CFRunLoopGetCurrent()
+        run_loop_source = CFMachPortCreateRunLoopSource(None, self.event_tap, 0)
+        CFRunLoopAddSource(self.run_loop, run_loop_source, kCFRunLoopCommonModes)
+        CGEventTapEnable(self.event_tap, not self.is_paused)
+        if not self._stop_requested:
+            CFRunLoopRun()
+        CGEventTapEnable(self.event_tap, False)
+        CFRunLoopRemoveSource(self.run_loop, run_loop_source, kCFRunLoopCommonModes)
+        self.run_loop = None
+
+    def reenable(self):
+        # 応答が遅れてタップが無効化された場合に再度有効にする
+        if self.event_tap and not self.is_paused:
+            CGEventTapEnable(self.event_tap, True)
+
+    def stop(self):
+        self._stop_requested = True
+        if self.run_loop:
+            CFRunLoopStop(self.run_loop)
+
+    def set_paused(self, paused: bool):
+        # 無効化したタップにはコールバックが来ないので、一時停止中は CPU を使わない
+        self.is_paused = paused
+        if self.event_tap:
+            CGEventTapEnable(self.event_tap, not paused)
+
+    def close(self):
+        if self.app_observer:
+            NSWorkspace.sharedWorkspace().notificationCenter().removeObserver_(self.app_observer)
+            self.app_observer = None
+        self.event_tap = None
+        self.emit = None
@@ -0,0 +1,99 @@
+# app/sources/replay.py
+# 既存の activity.db や JSONL トレースを元の間隔 (または N 倍速) で再生するキャプチャ元
+from __future__ import annotations
+from typing import Iterator, Tuple
+import datetime as _dt
+import json
+import pathlib
+import sqlite3
+import time
+
+from ..capture import (APP, KEY, KEYCODE_DELETE, KEYCODE_RETURN, KEYCODE_SPACE,
+                       Emit, PacedSource)
+
+# (経過秒, 種別, 引数)
+TimedEvent = Tuple[float, str, tuple]
+
+
+def _log_row_to_events(seconds: float, event_type: str, content: str) -> Iterator[TimedEvent]:
+    """logs の1行 (入力チャンク) を、それを生んだはずの生イベント列に戻す。"""
+    if event_type == 'APP_SWITCH':
+        yield seconds, APP, (content,)
+    elif event_type == 'KEYSTROKE':
+        if content == '[ENTER]':
+            yield seconds, KEY, (KEYCODE_RETURN, "\r")
+        elif content == '[BACKSPACE]':
+            yield seconds, KEY, (KEYCODE_DELETE, "\x7f")
+        else:
+            for char in content or '':
+                yield seconds, KEY, (KEYCODE_SPACE, " ") if char == " " else (0, char)
+
+
+def _iter_database(path: str) -> Iterator[TimedEvent]:
+    uri = pathlib.Path(path).resolve().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True)
+    try:
+        for timestamp, event_type, content in conn.execute(
+                "SELECT timestamp, event_type, content FROM logs ORDER BY id"):
+            yield from _log_row_to_events(_dt.datetime.fromisoformat(timestamp).timestamp(), event_type, content)
+    finally:
+        conn.close()
+
+
+def _iter_jsonl(path: str) -> Iterator[TimedEvent]:
+    # 1行1イベント。logs と同じ形 ({"timestamp", "event_type", "content"}) か、
+    # 生イベント ({"t": 秒, "kind": "KEY", "keycode", "text"} / {"t", "kind": "APP", "app"}) を受け付ける
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'event_type' in record:
+                seconds = record['ts'] / 1_000_000 if 'ts' in record else \
+                    _dt.datetime.fromisoformat(record['timestamp']).timestamp()
+                yield from _log_row_to_events(seconds, record['event_type'], record.get('content', ''))
+            elif record.get('kind') == APP:
+                yield float(record['t']), APP, (record['app'],)
+            elif record.get('kind') == KEY:
+                yield float(record['t']), KEY, (int(record.get('keycode', 0)), record.get('text', ''))
+
+
+class ReplaySource(PacedSource):
+    """記録済みのイベントを speed 倍速で再生する。speed=0 なら待たずに最大速度で流す。
+
+    max_gap 秒を超える空白 (夜間など) は max_gap に詰めて再生する。
+    """
+
+    def __init__(self, path: str, speed: float = 1.0, max_gap: float | None = 5.0, loop: bool = False):
+        super().__init__()
+        self.path = path
+        self.speed = speed
+        self.max_gap = max_gap
+        self.loop = loop
+        self.emitted = 0
+
+    def events(self) -> Iterator[TimedEvent]:
+        if self.path.endswith(('.jsonl', '.json')):
+            return _iter_jsonl(self.path)
+        return _iter_database(self.path)
+
+    def run(self, emit: Emit):
+        while True:
+            if not self._play_once(emit) or not self.loop:
+                return
+
+    def _play_once(self, emit: Emit) -> bool:
+        deadline = time.monotonic()
+        previous = None
+        for seconds, kind, args in self.events():
+            if self.speed > 0 and previous is not None:
+                gap = max(0.0, seconds - previous)
+                if self.max_gap is not None:
+                    gap = min(gap, self.max_gap)
+                deadline += gap / self.speed
+            previous = seconds
+            if not self.wait_until(deadline):
+                return False
+            emit(kind, *args)
+            self.emitted += 1
+        return True
@@ -0,0 +1,65 @@
+# app/sources/synthetic.py
+# 指定したレートでキー入力とアプリ切り替えを生成する負荷試験用のキャプチャ元
+from __future__ import annotations
+from typing import Sequence
+import random
+import string
+import time
+
+from ..capture import (APP, KEY, KEYCODE_DELETE, KEYCODE_RETURN, KEYCODE_SPACE,
+                       Emit, PacedSource)
+
+DEFAULT_APPS = ('Safari', 'Terminal', 'Code', 'Slack', 'Mail')
+
+
+class SyntheticSource(PacedSource):
+    """keys_per_second で打鍵し、app_switches_per_minute でアプリを切り替える。
+
+    keys_per_second=0 のときは待たずに最大速度で生成する。max_events を指定すると
+    その数を送った時点で終了する。
+    """
+
+    def __init__(self, keys_per_second: float = 8.0, app_switches_per_minute: float = 2.0,
+                 apps: Sequence[str] = DEFAULT_APPS, max_events: int | None = None,
+                 enter_ratio: float = 0.02, backspace_ratio: float = 0.03, space_ratio: float = 0.15,
+                 seed: int | None = None):
+        super().__init__()
+        self.keys_per_second = keys_per_second
+        self.app_switches_per_minute = app_switches_per_minute
+        self.apps = list(apps)
+        self.max_events = max_events
+        self.enter_ratio = enter_ratio
+        self.backspace_ratio = backspace_ratio
+        self.space_ratio = space_ratio
+        self.rng = random.Random(seed)
+        self.emitted = 0
+
+    def _next_key(self) -> tuple:
+        roll = self.rng.random()
+        if roll < self.enter_ratio:
+            return KEYCODE_RETURN, "\r"
+        roll -= self.enter_ratio
+        if roll < self.backspace_ratio:
+            return KEYCODE_DELETE, "\x7f"
+        roll -= self.backspace_ratio
+        if roll < self.space_ratio:
+            return KEYCODE_SPACE, " "
+        return 0, self.rng.choice(string.ascii_lowercase)
+
+    def run(self, emit: Emit):
+        unlimited = self.keys_per_second <= 0
+        key_interval = 0.0 if unlimited else 1.0 / self.keys_per_second
+        # 1打鍵あたりのアプリ切り替え確率 (最大速度のときは 8 打鍵/秒相当で換算する)
+        keys_per_minute = 60.0 * (self.keys_per_second if not unlimited else 8.0)
+        switch_probability = min(1.0, self.app_switches_per_minute / keys_per_minute)
+
+        deadline = time.monotonic()
+        while self.max_events is None or self.emitted < self.max_events:
+            deadline += key_interval
+            if not self.wait_until(deadline):
+                return
+            if self.apps and self.rng.random() < switch_probability:
+                emit(APP, self.rng.choice(self.apps))
+            else:
+                emit(KEY, *self._next_key())
+            self.emitted += 1
@@ -0,0 +1,142 @@
+# app/storage.py
+# 正規化したイベントの保存形式。アプリ名とイベント種別は辞書テーブルに1度だけ持ち、
+# events からは小さな整数IDで参照する。外部のビューアには従来の形の logs ビューを見せる。
+# 他の端末から取り込んだ行 (merge.py) は host_id でその端末を指す。この端末で記録した行は NULL。
+from __future__ import annotations
+from collections import OrderedDict
+import sqlite3
+
+# プロセス内に持つ 名前 → ID の数。アプリの切り替えは数十種類程度なので十分に収まる
+INTERN_CACHE_SIZE = 1024
+MIGRATE_CHUNK = 20000
+
+DICTIONARY_TABLES = ('event_types', 'apps', 'hosts')
+
+CREATE_SQL = (
+    '''CREATE TABLE IF NOT EXISTS event_types (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    )''',
+    '''CREATE TABLE IF NOT EXISTS apps (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    )''',
+    '''CREATE TABLE IF NOT EXISTS hosts (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    )''',
+    # APP_SWITCH は app_id だけ、それ以外は content だけを持つ。時刻は ts (エポックマイクロ秒) のみ。
+    # 取り込んだ行は host_id と取り込み元での id (source_id) を持つ
+    '''CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts INTEGER NOT NULL,
+        type_id INTEGER NOT NULL REFERENCES event_types (id),
+        app_id INTEGER REFERENCES apps (id),
+        content TEXT,
+        host_id INTEGER REFERENCES hosts (id),
+        source_id INTEGER
+    )''',
+    "CREATE INDEX IF NOT EXISTS idx_events_ts ON events (ts)",
+    "CREATE INDEX IF NOT EXISTS idx_events_type_ts ON events (type_id, ts)",
+)
+# host_id の列ができてから (v9) 作る索引。この端末の行は載らない部分索引にする:
+#   - (host_id, source_id) の一意制約で、同じ行を2回取り込んでも INSERT OR IGNORE で無視される
+#   - (host_id, type_id, ts) で、取り込んだ入力の直前の APP_SWITCH を端末ごとに引く
+HOST_INDEX_SQL = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_events_source ON events (host_id, source_id) WHERE host_id IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_events_host_type_ts ON events (host_id, type_id, ts) WHERE host_id IS NOT NULL",
+)
+
+# ts をローカル時刻の datetime.isoformat() と同じ文字列に戻す SQL 式
+TIMESTAMP_FROM_TS_SQL = (
+    "strftime('%Y-%m-%dT%H:%M:%S', e.ts / 1000000, 'unixepoch', 'localtime')"
+    " || CASE WHEN e.ts % 1000000 THEN printf('.%06d', e.ts % 1000000) ELSE '' END"
+)
+# 従来の logs (id, timestamp, ts, event_type, content) と同じ形の読み取り専用ビュー。
+# 末尾の host は取り込んだ行の端末名 (この端末の行は NULL)
+VIEW_SQL = f'''
+    CREATE VIEW IF NOT EXISTS logs AS
+    SELECT e.id AS id, {TIMESTAMP_FROM_TS_SQL} AS timestamp, e.ts AS ts,
+           t.name AS event_type, COALESCE(a.name, e.content) AS content, h.name AS host
+    FROM events e
+    JOIN event_types t ON t.id = e.type_id
+    LEFT JOIN apps a ON a.id = e.app_id
+    LEFT JOIN hosts h ON h.id = e.host_id
+'''
+
+_COPY_SQL = '''
+    INSERT INTO events (id, ts, type_id, app_id, content)
+    SELECT l.id, l.ts, t.id, a.id, CASE WHEN a.id IS NULL THEN l.content END
+    FROM logs_v6 l
+    JOIN event_types t ON t.name = l.event_type
+    LEFT JOIN apps a ON l.event_type = 'APP_SWITCH' AND a.name = l.content
+    WHERE l.id > ? AND l.id <= ?
+'''
+
+
+class NameInterner:
+    """名前を辞書テーブルのIDに変換する。直近に使った名前は LRU に持ち、DB を引かない。
+
+    ライタースレッド専用。新しい名前は書き込み中のトランザクションで登録するので、
+    ロールバックしたら clear() でキャッシュを捨てる。
+    """
+
+    def __init__(self, table: str, capacity: int = INTERN_CACHE_SIZE):
+        self.capacity = capacity
+        self._cache: OrderedDict[str, int] = OrderedDict()
+        self._insert_sql = f"INSERT OR IGNORE INTO {table} (name) VALUES (?)"
+        self._select_sql = f"SELECT id FROM {table} WHERE name = ?"
+
+    def id(self, conn: sqlite3.Connection, name: str) -> int:
+        row_id = self._cache.get(name)
+        if row_id is not None:
+            self._cache.move_to_end(name)
+            return row_id
+        conn.execute(self._insert_sql, (name,))
+        row_id = conn.execute(self._select_sql, (name,)).fetchone()[0]
+        self._cache[name] = row_id
+        if len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+        return row_id
+
+    def clear(self):
+        self._cache.clear()
+
+
+def create_tables(conn: sqlite3.Connection):
+    for sql in CREATE_SQL:
+        conn.execute(sql)
+
+
+def _table_exists(conn: sqlite3.Connection, name: str) -> bool:
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+    return row is not None
+
+
+def migrate_logs(conn: sqlite3.Connection, chunk: int = MIGRATE_CHUNK):
+    """従来の logs テーブルを events と辞書テーブルに移し、logs をビューに置き換える。
+
+    チャンクごとにコミットするので、途中で終了しても次回は続きから再開する。
+    """
+    with conn:
+        create_tables(conn)
+        if _table_exists(conn, 'logs'):
+            # 索引と削除トリガーは古いテーブルと一緒に消す
+            conn.execute("DROP TRIGGER IF EXISTS logs_search_delete")
+            conn.execute("ALTER TABLE logs RENAME TO logs_v6")
+    if not _table_exists(conn, 'logs_v6'):
+        return
+    with conn:
+        conn.execute("INSERT OR IGNORE INTO event_types (name) SELECT DISTINCT event_type FROM logs_v6")
+        conn.execute("INSERT OR IGNORE INTO apps (name) SELECT DISTINCT content FROM logs_v6 "
+                     "WHERE event_type = 'APP_SWITCH' AND content IS NOT NULL")
+    lower = conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+    max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM logs_v6").fetchone()[0]
+    while lower < max_id:
+        upper = min(max_id, lower + chunk)
+        with conn:
+            conn.execute(_COPY_SQL, (lower, upper))
+        lower = upper
+    with conn:
+        conn.execute("DROP TABLE logs_v6")
+        conn.execute(VIEW_SQL)
@@ -0,0 +1,126 @@
+# app/workers.py
+# GUI スレッドを止めないための QThreadPool 用バックグラウンドタスク
+from __future__ import annotations
+from typing import Callable
+import datetime as _dt
+import sqlite3
+
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+
+from . import export
+from . import queries
+from . import search
+from .database import DatabaseManager
+
+
+class TaskSignals(QObject):
+    finished = pyqtSignal(int, object, object)
+    failed = pyqtSignal(int, str)
+
+
+class ExportSignals(QObject):
+    progress = pyqtSignal(int, float)
+    finished = pyqtSignal(str, int)
+    failed = pyqtSignal(str)
+
+
+class DashboardRefreshTask(QRunnable):
+    """ダッシュボードの期間 [start, end) の集計を読み取り接続で計算し、結果をシグナルで GUI スレッドに返す。
+
+    is_current(generation) が False を返すようになったら (新しい要求が来たら)、
+    実行中のクエリも progress handler 経由で中断して結果を捨てる。
+    """
+
+    def __init__(self, db_manager: DatabaseManager, start: _dt.date, end: _dt.date, generation: int, cache_key,
+                 is_current: Callable[[int], bool]):
+        super().__init__()
+        self.db_manager = db_manager
+        self.start = start
+        self.end = end
+        self.generation = generation
+        self.cache_key = cache_key
+        self.is_current = is_current
+        self.signals = TaskSignals()
+
+    def cancelled(self) -> bool:
+        return not self.is_current(self.generation)
+
+    def run(self):
+        if self.cancelled():
+            return
+        conn = self.db_manager.reader()
+        conn.set_progress_handler(self.cancelled, 1000)
+        try:
+            summary = queries.range_summary(conn, self.start, self.end)
+        except sqlite3.Error as e:
+            if not self.cancelled():
+                self.signals.failed.emit(self.generation, str(e))
+            return
+        finally:
+            conn.set_progress_handler(None, 0)
+        if not self.cancelled():
+            self.signals.finished.emit(self.generation, self.cache_key, summary)
+
+
+class SearchTask(QRunnable):
+    """全文検索を読み取り接続で実行し、結果を finished(generation, query, hits) で返す。"""
+
+    def __init__(self, db_manager: DatabaseManager, query: str, start_us: int, end_us: int, app: str | None,
+                 generation: int, is_current: Callable[[int], bool], limit: int = 100):
+        super().__init__()
+        self.db_manager = db_manager
+        self.query = query
+        self.start_us = start_us
+        self.end_us = end_us
+        self.app = app
+        self.generation = generation
+        self.is_current = is_current
+        self.limit = limit
+        self.signals = TaskSignals()
+
+    def cancelled(self) -> bool:
+        return not self.is_current(self.generation)
+
+    def run(self):
+        if self.cancelled():
+            return
+        conn = self.db_manager.reader()
+        conn.set_progress_handler(self.cancelled, 1000)
+        try:
+            hits = search.search(conn, self.query, self.start_us, self.end_us, self.app, self.limit)
+        except sqlite3.Error as e:
+            if not self.cancelled():
+                self.signals.failed.emit(self.generation, str(e))
+            return
+        finally:
+            conn.set_progress_handler(None, 0)
+        if not self.cancelled():
+            self.signals.finished.emit(self.generation, self.query, hits)
+
+
+class ExportTask(QRunnable):
+    """export.export() を読み取り接続で実行し、進捗と結果をシグナルで返す。cancel() で中断する。"""
+
+    def __init__(self, db_manager: DatabaseManager, path: str, start: _dt.date, end: _dt.date, kind: str):
+        super().__init__()
+        self.db_manager = db_manager
+        self.path = path
+        self.start = start
+        self.end = end
+        self.kind = kind
+        self._cancelled = False
+        self.signals = ExportSignals()
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        try:
+            rows = export.export(self.db_manager.reader(), self.path, self.start, self.end, self.kind,
+                                 progress=self.signals.progress.emit, cancelled=lambda: self._cancelled)
+        except export.ExportCancelled:
+            return
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(self.path, rows)
@@ -23,8 +23,8 @@ a = Analysis(
     ['app/main.py'],
     pathex=[],
     binaries=[],
-    datas=[('asset/icon.svg', 'asset')],
-    hiddenimports=['objc', 'sqlite3', 'pyminizip','PyQt5.QtWebEngineWidgets'],
+    datas=[('asset/icon.svg', 'asset'), ('asset/dashboard.html', 'asset'), ('asset/chart.min.js', 'asset')],
+    hiddenimports=['objc', 'sqlite3', 'pyminizip','PyQt5.QtWebEngineWidgets', 'numpy'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -4,11 +4,12 @@ import sys
 import os
 import subprocess
 import shutil
+import tempfile
 
 from PyQt5.QtWidgets import QApplication
-from PyQt5.QtSvg import QSvgRenderer
-from PyQt5.QtGui import QPixmap, QPainter
-from PyQt5.QtCore import Qt, QSize
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.icon_cache import IconCache
 
 def create_icns_from_svg(svg_path, output_icns_path):
     """
@@ -23,8 +24,8 @@ def create_icns_from_svg(svg_path, output_icns_path):
     print(f"作業ディレクトリ '{iconset_dir}' を作成しました。")
 
     # SVGファイルを読み込む
-    with open(svg_path, 'r') as f:
-        svg_data = f.read().encode('utf-8')
+    with open(svg_path, 'r', encoding='utf-8') as f:
+        svg_data = f.read()
 
     # 必要なアイコンサイズ
     sizes = {
@@ -37,20 +38,15 @@ def create_icns_from_svg(svg_path, output_icns_path):
 
     # PyQtアプリケーションのインスタンス（描画処理に必要）
     app = QApplication.instance() or QApplication(sys.argv)
-    renderer = QSvgRenderer(svg_data)
-
-    # 各サイズのPNG画像を生成
-    for filename, size in sizes.items():
-        pixmap = QPixmap(QSize(size, size))
-        pixmap.fill(Qt.transparent)
-
-        painter = QPainter(pixmap)
-        renderer.render(painter)
-        painter.end()
 
-        output_path = os.path.join(iconset_dir, filename)
-        pixmap.save(output_path, "PNG")
-        print(f"'{output_path}' を生成しました。")
+    # 各サイズのPNG画像を生成 (同じサイズは1回だけ描画する)。キャッシュはビルドの間だけの一時ディレクトリに置き、
+    # 開発者の ~/.activity-logger/icon-cache には書き込まない
+    with tempfile.TemporaryDirectory(prefix="icon-cache-") as cache_dir:
+        icon_cache = IconCache(svg_data, cache_dir)
+        for filename, size in sizes.items():
+            output_path = os.path.join(iconset_dir, filename)
+            shutil.copyfile(icon_cache.png_path(None, size), output_path)
+            print(f"'{output_path}' を生成しました。")
 
     # iconutilコマンドで.icnsファイルを生成
     print(f"'{iconset_dir}' から '{output_icns_path}' を生成します...")